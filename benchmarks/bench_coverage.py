@@ -0,0 +1,108 @@
+"""
+Benchmark of flight.coverage search generation against the complexity of the area
+searched, from a plain polygon to wavy ones drawn with thousands of vertices. Each area
+is turned into a simplified boustrophedon path and then into the mission items uploaded.
+"""
+import argparse
+import math
+import timeit
+
+import numpy as np
+import numpy.typing as npt
+from shapely.geometry import Polygon
+
+from flight import coverage, geo, upload_mission
+
+FIELD_RADIUS: float = 250.0  # Meters, mean radius of the generated areas
+ROUGHNESS: float = 0.15  # Fraction of the radius the boundary of the areas wanders by
+HARMONICS: int = 8  # Waves of the boundary around the area, the outline of a real field
+
+
+def jagged_area(vertices: int, rng: np.random.Generator) -> Polygon:
+    """
+    Returns a star-shaped area with a boundary wandering around a circle in a few
+    random waves, drawn with a number of vertices
+
+    Parameters
+    ----------
+    vertices : int
+        The number of vertices of the boundary
+    rng : Generator
+        The random number generator
+
+    Returns
+    -------
+    area : Polygon
+        The area in local meters
+    """
+    angles: npt.NDArray[np.float64] = np.linspace(0.0, 2.0 * math.pi, vertices, endpoint=False)
+    waves: npt.NDArray[np.float64] = np.arange(2.0, HARMONICS + 2.0)
+    amplitudes: npt.NDArray[np.float64] = rng.uniform(-1.0, 1.0, HARMONICS) / HARMONICS
+    phases: npt.NDArray[np.float64] = rng.uniform(0.0, 2.0 * math.pi, HARMONICS)
+    radii: npt.NDArray[np.float64] = FIELD_RADIUS * (
+        1.0 + ROUGHNESS * (amplitudes * np.cos(np.outer(angles, waves) + phases)).sum(axis=1)
+    )
+    return Polygon(np.column_stack((radii * np.cos(angles), radii * np.sin(angles))))
+
+
+def best_time(statement: str, setup_globals: dict[str, object]) -> float:
+    """
+    Returns the best time of a statement over several repeats
+
+    Parameters
+    ----------
+    statement : str
+        The Python statement to time
+    setup_globals : dict[str, object]
+        Names available to the statement
+
+    Returns
+    -------
+    seconds : float
+        The fastest run in seconds
+    """
+    return min(timeit.repeat(statement, globals=setup_globals, number=1, repeat=5))
+
+
+def main() -> None:
+    """
+    Times the search generation for growing area complexity and prints the results
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n",
+        "--vertices",
+        default="4,64,1024,16384",
+        help="Comma-separated vertex counts of the areas",
+    )
+    parser.add_argument("-s", "--swath", type=float, default=2.0, help="Swath in meters")
+    args: argparse.Namespace = parser.parse_args()
+
+    rng: np.random.Generator = np.random.default_rng(0)
+    frame: geo.LocalFrame = geo.LocalFrame(37.9490953, -91.7848293)
+    print(f"{'vertices':>9}{'raw':>9}{'items':>9}{'path ms':>10}{'plan ms':>10}{'items ms':>10}")
+    for vertices in [int(count) for count in args.vertices.split(",")]:
+        area: Polygon = jagged_area(vertices, rng)
+        waypoints: npt.NDArray[np.float64] = coverage.coverage_waypoints(
+            area, frame, args.swath, 100.0
+        )
+        names: dict[str, object] = {
+            "coverage": coverage,
+            "upload_mission": upload_mission,
+            "area": area,
+            "frame": frame,
+            "swath": args.swath,
+            "waypoints": waypoints,
+        }
+        raw: int = len(coverage.coverage_path(area, args.swath))
+        path: float = best_time("coverage.coverage_path(area, swath)", names)
+        plan: float = best_time("coverage.coverage_waypoints(area, frame, swath, 100.0)", names)
+        items: float = best_time("upload_mission.mission_items(waypoints, 12.0, 2.0)", names)
+        print(
+            f"{vertices:>9}{raw:>9}{len(waypoints):>9}"
+            f"{path * 1e3:>10.2f}{plan * 1e3:>10.2f}{items * 1e3:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Fleet benchmark. Flies growing fleets of offline simulated vehicles through the full
+run.start_flight pipeline on one virtual-time event loop, and reports the wall time
+per vehicle, which should stay flat as the fleet grows.
+
+Run with python -m benchmarks.bench_fleet [-n 1,4,16,32]
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import run
+from flight import connection, fleet
+from flight.sim import clock
+
+
+class ErrorCounter(logging.Handler):
+    """
+    Logging handler counting the errors logged, so failed flights are not mistaken for
+    fast ones.
+
+    Attributes
+    ----------
+    errors : int
+        The number of records logged at ERROR or above.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(logging.ERROR)
+        self.errors: int = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """
+        Counts one error record
+
+        Parameters
+        ----------
+        record : LogRecord
+            The record logged
+        """
+        self.errors += 1
+
+
+async def fly_fleet(count: int) -> None:
+    """
+    Flies a fleet of simulated vehicles to the golf course target, then forgets their
+    connections so the next fleet starts afresh
+
+    Parameters
+    ----------
+    count : int
+        The number of vehicles
+    """
+    try:
+        await run.init_and_begin(fleet.simulated_fleet(count), False)
+    finally:
+        await connection.MANAGER.close()
+
+
+def main() -> None:
+    """
+    Flies each fleet size and prints the wall time in total and per vehicle
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--sizes", default="1,4,16,32", help="Comma separated fleet sizes to fly"
+    )
+    args: argparse.Namespace = parser.parse_args()
+    sizes: list[int] = [int(size) for size in args.sizes.split(",")]
+
+    counter: ErrorCounter = ErrorCounter()
+    root: logging.Logger = logging.getLogger()
+    root.addHandler(counter)
+    root.setLevel(logging.ERROR)
+
+    print(f"{'vehicles':>8}{'wall s':>10}{'ms / vehicle':>14}{'errors':>8}")
+    # The flight recordings are only a cost being measured, so they are not kept
+    with tempfile.TemporaryDirectory() as directory:
+        run.FLIGHT_RECORD_FILE = os.path.join(directory, os.path.basename(run.FLIGHT_RECORD_FILE))
+        for size in sizes:
+            counter.errors = 0
+            start: float = time.perf_counter()
+            clock.run(fly_fleet(size))
+            wall_time: float = time.perf_counter() - start
+            print(f"{size:>8}{wall_time:>10.2f}{wall_time / size * 1e3:>14.1f}{counter.errors:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Micro-benchmark of the per-sample cost of the flight.geo conversions,
+comparing the scalar fast paths against the NumPy batch conversions.
+"""
+import argparse
+import timeit
+
+import numpy as np
+import numpy.typing as npt
+
+from flight import geo
+
+# Golf course home position, the anchor of the frame being benchmarked
+HOME_LATITUDE: float = 37.9490953
+HOME_LONGITUDE: float = -91.7848293
+
+
+def per_call(statement: str, setup_globals: dict[str, object], number: int) -> float:
+    """
+    Returns the best time of a statement over several repeats, per execution
+
+    Parameters
+    ----------
+    statement : str
+        The Python statement to time
+    setup_globals : dict[str, object]
+        Names available to the statement
+    number : int
+        Executions of the statement per repeat
+
+    Returns
+    -------
+    seconds : float
+        Seconds per execution of the statement
+    """
+    return min(timeit.repeat(statement, globals=setup_globals, number=number, repeat=5)) / number
+
+
+def main() -> None:
+    """
+    Times the scalar and batch conversions and prints the cost per sample
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--samples", type=int, default=100_000, help="Batch size")
+    args: argparse.Namespace = parser.parse_args()
+    samples: int = args.samples
+
+    frame: geo.LocalFrame = geo.LocalFrame(HOME_LATITUDE, HOME_LONGITUDE)
+    rng: np.random.Generator = np.random.default_rng(0)
+    latitudes: npt.NDArray[np.float64] = HOME_LATITUDE + rng.uniform(-0.01, 0.01, samples)
+    longitudes: npt.NDArray[np.float64] = HOME_LONGITUDE + rng.uniform(-0.01, 0.01, samples)
+    altitudes: npt.NDArray[np.float64] = rng.uniform(0.0, 150.0, samples)
+    enu: npt.NDArray[np.float64] = frame.to_enu_array(latitudes, longitudes, altitudes)
+
+    names: dict[str, object] = {
+        "frame": frame,
+        "geo": geo,
+        "lat": float(latitudes[0]),
+        "lon": float(longitudes[0]),
+        "lats": latitudes,
+        "lons": longitudes,
+        "alts": altitudes,
+        "enu": enu,
+    }
+
+    print(f"{'conversion':<28}{'ns / sample':>12}")
+    results: list[tuple[str, float]] = [
+        ("to_enu (scalar)", per_call("frame.to_enu(lat, lon, 10.0)", names, 100_000)),
+        ("from_enu (scalar)", per_call("frame.from_enu(30.0, 40.0, 10.0)", names, 100_000)),
+        ("distance (scalar)", per_call("geo.distance(lat, lon, lat, lon + 1e-4)", names, 100_000)),
+        (
+            "to_enu_array (batch)",
+            per_call("frame.to_enu_array(lats, lons, alts)", names, 10) / samples,
+        ),
+        ("from_enu_array (batch)", per_call("frame.from_enu_array(enu)", names, 10) / samples),
+        (
+            "distance_array (batch)",
+            per_call("geo.distance_array(lats, lons, lat, lon)", names, 10) / samples,
+        ),
+    ]
+    for name, seconds in results:
+        print(f"{name:<28}{seconds * 1e9:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Micro-benchmark of flight.geofence checks per second, along a flight track sampled
+at the landing telemetry rate, at scattered points that defeat the clearance cache,
+and against plain unprepared Shapely polygons.
+"""
+import argparse
+import asyncio
+import timeit
+
+import numpy as np
+import numpy.typing as npt
+from shapely.geometry import Point
+
+from flight import geofence
+
+TRACK_SPEED: float = 12.0  # m/s, speed of the simulated flight track
+TRACK_RATE: float = 20.0  # Hz, position samples of the track per second
+
+
+def checks_per_second(statement: str, setup_globals: dict[str, object], checks: int) -> float:
+    """
+    Returns the best rate of a statement that runs a number of checks, over several repeats
+
+    Parameters
+    ----------
+    statement : str
+        The Python statement to time
+    setup_globals : dict[str, object]
+        Names available to the statement
+    checks : int
+        Checks done by one execution of the statement
+
+    Returns
+    -------
+    rate : float
+        Checks per second
+    """
+    return checks / min(timeit.repeat(statement, globals=setup_globals, number=1, repeat=5))
+
+
+def main() -> None:
+    """
+    Times the geofence checks and prints the checks per second and time per check
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--samples", type=int, default=20_000, help="Positions checked")
+    parser.add_argument(
+        "-f", "--file", default=geofence.GOLF_GEOFENCE_FILE, help="Geofence file to check"
+    )
+    args: argparse.Namespace = parser.parse_args()
+    samples: int = args.samples
+
+    fence: geofence.Geofence = asyncio.run(geofence.load_geofence(args.file))
+    rng: np.random.Generator = np.random.default_rng(0)
+    west, south, east, north = fence.inclusion[next(iter(fence.inclusion))].bounds
+
+    # A track wandering around the middle of the field, one sample every TRACK_RATE
+    heading: npt.NDArray[np.float64] = np.cumsum(rng.normal(0.0, 0.05, samples))
+    step: float = TRACK_SPEED / TRACK_RATE
+    track_east: npt.NDArray[np.float64] = np.cumsum(step * np.sin(heading)) % 100.0 - 50.0
+    track_north: npt.NDArray[np.float64] = np.cumsum(step * np.cos(heading)) % 100.0 - 50.0
+    track: list[tuple[float, float]] = [
+        fence.frame.from_enu(float(e), float(n))[:2] for e, n in zip(track_east, track_north)
+    ]
+    scattered_enu: list[tuple[float, float]] = list(
+        zip(rng.uniform(west, east, samples).tolist(), rng.uniform(south, north, samples).tolist())
+    )
+    scattered: list[tuple[float, float]] = [
+        fence.frame.from_enu(e, n)[:2] for e, n in scattered_enu
+    ]
+    polygons: list[object] = [*fence.inclusion.values(), *fence.exclusion.values()]
+
+    names: dict[str, object] = {
+        "fence": fence,
+        "track": track,
+        "scattered": scattered,
+        "scattered_enu": scattered_enu,
+        "polygons": polygons,
+        "Point": Point,
+    }
+    print(f"{'check':<32}{'checks / s':>14}{'us / check':>12}")
+    results: list[tuple[str, float]] = [
+        (
+            "check, flight track",
+            checks_per_second("for p in track: fence.check(*p)", names, samples),
+        ),
+        (
+            "check, scattered points",
+            checks_per_second("for p in scattered: fence.check(*p)", names, samples),
+        ),
+        (
+            "unprepared polygons, scattered",
+            checks_per_second(
+                "for p in scattered_enu:\n    point = Point(*p)\n"
+                "    [polygon.contains(point) for polygon in polygons]",
+                names,
+                samples,
+            ),
+        ),
+    ]
+    for name, rate in results:
+        print(f"{name:<32}{rate:>14,.0f}{1e6 / rate:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
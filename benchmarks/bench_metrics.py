@@ -0,0 +1,111 @@
+"""
+Micro-benchmark of the cost of the flight.metrics instrumentation on the hot paths,
+with the instrumentation off and on, against the bare code it wraps.
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, Callable, Coroutine
+
+from flight import metrics
+
+HISTOGRAM: metrics.Histogram = metrics.Histogram("bench_seconds")
+
+
+async def bare() -> None:
+    """
+    The coroutine being instrumented, doing nothing so only the overhead is timed
+    """
+
+
+timed_bare: Callable[[], Coroutine[Any, Any, None]] = metrics.timed("bench_timed_seconds")(bare)
+
+
+async def per_call(statement: Callable[[], Coroutine[Any, Any, None]], number: int) -> float:
+    """
+    Returns the best time of a coroutine over several repeats, per execution
+
+    Parameters
+    ----------
+    statement : Callable[[], Coroutine]
+        Runs the code being timed number times
+    number : int
+        Executions of the code per repeat
+
+    Returns
+    -------
+    seconds : float
+        Seconds per execution of the code
+    """
+    best: float = float("inf")
+    for _ in range(5):
+        start: float = time.perf_counter()
+        await statement()
+        best = min(best, time.perf_counter() - start)
+    return best / number
+
+
+async def run(number: int) -> list[tuple[str, float]]:
+    """
+    Times every instrumentation point with the instrumentation off, then on
+
+    Parameters
+    ----------
+    number : int
+        Executions of each statement per repeat
+
+    Returns
+    -------
+    results : list[tuple[str, float]]
+        Name and seconds per execution of each statement
+    """
+
+    async def await_bare() -> None:
+        for _ in range(number):
+            await bare()
+
+    async def await_timed() -> None:
+        for _ in range(number):
+            await timed_bare()
+
+    async def with_timer() -> None:
+        for _ in range(number):
+            with metrics.timer(HISTOGRAM):
+                await bare()
+
+    async def with_command() -> None:
+        for _ in range(number):
+            with metrics.time_command("bench"):
+                await bare()
+
+    async def record() -> None:
+        for _ in range(number):
+            HISTOGRAM.record(0.0123)
+
+    baseline: float = await per_call(await_bare, number)
+    results: list[tuple[str, float]] = [("await (baseline)", baseline)]
+    for state, switch in (("off", metrics.disable), ("on", metrics.enable)):
+        switch()
+        results.append((f"timed, {state}", await per_call(await_timed, number) - baseline))
+        results.append((f"timer, {state}", await per_call(with_timer, number) - baseline))
+        results.append((f"time_command, {state}", await per_call(with_command, number) - baseline))
+    metrics.disable()
+    results.append(("Histogram.record", await per_call(record, number)))
+    return results
+
+
+def main() -> None:
+    """
+    Times the instrumentation and prints the overhead per call
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=100_000, help="Calls per repeat")
+    args: argparse.Namespace = parser.parse_args()
+
+    print(f"{'instrumentation':<28}{'ns / call':>12}")
+    for name, seconds in asyncio.run(run(args.number)):
+        print(f"{name:<28}{seconds * 1e9:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
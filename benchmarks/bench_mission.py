@@ -0,0 +1,395 @@
+"""
+End-to-end mission benchmark. Runs the full run.start_flight pipeline and each
+flight stage on its own against the offline simulator, reporting wall time per
+phase, time to first command, telemetry-to-command latency percentiles, landing
+error, simulated time to land and peak memory, and writes the results as JSON.
+
+Run with python -m benchmarks.bench_mission [-n repeats] [-o results.json]
+[--baseline old_results.json]
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import math
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, NamedTuple, Optional
+
+import numpy as np
+
+import run
+from flight import config, goto, intake_gps, landing, run_mission, upload_mission
+from flight.sim import clock
+from flight.sim.system import SimulatedSystem
+
+TARGET_PATH: str = intake_gps.GOLF_TARGET_FILE
+GOTO_WAYPOINT: tuple[float, float, float] = (37.949803, -91.784440, 75.0)  # Feet altitude
+LANDING_START_ALTITUDE: float = 75.0  # Meters, where run_mission hands over to landing
+REGRESSION_TOLERANCE: float = 0.10  # Fractional slowdown of a metric reported as a regression
+
+
+class StageResult(NamedTuple):
+    """
+    NamedTuple storing the measurements of one benchmarked run.
+
+    Attributes
+    ----------
+    name : str
+        Name of the benchmarked stage or pipeline.
+    wall_time : float
+        Wall-clock seconds the run took.
+    phases : dict[str, float]
+        Wall-clock seconds spent in each flight stage called during the run.
+    sim_time : float
+        Simulated seconds the run took.
+    time_to_first_command : float
+        Wall-clock seconds from the start of the run to the first command the vehicle received.
+    latency_percentiles : dict[str, float]
+        Percentiles of the telemetry-to-command latency in seconds.
+    commands : int
+        The number of commands the vehicle received.
+    landing_error : float
+        Horizontal distance in meters between the vehicle and the target once disarmed,
+        nan if the run ends with the vehicle still flying.
+    peak_memory : int
+        Peak traced Python memory in bytes.
+    """
+
+    name: str
+    wall_time: float
+    phases: dict[str, float]
+    sim_time: float
+    time_to_first_command: float
+    latency_percentiles: dict[str, float]
+    commands: int
+    landing_error: float
+    peak_memory: int
+
+
+def timed_stage(
+    phases: dict[str, float], name: str, stage: Callable[..., Awaitable[Any]]
+) -> Callable[..., Awaitable[Any]]:
+    """
+    Wraps a flight stage so the wall time of every call is added to a phase total
+
+    Parameters
+    ----------
+    phases : dict[str, float]
+        Totals of wall time per phase, updated in place
+    name : str
+        Name of the phase
+    stage : Callable[..., Awaitable[Any]]
+        The stage coroutine function
+
+    Returns
+    -------
+    wrapper : Callable[..., Awaitable[Any]]
+        The timed stage
+    """
+
+    @functools.wraps(stage)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start: float = time.perf_counter()
+        try:
+            return await stage(*args, **kwargs)
+        finally:
+            phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+    return wrapper
+
+
+async def full_pipeline(drone: SimulatedSystem) -> None:
+    """Runs run.start_flight with the golf course target"""
+    await run.start_flight(drone, False)
+
+
+async def config_stage(drone: SimulatedSystem) -> None:
+    """Runs config.config_params"""
+    await config.config_params(drone)
+
+
+async def upload_stage(drone: SimulatedSystem) -> None:
+    """Runs upload_mission.upload_mission"""
+    await upload_mission.upload_mission(drone, False)
+
+
+async def run_mission_stage(drone: SimulatedSystem) -> None:
+    """Runs run_mission.run_mission, which needs the mission uploaded first"""
+    await run_mission.run_mission(drone, False)
+
+
+async def goto_stage(drone: SimulatedSystem) -> None:
+    """Runs goto.move_to to the first golf course test waypoint"""
+    await goto.move_to(drone, *GOTO_WAYPOINT)
+
+
+async def landing_stage(drone: SimulatedSystem) -> None:
+    """Runs landing.manual_land over the golf course target"""
+    target: intake_gps.Waypoint = (await intake_gps.load_targets(TARGET_PATH)).target
+    await landing.manual_land(drone, target.latitude, target.longitude)
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    """
+    Returns the p50, p90, p99 and max of a list of values
+
+    Parameters
+    ----------
+    values : list[float]
+        The values, nan entries are ignored
+
+    Returns
+    -------
+    percentiles : dict[str, float]
+        The percentiles keyed by name, nan if there are no values
+    """
+    finite: list[float] = [value for value in values if not math.isnan(value)]
+    if not finite:
+        return {key: float("nan") for key in ("p50", "p90", "p99", "max")}
+    p50, p90, p99 = np.percentile(finite, [50.0, 90.0, 99.0])
+    return {"p50": float(p50), "p90": float(p90), "p99": float(p99), "max": max(finite)}
+
+
+def landing_drone(target: intake_gps.Waypoint) -> SimulatedSystem:
+    """
+    Creates a simulated drone starting where run_mission hands over to landing
+
+    Parameters
+    ----------
+    target : Waypoint
+        The landing target
+
+    Returns
+    -------
+    drone : SimulatedSystem
+        A drone hovering LANDING_START_ALTITUDE above a point near the target
+    """
+    drone: SimulatedSystem = SimulatedSystem()
+    east, north, _ = drone.link.frame.to_enu(target.latitude, target.longitude)
+    # Start a few meters off the target, as the mission leaves the drone
+    drone.link.vehicle.position = [east + 3.0, north - 2.0, LANDING_START_ALTITUDE]
+    drone.link.vehicle.hold()
+    return drone
+
+
+async def benchmark(
+    name: str,
+    stage: Callable[[SimulatedSystem], Awaitable[None]],
+    drone: SimulatedSystem,
+    target: intake_gps.Waypoint,
+    prepare: Optional[Callable[[SimulatedSystem], Awaitable[None]]] = None,
+) -> StageResult:
+    """
+    Runs one stage against a fresh simulated drone and measures it
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage
+    stage : Callable[[SimulatedSystem], Awaitable[None]]
+        The stage to run
+    drone : SimulatedSystem
+        A fresh, unconnected simulated drone
+    target : Waypoint
+        The landing target, for the landing error
+    prepare : Optional[Callable[[SimulatedSystem], Awaitable[None]]]
+        Untimed setup to run before the stage
+
+    Returns
+    -------
+    result : StageResult
+        The measurements of the run
+    """
+    await drone.connect()
+    if prepare is not None:
+        await prepare(drone)
+    first_command: int = len(drone.link.commands)
+
+    phases: dict[str, float] = {}
+    originals: list[tuple[Any, str, Any]] = [
+        (config, "config_params", config.config_params),
+        (upload_mission, "upload_mission", upload_mission.upload_mission),
+        (run_mission, "run_mission", run_mission.run_mission),
+        (goto, "move_to", goto.move_to),
+        (landing, "manual_land", landing.manual_land),
+    ]
+    for module, attribute, function in originals:
+        setattr(module, attribute, timed_stage(phases, attribute, function))
+
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    tracemalloc.start()
+    sim_start: float = loop.time()
+    start: float = time.perf_counter()
+    try:
+        await stage(drone)
+    finally:
+        wall_time: float = time.perf_counter() - start
+        sim_time: float = loop.time() - sim_start
+        peak_memory: int = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        for module, attribute, function in originals:
+            setattr(module, attribute, function)
+
+    commands = drone.link.commands[first_command:]
+    time_to_first_command: float = commands[0].wall_time - start if commands else float("nan")
+    east, north, _ = drone.link.frame.to_enu(target.latitude, target.longitude)
+    position: list[float] = drone.link.vehicle.position
+    landing_error: float = float("nan")
+    if not drone.link.vehicle.armed:
+        landing_error = math.hypot(position[0] - east, position[1] - north)
+    return StageResult(
+        name,
+        wall_time,
+        phases,
+        sim_time,
+        time_to_first_command,
+        percentiles([command.telemetry_age for command in commands]),
+        len(commands),
+        landing_error,
+        peak_memory,
+    )
+
+
+async def run_benchmarks() -> list[StageResult]:
+    """
+    Runs the full pipeline and every stage once, each on a fresh simulated drone
+
+    Returns
+    -------
+    results : list[StageResult]
+        The measurements of every run
+    """
+    target: intake_gps.Waypoint = (await intake_gps.load_targets(TARGET_PATH)).target
+    return [
+        await benchmark("start_flight", full_pipeline, SimulatedSystem(), target),
+        await benchmark("config_params", config_stage, SimulatedSystem(), target),
+        await benchmark("upload_mission", upload_stage, SimulatedSystem(), target),
+        await benchmark(
+            "run_mission", run_mission_stage, SimulatedSystem(), target, prepare=upload_stage
+        ),
+        await benchmark("move_to", goto_stage, SimulatedSystem(), target),
+        await benchmark("manual_land", landing_stage, landing_drone(target), target),
+    ]
+
+
+def summarize(runs: list[list[StageResult]]) -> list[dict[str, Any]]:
+    """
+    Combines repeated runs into the median of every measurement
+
+    Parameters
+    ----------
+    runs : list[list[StageResult]]
+        The results of each repeat, in the same stage order
+
+    Returns
+    -------
+    summary : list[dict[str, Any]]
+        One JSON-ready dict per stage
+    """
+    summary: list[dict[str, Any]] = []
+    for repeats in zip(*runs):
+        first: StageResult = repeats[0]
+        summary.append(
+            {
+                "name": first.name,
+                "wall_time": statistics.median(result.wall_time for result in repeats),
+                "phases": {
+                    phase: statistics.median(result.phases.get(phase, 0.0) for result in repeats)
+                    for phase in first.phases
+                },
+                "sim_time": statistics.median(result.sim_time for result in repeats),
+                "time_to_first_command": statistics.median(
+                    result.time_to_first_command for result in repeats
+                ),
+                "latency": {
+                    key: statistics.median(result.latency_percentiles[key] for result in repeats)
+                    for key in first.latency_percentiles
+                },
+                "commands": first.commands,
+                "landing_error": statistics.median(result.landing_error for result in repeats),
+                "peak_memory": max(result.peak_memory for result in repeats),
+            }
+        )
+    return summary
+
+
+def regressions(summary: list[dict[str, Any]], baseline: list[dict[str, Any]]) -> list[str]:
+    """
+    Compares a summary against a baseline and describes every metric that got worse
+
+    Parameters
+    ----------
+    summary : list[dict[str, Any]]
+        The current results
+    baseline : list[dict[str, Any]]
+        Results of an earlier release
+
+    Returns
+    -------
+    regressions : list[str]
+        One line per metric that is more than REGRESSION_TOLERANCE worse
+    """
+    found: list[str] = []
+    previous: dict[str, dict[str, Any]] = {stage["name"]: stage for stage in baseline}
+    for stage in summary:
+        old: Optional[dict[str, Any]] = previous.get(stage["name"])
+        if old is None:
+            continue
+        for metric in ("wall_time", "sim_time", "landing_error", "peak_memory"):
+            if stage[metric] > old[metric] * (1.0 + REGRESSION_TOLERANCE) and old[metric] > 0:
+                found.append(f"{stage['name']}.{metric}: {old[metric]:.4g} -> {stage[metric]:.4g}")
+    return found
+
+
+def main() -> None:
+    """
+    Runs the benchmarks, prints a table and optionally writes and compares JSON results
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeats", type=int, default=3, help="Runs per stage")
+    parser.add_argument("-o", "--output", help="Path of the JSON results file to write")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    args: argparse.Namespace = parser.parse_args()
+
+    # The flight code logs at debug level, which would drown out the table
+    logging.basicConfig(level=logging.WARNING)
+    # The flight recordings are only a cost being measured, so they are not kept
+    with tempfile.TemporaryDirectory() as directory:
+        run.FLIGHT_RECORD_FILE = os.path.join(directory, os.path.basename(run.FLIGHT_RECORD_FILE))
+        runs: list[list[StageResult]] = [clock.run(run_benchmarks()) for _ in range(args.repeats)]
+    summary: list[dict[str, Any]] = summarize(runs)
+
+    print(
+        f"{'stage':<16}{'wall s':>9}{'sim s':>9}{'first cmd ms':>14}"
+        f"{'lat p50 us':>12}{'lat p99 us':>12}{'error m':>9}{'peak KiB':>10}"
+    )
+    for stage in summary:
+        print(
+            f"{stage['name']:<16}{stage['wall_time']:>9.3f}{stage['sim_time']:>9.1f}"
+            f"{stage['time_to_first_command'] * 1e3:>14.3f}"
+            f"{stage['latency']['p50'] * 1e6:>12.1f}{stage['latency']['p99'] * 1e6:>12.1f}"
+            f"{stage['landing_error']:>9.3f}{stage['peak_memory'] / 1024:>10.0f}"
+        )
+        for phase, seconds in stage["phases"].items():
+            print(f"    {phase:<24}{seconds:>9.3f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="UTF-8") as output:
+            json.dump({"stages": summary}, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="UTF-8") as baseline_file:
+            baseline: list[dict[str, Any]] = json.load(baseline_file)["stages"]
+        found: list[str] = regressions(summary, baseline)
+        print("Regressions:" if found else "No regressions")
+        for line in found:
+            print(f"    {line}")
+
+
+if __name__ == "__main__":
+    main()
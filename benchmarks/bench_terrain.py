@@ -0,0 +1,111 @@
+"""
+Micro-benchmark of flight.terrain elevation queries per second, along a flight track
+that stays in one decoded tile, at scattered points over a large grid that miss the
+tile cache, and with a bilinear interpolation reading the memory map directly.
+Runs on a synthetic grid written to a temporary directory.
+"""
+import argparse
+import os
+import tempfile
+import timeit
+
+import numpy as np
+import numpy.typing as npt
+
+from flight import terrain
+
+GRID_CELLS: int = 2048  # Cells per side of the synthetic grid, 1 m cells
+CELL_DEGREES: float = 1e-5  # Degrees per cell, about a meter
+NORTH: float = 37.96  # Latitude of the first row of the synthetic grid
+WEST: float = -91.80  # Longitude of the first column of the synthetic grid
+
+
+def direct_elevation(grid: npt.NDArray[np.int16], latitude: float, longitude: float) -> float:
+    """
+    Interpolates an elevation straight from the memory-mapped cells, with no tiles
+
+    Parameters
+    ----------
+    grid : NDArray[int16]
+        The memory-mapped stored cells
+    latitude : float
+        Latitude in degrees
+    longitude : float
+        Longitude in degrees
+
+    Returns
+    -------
+    elevation : float
+        Stored elevation, unscaled
+    """
+    row: float = (NORTH - latitude) / CELL_DEGREES
+    column: float = (longitude - WEST) / CELL_DEGREES
+    top: int = int(row)
+    left: int = int(column)
+    south_share: float = row - top
+    east_share: float = column - left
+    cells: npt.NDArray[np.int16] = grid[top : top + 2, left : left + 2]
+    return float(
+        cells[0, 0] * (1.0 - south_share) * (1.0 - east_share)
+        + cells[0, 1] * (1.0 - south_share) * east_share
+        + cells[1, 0] * south_share * (1.0 - east_share)
+        + cells[1, 1] * south_share * east_share
+    )
+
+
+def main() -> None:
+    """
+    Times the elevation queries and prints the queries per second and time per query
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--samples", type=int, default=20_000, help="Positions queried")
+    args: argparse.Namespace = parser.parse_args()
+    samples: int = args.samples
+
+    rng: np.random.Generator = np.random.default_rng(0)
+    rows: npt.NDArray[np.float64] = np.arange(GRID_CELLS, dtype=np.float64)[:, None]
+    columns: npt.NDArray[np.float64] = np.arange(GRID_CELLS, dtype=np.float64)[None, :]
+    elevations: npt.NDArray[np.float64] = 380.0 + 5.0 * np.sin(rows / 50.0) * np.cos(columns / 70.0)
+    span: float = (GRID_CELLS - 2) * CELL_DEGREES
+    # A slow track within a few meters, like the landing, and points all over the grid
+    track: list[tuple[float, float]] = [
+        (NORTH - 0.0001 - 2e-5 * np.sin(step / 100.0), WEST + 0.0001 + 2e-5 * np.cos(step / 80.0))
+        for step in range(samples)
+    ]
+    scattered: list[tuple[float, float]] = list(
+        zip(
+            (NORTH - rng.uniform(0.0, span, samples)).tolist(),
+            (WEST + rng.uniform(0.0, span, samples)).tolist(),
+        )
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        path: str = os.path.join(directory, "bench.dem")
+        terrain.write_grid(path, elevations, NORTH, WEST, CELL_DEGREES, CELL_DEGREES)
+        grid: terrain.ElevationGrid = terrain.ElevationGrid(path, 380.0)
+        names: dict[str, object] = {
+            "grid": grid,
+            "cells": np.memmap(
+                path,
+                dtype="<i2",
+                mode="r",
+                offset=terrain.HEADER.size,
+                shape=(GRID_CELLS, GRID_CELLS),
+            ),
+            "direct": direct_elevation,
+            "track": track,
+            "scattered": scattered,
+        }
+        print(f"{'query':<32}{'queries / s':>14}{'us / query':>12}")
+        for name, statement in (
+            ("elevation, flight track", "for p in track: grid.elevation(*p)"),
+            ("elevation, scattered points", "for p in scattered: grid.elevation(*p)"),
+            ("memory map directly, scattered", "for p in scattered: direct(cells, *p)"),
+        ):
+            best: float = min(timeit.repeat(statement, globals=names, number=1, repeat=5))
+            print(f"{name:<32}{samples / best:>14,.0f}{best / samples * 1e6:>12.2f}")
+        print(f"Tiles decoded: {grid.tile_loads}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Checks of the retry decision of flight.commands against errors raised by the real mavsdk
+plugins. Each plugin is given a stub standing in for mavsdk_server that answers with a
+result, so the error comes from the plugin code itself, as it would in flight.
+
+Run with python -m pytest benchmarks
+"""
+import asyncio
+from typing import Any
+
+from mavsdk.action import Action, ActionError, action_pb2
+from mavsdk.param import Param, ParamError, param_pb2
+
+from flight import commands
+
+
+class _ActionStub:
+    """
+    Stand-in for the gRPC stub of the Action plugin, answering arm requests with a result.
+    """
+
+    def __init__(self, result: int) -> None:
+        self.result: int = result
+
+    async def Arm(self, request: Any) -> Any:  # pylint: disable=invalid-name
+        """Answers an arm request"""
+        return action_pb2.ArmResponse(
+            action_result=action_pb2.ActionResult(result=self.result, result_str="stub")
+        )
+
+
+class _ParamStub:
+    """
+    Stand-in for the gRPC stub of the Param plugin, answering parameter writes with a result.
+    """
+
+    def __init__(self, result: int) -> None:
+        self.result: int = result
+
+    async def SetParamInt(self, request: Any) -> Any:  # pylint: disable=invalid-name
+        """Answers a parameter write"""
+        return param_pb2.SetParamIntResponse(
+            param_result=param_pb2.ParamResult(result=self.result, result_str="stub")
+        )
+
+
+def _arm_error(result: int) -> ActionError:
+    action: Action = Action(None)
+    action._stub = _ActionStub(result)  # pylint: disable=protected-access
+    try:
+        asyncio.run(action.arm())
+    except ActionError as ex:
+        return ex
+    raise AssertionError("arm() did not fail")
+
+
+def _set_param_error(result: int) -> ParamError:
+    param: Param = Param(None)
+    param._stub = _ParamStub(result)  # pylint: disable=protected-access
+    try:
+        asyncio.run(param.set_param_int("NAV_DLL_ACT", 1))
+    except ParamError as ex:
+        return ex
+    raise AssertionError("set_param_int() did not fail")
+
+
+def test_link_errors_are_transient() -> None:
+    """
+    Timeouts, a busy vehicle and a lost link are retried
+    """
+    for result in (
+        action_pb2.ActionResult.RESULT_TIMEOUT,
+        action_pb2.ActionResult.RESULT_BUSY,
+        action_pb2.ActionResult.RESULT_NO_SYSTEM,
+        action_pb2.ActionResult.RESULT_CONNECTION_ERROR,
+    ):
+        assert commands.is_transient(_arm_error(result)), result
+    assert commands.is_transient(_set_param_error(param_pb2.ParamResult.RESULT_TIMEOUT))
+
+
+def test_refusals_are_not_transient() -> None:
+    """
+    A command the vehicle refused fails at once
+    """
+    assert not commands.is_transient(_arm_error(action_pb2.ActionResult.RESULT_COMMAND_DENIED))
+    assert not commands.is_transient(_set_param_error(param_pb2.ParamResult.RESULT_WRONG_TYPE))
+    assert not commands.is_transient(ValueError("TIMEOUT: not from mavsdk"))
+
+
+class _RenamedError(Exception):
+    """
+    Plugin error of a mavsdk version keeping its result under another name.
+    """
+
+    def __init__(self, result: Any, origin: str) -> None:
+        self._action_result: Any = result
+        self._origin: str = origin
+
+    def __str__(self) -> str:
+        result: Any = self._action_result
+        return f"{result.result}: '{result.result_str}'; origin: {self._origin}"
+
+
+_RenamedError.__module__ = "mavsdk.action"
+
+
+def test_result_read_from_message() -> None:
+    """
+    Without the private result attribute, the result is read from the message
+    """
+    for result, transient in (
+        (action_pb2.ActionResult.RESULT_TIMEOUT, True),
+        (action_pb2.ActionResult.RESULT_COMMAND_DENIED, False),
+    ):
+        error: ActionError = _arm_error(result)
+        renamed: _RenamedError = _RenamedError(
+            error._result, "arm()"  # pylint: disable=protected-access
+        )
+        assert commands.is_transient(renamed) == transient, result
@@ -0,0 +1,92 @@
+"""
+Checks of the coverage paths of flight.coverage on areas with holes and separate parts:
+the path stays inside the area and its swath covers it.
+
+Run with python -m pytest benchmarks
+"""
+from typing import Union
+
+import numpy as np
+from shapely.geometry import LineString, MultiPolygon, Point, Polygon, box
+
+from flight import coverage
+
+from benchmarks.bench_coverage import jagged_area
+
+SWATHS: tuple[float, ...] = (10.0, 25.0)  # Meters, swaths every area is covered with
+START: tuple[float, float] = (-300.0, -300.0)  # East and north in meters the path starts from
+FINISH: tuple[float, float] = (400.0, 0.0)  # East and north in meters the path finishes at
+SLACK: float = 0.01  # Share of the swath the swath is widened by, for the polygons of buffers
+
+HOLED_FIELD: Polygon = Polygon(
+    box(0.0, 0.0, 200.0, 120.0).exterior.coords, [box(60.0, 40.0, 140.0, 80.0).exterior.coords]
+)
+ROUND_FIELD: Polygon = Polygon(
+    Point(0.0, 0.0).buffer(100.0).exterior.coords,
+    [Point(20.0, 10.0).buffer(30.0).exterior.coords],
+)
+SPLIT_FIELD: MultiPolygon = MultiPolygon(
+    [box(0.0, 0.0, 100.0, 100.0), box(150.0, 20.0, 260.0, 90.0)]
+)
+
+
+def _paths(area: Union[Polygon, MultiPolygon]) -> list[tuple[float, coverage.FloatArray]]:
+    return [
+        (swath, path)
+        for swath in SWATHS
+        for path in (
+            coverage.coverage_path(area, swath),
+            coverage.coverage_path(area, swath, start=START, finish=FINISH),
+        )
+    ]
+
+
+def _swath(path: coverage.FloatArray, swath: float) -> Polygon:
+    return LineString(path).buffer(swath / 2.0 * (1.0 + SLACK))
+
+
+def test_path_inside_holed_areas() -> None:
+    """
+    The path never crosses a hole or leaves the area
+    """
+    for area in (HOLED_FIELD, ROUND_FIELD, jagged_area(500, np.random.default_rng(1))):
+        inside: Polygon = area.buffer(coverage.TRANSIT_TOLERANCE)
+        for swath, path in _paths(area):
+            assert inside.covers(LineString(path)), swath
+
+
+def test_path_between_parts() -> None:
+    """
+    Only legs from one part of the area to another leave it
+    """
+    inside: MultiPolygon = SPLIT_FIELD.buffer(coverage.TRANSIT_TOLERANCE)
+    for swath, path in _paths(SPLIT_FIELD):
+        for leg in zip(path[:-1], path[1:]):
+            if not inside.covers(LineString(leg)):
+                parts: list[int] = [
+                    next(
+                        index for index, part in enumerate(inside.geoms) if part.covers(Point(end))
+                    )
+                    for end in leg
+                ]
+                assert parts[0] != parts[1], (swath, leg)
+
+
+def test_swath_covers_straight_sides() -> None:
+    """
+    With the sides along and across the sweep lines, the swath covers all of the area,
+    above and below the hole too
+    """
+    for area in (HOLED_FIELD, SPLIT_FIELD):
+        for swath, path in _paths(area):
+            assert _swath(path, swath).covers(area), swath
+
+
+def test_swath_covers_slanted_sides() -> None:
+    """
+    With sides slanting across the sweep lines, the swath covers all of the area more
+    than half a swath from its sides
+    """
+    for area in (ROUND_FIELD, jagged_area(500, np.random.default_rng(1))):
+        for swath, path in _paths(area):
+            assert _swath(path, swath).covers(area.buffer(-swath / 2.0)), swath
@@ -0,0 +1,431 @@
+"""
+Command bus of a drone. Every command sent to the vehicle goes through the bus of its
+drone, which orders the commands by priority so kill and the failsafes jump the queue,
+never has two commands for the same thing in flight at once, replaces a queued setpoint
+with a newer one instead of sending both, skips a setting the vehicle already has, and
+retries a command that fails on a transient link error with a bounded backoff.
+
+Once a failsafe or kill is sent, the bus is latched: flight control commands are
+rejected, queued ones included, so nothing steers the drone out of the failsafe.
+
+The bus times each command into the command latency histogram and records it in the
+flight recording once acknowledged, so callers only say what to send.
+"""
+import asyncio
+import itertools
+import logging
+import weakref
+from typing import Any, Awaitable, Callable, Optional
+
+from mavsdk import System
+
+from flight import logger, metrics, recorder
+
+# Priorities, lower goes first
+CRITICAL: int = 0  # Kill, sent before even the failsafes
+FAILSAFE: int = 1  # Hold and land when something went wrong
+CONTROL: int = 2  # Setpoints, gotos and mode changes of the flight itself
+ROUTINE: int = 3  # Parameters, telemetry rates and mission transfers
+
+IN_FLIGHT_LIMIT: int = 4  # Commands awaiting acknowledgement at once, CRITICAL and FAILSAFE aside
+RETRY_ATTEMPTS: int = 3  # Retries of a command failing on a transient error
+RETRY_DELAY: float = 0.1  # Seconds before the first retry, doubled before each next one
+RETRY_MAX_DELAY: float = 1.0  # Seconds, longest wait between two retries
+# Results of the mavsdk plugin errors worth retrying, as the command may go through later
+TRANSIENT_RESULTS: frozenset[str] = frozenset({"NO_SYSTEM", "CONNECTION_ERROR", "BUSY", "TIMEOUT"})
+
+_warned_result: bool = False  # Whether a mavsdk error without a readable result was logged
+
+
+class CommandRejectedError(RuntimeError):
+    """
+    Exception for when a flight control command is sent after a failsafe
+    """
+
+
+class _Command:
+    """
+    A command waiting in the bus or in flight.
+    """
+
+    __slots__ = (
+        "name",
+        "key",
+        "call",
+        "values",
+        "priority",
+        "sequence",
+        "coalesce",
+        "queued_at",
+        "waiters",
+        "future",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        key: str,
+        call: Callable[[], Awaitable[Any]],
+        values: tuple[float, ...],
+        priority: int,
+        sequence: int,
+        coalesce: bool,
+    ) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        self.name: str = name
+        self.key: str = key
+        self.call: Callable[[], Awaitable[Any]] = call
+        self.values: tuple[float, ...] = values
+        self.priority: int = priority
+        self.sequence: int = sequence
+        self.coalesce: bool = coalesce
+        self.queued_at: float = loop.time()
+        self.waiters: int = 0
+        self.future: asyncio.Future[Any] = loop.create_future()
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Returns whether a failed command may succeed if sent again
+
+    Parameters
+    ----------
+    error : BaseException
+        The error the command raised
+
+    Returns
+    -------
+    transient : bool
+        True for the link and busy errors of the mavsdk plugins
+    """
+    # The plugin errors have no public accessor for their result, only this attribute
+    result: Any = getattr(getattr(error, "_result", None), "result", None)
+    if result is not None:
+        return result.name in TRANSIENT_RESULTS
+    if type(error).__module__.startswith("mavsdk."):
+        global _warned_result
+        if not _warned_result:
+            _warned_result = True
+            logging.warning(
+                "%s has no _result, reading its result from its message to decide on retries",
+                type(error).__name__,
+            )
+        # The message of a plugin error starts with the name of its result
+        return str(error).split(":", 1)[0].strip() in TRANSIENT_RESULTS
+    return False
+
+
+class CommandBus:
+    """
+    Queue of the commands of one drone, sent in order of priority.
+
+    Attributes
+    ----------
+    in_flight_limit : int
+        The number of commands awaiting acknowledgement at once, CRITICAL and FAILSAFE
+        ones aside.
+    latched : Optional[str]
+        The failsafe or kill command that latched the bus, None until one is sent.
+    """
+
+    def __init__(self, in_flight_limit: int = IN_FLIGHT_LIMIT) -> None:
+        self.in_flight_limit: int = in_flight_limit
+        self.latched: Optional[str] = None
+        self._queue: list[_Command] = []
+        self._in_flight: set[str] = set()  # Keys of the commands awaiting acknowledgement
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._coalescing: dict[str, _Command] = {}  # Queued command that newer ones replace
+        self._acknowledged: dict[str, tuple[float, ...]] = {}  # Last values of each key
+        self._sequence: itertools.count[int] = itertools.count()
+
+    def depth(self) -> int:
+        """
+        Returns the number of commands waiting to be sent
+
+        Returns
+        -------
+        depth : int
+            Queued commands, not counting the ones in flight
+        """
+        return len(self._queue)
+
+    async def send(
+        self,
+        drone: System,
+        name: str,
+        call: Callable[[], Awaitable[Any]],
+        *values: float,
+        priority: int = CONTROL,
+        key: Optional[str] = None,
+        coalesce: bool = False,
+        dedupe: bool = False,
+    ) -> Any:
+        """
+        Queues a command and waits for the vehicle to acknowledge it
+
+        Parameters
+        ----------
+        drone : System
+            The drone the command is sent to
+        name : str
+            The command name, one of recorder.COMMAND_KINDS
+        call : Callable[[], Awaitable[Any]]
+            Sends the command, called once per attempt
+        *values : float
+            The numeric arguments of the command, as recorded
+        priority : int
+            CRITICAL, FAILSAFE, CONTROL or ROUTINE
+        key : Optional[str]
+            What the command sets, the name if None. Commands with the same key are
+            never in flight together
+        coalesce : bool
+            Whether a newer command with the same key replaces this one while it is
+            queued, so only the newest setpoint is sent
+        dedupe : bool
+            Whether to skip the command when the last one acknowledged with the same
+            key had the same values
+
+        Returns
+        -------
+        result : Any
+            What the call returned, or None if the command was skipped
+
+        Raises
+        ------
+        CommandRejectedError
+            If a CONTROL command is sent, or was waiting, after a failsafe latched the bus
+        """
+        if priority == CONTROL and self.latched is not None:
+            raise CommandRejectedError(f"{name} rejected, {self.latched} latched the failsafe")
+        if priority <= FAILSAFE:
+            self._latch(name)
+        key = name if key is None else key
+        if dedupe and self._acknowledged.get(key) == values:
+            if metrics.enabled():
+                _counter("commands_skipped_total", "Commands already in effect", name).inc()
+            return None
+
+        command: Optional[_Command] = self._coalescing.get(key) if coalesce else None
+        if command is not None:
+            # The queued setpoint is superseded, it goes out with the newest values
+            command.name = name
+            command.call = call
+            command.values = values
+            command.priority = min(command.priority, priority)
+            if metrics.enabled():
+                _counter("commands_coalesced_total", "Setpoints replaced while queued", name).inc()
+        else:
+            command = _Command(name, key, call, values, priority, next(self._sequence), coalesce)
+            self._queue.append(command)
+            if coalesce:
+                self._coalescing[key] = command
+            self._pump(drone)
+
+        command.waiters += 1
+        try:
+            return await asyncio.shield(command.future)
+        except asyncio.CancelledError:
+            command.waiters -= 1
+            if not command.waiters and command in self._queue:
+                # Nobody wants it anymore and it has not gone out yet
+                self._unqueue(command)
+                command.future.cancel()
+            raise
+
+    def release(self) -> None:
+        """
+        Lets flight control commands through again after a failsafe, once the drone is
+        safe to be flown by the code again
+        """
+        self.latched = None
+
+    def _latch(self, name: str) -> None:
+        if self.latched is None:
+            logging.info("%s latched the failsafe, flight control commands are rejected", name)
+        self.latched = name
+        for command in [queued for queued in self._queue if queued.priority == CONTROL]:
+            self._unqueue(command)
+            command.future.set_exception(
+                CommandRejectedError(f"{command.name} rejected, {name} latched the failsafe")
+            )
+
+    def _unqueue(self, command: _Command) -> None:
+        self._queue.remove(command)
+        if self._coalescing.get(command.key) is command:
+            del self._coalescing[command.key]
+        self._record_depth()
+
+    def _pump(self, drone: System) -> None:
+        while self._queue:
+            ready: list[_Command] = [
+                command
+                for command in self._queue
+                if command.key not in self._in_flight
+                and (command.priority <= FAILSAFE or len(self._tasks) < self.in_flight_limit)
+            ]
+            if not ready:
+                break
+            command: _Command = min(ready, key=lambda queued: (queued.priority, queued.sequence))
+            self._unqueue(command)
+            self._in_flight.add(command.key)
+            task: asyncio.Task[None] = asyncio.create_task(self._execute(drone, command))
+            self._tasks.add(task)
+        self._record_depth()
+
+    async def _execute(self, drone: System, command: _Command) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        if metrics.enabled():
+            metrics.histogram(
+                "command_queue_seconds",
+                "Seconds commands waited in the bus before being sent",
+                command=command.name,
+                vehicle=logger.VEHICLE.get(),
+            ).record(loop.time() - command.queued_at)
+        try:
+            delay: float = RETRY_DELAY
+            attempt: int = 0
+            while True:
+                try:
+                    with metrics.time_command(command.name):
+                        result: Any = await command.call()
+                    break
+                except Exception as ex:  # pylint: disable=broad-except
+                    attempt += 1
+                    if attempt > RETRY_ATTEMPTS or not is_transient(ex):
+                        self._fail(command, ex)
+                        return
+                    if command.coalesce and command.key in self._coalescing:
+                        # A newer setpoint is already queued, so this one is dropped
+                        command.future.set_result(None)
+                        return
+                    logging.warning(
+                        "%s failed, retry %d of %d in %.2f s: %s",
+                        command.name,
+                        attempt,
+                        RETRY_ATTEMPTS,
+                        delay,
+                        ex,
+                    )
+                    if metrics.enabled():
+                        _counter("command_retries_total", "Commands sent again", command.name).inc()
+                    await asyncio.sleep(delay)
+                    delay = min(2.0 * delay, RETRY_MAX_DELAY)
+
+            # The sender resumes first, so a failure to record never leaves it waiting
+            if not command.future.done():
+                command.future.set_result(result)
+            self._acknowledged[command.key] = command.values
+            recorder.record_command(drone, command.name, *command.values)
+        except asyncio.CancelledError:
+            command.future.cancel()
+            raise
+        except Exception as ex:  # pylint: disable=broad-except
+            if command.future.done():
+                logging.exception("%s was acknowledged but could not be recorded", command.name)
+            else:
+                self._fail(command, ex)
+        finally:
+            self._in_flight.discard(command.key)
+            self._tasks.discard(asyncio.current_task())  # type: ignore[arg-type]
+            self._pump(drone)
+
+    @staticmethod
+    def _fail(command: _Command, error: BaseException) -> None:
+        if command.future.done():
+            return
+        if command.waiters:
+            command.future.set_exception(error)
+        else:
+            # Every sender gave up waiting, so nobody would see the error
+            logging.warning("%s failed after its senders left: %s", command.name, error)
+            command.future.cancel()
+
+    def _record_depth(self) -> None:
+        if metrics.enabled():
+            metrics.gauge(
+                "command_queue_depth",
+                "Commands waiting in the bus",
+                vehicle=logger.VEHICLE.get(),
+            ).set(len(self._queue))
+
+
+def _counter(name: str, description: str, command: str) -> metrics.Counter:
+    return metrics.counter(name, description, command=command, vehicle=logger.VEHICLE.get())
+
+
+# Bus of each drone, dropped with the drone
+_BUSES: weakref.WeakKeyDictionary[System, CommandBus] = weakref.WeakKeyDictionary()
+
+
+def get_bus(drone: System) -> CommandBus:
+    """
+    Returns the command bus of a drone, creating it the first time
+
+    Parameters
+    ----------
+    drone : System
+        The connected drone
+
+    Returns
+    -------
+    bus : CommandBus
+        The command bus of the drone
+    """
+    bus: Optional[CommandBus] = _BUSES.get(drone)
+    if bus is None:
+        bus = _BUSES[drone] = CommandBus()
+    return bus
+
+
+async def send(
+    drone: System,
+    name: str,
+    call: Callable[[], Awaitable[Any]],
+    *values: float,
+    priority: int = CONTROL,
+    key: Optional[str] = None,
+    coalesce: bool = False,
+    dedupe: bool = False,
+) -> Any:
+    """
+    Sends a command through the bus of a drone, see CommandBus.send
+
+    Parameters
+    ----------
+    drone : System
+        The drone the command is sent to
+    name : str
+        The command name, one of recorder.COMMAND_KINDS
+    call : Callable[[], Awaitable[Any]]
+        Sends the command, called once per attempt
+    *values : float
+        The numeric arguments of the command, as recorded
+    priority : int
+        CRITICAL, FAILSAFE, CONTROL or ROUTINE
+    key : Optional[str]
+        What the command sets, the name if None
+    coalesce : bool
+        Whether a newer command with the same key replaces this one while it is queued
+    dedupe : bool
+        Whether to skip the command when the vehicle already has the same values
+
+    Returns
+    -------
+    result : Any
+        What the call returned, or None if the command was skipped
+
+    Raises
+    ------
+    CommandRejectedError
+        If a CONTROL command is sent, or was waiting, after a failsafe latched the bus
+    """
+    return await get_bus(drone).send(
+        drone,
+        name,
+        call,
+        *values,
+        priority=priority,
+        key=key,
+        coalesce=coalesce,
+        dedupe=dedupe,
+    )
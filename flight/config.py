@@ -1,26 +1,227 @@
 """File to hold important constant values and configure drone upon startup"""
+import asyncio
+import functools
+import logging
+from typing import Any, Awaitable, Callable, NamedTuple, Optional, Union
+
 from mavsdk import System
+from mavsdk.param import AllParams
+
+from flight import commands
 
 WAIT: float = 2.0  # Seconds
+FLOAT_TOLERANCE: float = 1e-6  # Float parameters closer than this to the profile are left alone
+
+
+class ParamSpec(NamedTuple):
+    """
+    NamedTuple storing the value a drone parameter must be set to.
+
+    Attributes
+    ----------
+    name : str
+        Name of the PX4 parameter.
+    value : Union[int, float]
+        Required value, an int for integer parameters and a float for float parameters.
+    description : str
+        What the value does, for the logs.
+    """
+
+    name: str
+    value: Union[int, float]
+    description: str
+
+
+class ParamResult(NamedTuple):
+    """
+    NamedTuple storing the outcome of configuring one parameter.
+
+    Attributes
+    ----------
+    name : str
+        Name of the PX4 parameter.
+    value : Union[int, float]
+        The value the parameter was configured to.
+    previous : Optional[Union[int, float]]
+        The value read before configuring, None if the drone did not report it.
+    changed : bool
+        Whether the parameter had to be written.
+    latency : float
+        Seconds the write took, 0 if it was already correct.
+    """
+
+    name: str
+    value: Union[int, float]
+    previous: Optional[Union[int, float]]
+    changed: bool
+    latency: float
+
+
+class ParamConfigError(Exception):
+    """
+    Exception for when parameters could not be written or did not read back as written
+    """
+
+
+# Parameters the drone must have before flight
+PARAM_PROFILE: tuple[ParamSpec, ...] = (
+    ParamSpec("NAV_DLL_ACT", 1, "Data link loss failsafe mode HOLD"),
+    ParamSpec("COM_OBL_ACT", 1, "Offboard loss failsafe mode HOLD"),
+    ParamSpec("COM_OBL_RC_ACT", 5, "Offboard loss failsafe mode when RC is available HOLD"),
+    ParamSpec("NAV_RCL_ACT", 1, "RC loss failsafe mode HOLD"),
+    ParamSpec("LNDMC_XY_VEL_MAX", 0.5, "Maximum horizontal velocity to detect landing, m/s"),
+)
+
+
+def read_params(all_params: AllParams) -> dict[str, Union[int, float]]:
+    """
+    Flattens the integer and float parameters of a bulk read into one dict
+
+    Parameters
+    ----------
+    all_params : AllParams
+        Result of param.get_all_params()
+
+    Returns
+    -------
+    values : dict[str, Union[int, float]]
+        Value of every parameter by name
+    """
+    values: dict[str, Union[int, float]] = {
+        param.name: param.value for param in all_params.int_params
+    }
+    values.update((param.name, param.value) for param in all_params.float_params)
+    return values
+
+
+def is_set(spec: ParamSpec, current: Optional[Union[int, float]]) -> bool:
+    """
+    Checks whether a parameter already has its profile value
+
+    Parameters
+    ----------
+    spec : ParamSpec
+        The profile entry
+    current : Optional[Union[int, float]]
+        The value read from the drone, None if it was not reported
+
+    Returns
+    -------
+    is_set : bool
+        True if the parameter does not need to be written
+    """
+    if current is None:
+        return False
+    if isinstance(spec.value, float):
+        return abs(current - spec.value) <= FLOAT_TOLERANCE
+    return current == spec.value
 
 
-async def config_params(drone: System) -> None:
+async def write_param(drone: System, spec: ParamSpec) -> float:
     """
-    Sets certain parameters within the drone for flight
+    Writes one parameter and returns how long the round trip took
+
+    Parameters
+    ----------
+    drone : System
+        MAVSDK object for manual drone control & manipulation
+    spec : ParamSpec
+        The parameter and value to write
+
+    Returns
+    -------
+    latency : float
+        Seconds the write took
+    """
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    start: float = loop.time()
+    setter: Callable[[str, Any], Awaitable[None]] = (
+        drone.param.set_param_float if isinstance(spec.value, float) else drone.param.set_param_int
+    )
+    await commands.send(
+        drone,
+        "set_param",
+        functools.partial(setter, spec.name, spec.value),
+        float(spec.value),
+        priority=commands.ROUTINE,
+        key=f"set_param:{spec.name}",
+    )
+    return loop.time() - start
+
+
+async def config_params(
+    drone: System, profile: tuple[ParamSpec, ...] = PARAM_PROFILE
+) -> list[ParamResult]:
+    """
+    Sets certain parameters within the drone for flight. The current values are read
+    in one bulk request and only the parameters that differ from the profile are
+    written, all at once, then read back to verify them.
 
     Parameters
     ----------
     drone: System
         MAVSDK object for manual drone control & manipulation
+    profile: tuple[ParamSpec, ...]
+        The parameters to configure
+
+    Returns
+    -------
+    results: list[ParamResult]
+        The outcome for every parameter of the profile, in order
+
+    Raises
+    ------
+    ParamConfigError
+        If a write failed or a parameter did not read back as written
     """
+    current: dict[str, Union[int, float]] = read_params(await drone.param.get_all_params())
+    pending: list[ParamSpec] = [
+        spec for spec in profile if not is_set(spec, current.get(spec.name))
+    ]
+
+    outcomes: list[Union[float, BaseException]] = await asyncio.gather(
+        *(write_param(drone, spec) for spec in pending), return_exceptions=True
+    )
+    latencies: dict[str, float] = {}
+    failures: list[str] = []
+    for spec, outcome in zip(pending, outcomes):
+        if isinstance(outcome, BaseException):
+            failures.append(f"{spec.name}: {outcome}")
+        else:
+            latencies[spec.name] = outcome
 
-    # Set data link loss failsafe mode HOLD
-    await drone.param.set_param_int("NAV_DLL_ACT", 1)
-    # Set offboard loss failsafe mode HOLD
-    await drone.param.set_param_int("COM_OBL_ACT", 1)
-    # Set offboard loss failsafe mode when RC is available HOLD
-    await drone.param.set_param_int("COM_OBL_RC_ACT", 5)
+    if pending:
+        verified: dict[str, Union[int, float]] = read_params(await drone.param.get_all_params())
+        failures.extend(
+            f"{spec.name}: read back {verified.get(spec.name)}, expected {spec.value}"
+            for spec in pending
+            if spec.name in latencies and not is_set(spec, verified.get(spec.name))
+        )
+    if failures:
+        raise ParamConfigError("Could not configure " + "; ".join(failures))
 
-    # Set RC loss failsafe mode HOLD
-    await drone.param.set_param_int("NAV_RCL_ACT", 1)
-    await drone.param.set_param_float("LNDMC_XY_VEL_MAX", 0.5)
+    results: list[ParamResult] = []
+    for spec in profile:
+        changed: bool = spec.name in latencies
+        results.append(
+            ParamResult(
+                spec.name,
+                spec.value,
+                current.get(spec.name),
+                changed,
+                latencies.get(spec.name, 0.0),
+            )
+        )
+        if changed:
+            logging.debug(
+                "Set %s to %s (%s) in %.1f ms, was %s",
+                spec.name,
+                spec.value,
+                spec.description,
+                latencies[spec.name] * 1e3,
+                current.get(spec.name),
+            )
+    logging.info(
+        "Configured %d parameters, %d already set", len(pending), len(profile) - len(pending)
+    )
+    return results
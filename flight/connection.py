@@ -0,0 +1,322 @@
+"""
+Owns the MAVSDK connections used by the flight code so that every stage
+(config, upload, run, landing, goto) shares a single System, and therefore a
+single mavsdk_server and handshake, per system address.
+"""
+import asyncio
+import logging
+from typing import NamedTuple, Optional
+
+import grpc
+from mavsdk import System
+from mavsdk.core import ConnectionState
+
+from flight import telemetry_hub
+from flight.flight import DroneNotFoundError, wait_for_drone
+from flight.sim.system import SimulatedSystem, is_simulated
+
+CONNECT_TIMEOUT: float = 5.0  # Seconds to wait for the first heartbeat
+OUTAGE_WARNING_INTERVAL: float = 5.0  # Seconds between warnings while the link is lost
+RESTART_DELAY: float = 1.0  # Seconds before retrying a failed restart, doubled each time
+RESTART_MAX_DELAY: float = 30.0  # Seconds, longest wait between two restarts
+SERVER_STOP_PAUSE: float = 1.0  # Seconds for a stopped mavsdk_server to free its port
+BASE_SERVER_PORT: int = 50051  # gRPC port of the first mavsdk_server, later ones count up
+
+
+class ConnectionStats(NamedTuple):
+    """
+    NamedTuple storing connection statistics for a single system address.
+
+    Attributes
+    ----------
+    address : str
+        The system address the drone is connected on.
+    server_port : int
+        The gRPC port used by the mavsdk_server of this connection, 0 if it has none.
+    time_to_connected : float
+        Seconds from creating the System to the first connected heartbeat.
+    reconnects : int
+        The number of times the link was lost and regained.
+    """
+
+    address: str
+    server_port: int
+    time_to_connected: float
+    reconnects: int
+
+
+class ConnectionManager:
+    """
+    Creates, caches and supervises one connected System per system address.
+
+    Attributes
+    ----------
+    timeout : float
+        Seconds to wait for a drone to connect before raising DroneNotFoundError.
+    outage_warning_interval : float
+        Seconds between two warnings while the link of a drone is lost.
+    """
+
+    def __init__(
+        self,
+        timeout: float = CONNECT_TIMEOUT,
+        outage_warning_interval: float = OUTAGE_WARNING_INTERVAL,
+    ) -> None:
+        self.timeout: float = timeout
+        self.outage_warning_interval: float = outage_warning_interval
+
+        self._drones: dict[str, System] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._monitors: dict[str, asyncio.Task[None]] = {}
+        self._stats: dict[str, ConnectionStats] = {}
+        self._next_port: int = BASE_SERVER_PORT
+        self._ports: set[int] = set()
+
+    async def get(self, address: str, server_port: Optional[int] = None) -> System:
+        """
+        Returns the connected System for an address, connecting on first use
+
+        Parameters
+        ----------
+        address : str
+            MAVSDK system address, such as udp://:14540 or serial:///dev/ttyUSB0,
+            or sim:// for the offline simulator
+        server_port : Optional[int]
+            gRPC port of the mavsdk_server started for the address, or None for the next
+            free one counting up from BASE_SERVER_PORT. Ignored once connected.
+
+        Returns
+        -------
+        drone : System
+            The shared, connected System for the address
+
+        Raises
+        ------
+        DroneNotFoundError
+            If the drone did not connect within the timeout
+        ValueError
+            If the server port is already used by another address
+        """
+        lock: asyncio.Lock = self._locks.setdefault(address, asyncio.Lock())
+        async with lock:
+            if address in self._drones:
+                return self._drones[address]
+
+            drone: System
+            if is_simulated(address):
+                # The offline simulator runs in process and needs no mavsdk_server
+                drone = SimulatedSystem.from_address(address)
+                server_port = 0
+            else:
+                if server_port is None:
+                    while self._next_port in self._ports:
+                        self._next_port += 1
+                    server_port = self._next_port
+                elif server_port in self._ports:
+                    raise ValueError(f"mavsdk_server port {server_port} is already used")
+                self._ports.add(server_port)
+                drone = System(port=server_port)
+
+            start: float = asyncio.get_running_loop().time()
+            await self._connect(drone, address)
+            elapsed: float = asyncio.get_running_loop().time() - start
+
+            logging.info("Connected to %s in %.3f s", address, elapsed)
+            self._stats[address] = ConnectionStats(address, server_port, elapsed, 0)
+            self._drones[address] = drone
+            self._monitors[address] = asyncio.create_task(self._monitor(address, drone))
+            return drone
+
+    def stats(self, address: str) -> ConnectionStats:
+        """
+        Returns the connection statistics for an already connected address
+
+        Parameters
+        ----------
+        address : str
+            The system address passed to get
+
+        Returns
+        -------
+        stats : ConnectionStats
+            Time to connected and reconnect count for the address
+        """
+        return self._stats[address]
+
+    async def close(self) -> None:
+        """
+        Stops connection monitoring and forgets all cached drones, their statistics and
+        the mavsdk_server ports they used
+        """
+        for task in self._monitors.values():
+            task.cancel()
+        await asyncio.gather(*self._monitors.values(), return_exceptions=True)
+        self._monitors.clear()
+        self._drones.clear()
+        self._locks.clear()
+        self._stats.clear()
+        self._ports.clear()
+        self._next_port = BASE_SERVER_PORT
+
+    async def _connect(self, drone: System, address: str) -> None:
+        """
+        Starts mavsdk_server for a System and waits for the first heartbeat
+
+        Parameters
+        ----------
+        drone : System
+            The System to connect
+        address : str
+            MAVSDK system address to connect to
+        """
+        await drone.connect(system_address=address)
+        logging.debug("Waiting for drone to connect on %s...", address)
+        try:
+            await asyncio.wait_for(wait_for_drone(drone), timeout=self.timeout)
+        except asyncio.TimeoutError as ex:
+            raise DroneNotFoundError() from ex
+
+    async def _monitor(self, address: str, drone: System) -> None:
+        """
+        Watches the connection state of a drone. A lost link is only waited out, as
+        mavsdk_server keeps listening and picks the heartbeats up again by itself.
+        mavsdk_server is restarted only when its gRPC channel fails, with a growing
+        delay between attempts, and never while the drone is in the air.
+
+        Parameters
+        ----------
+        address : str
+            The system address of the drone
+        drone : System
+            The System being monitored
+        """
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        delay: float = RESTART_DELAY
+        lost_at: Optional[float] = None
+        while True:
+            try:
+                if lost_at is None:
+                    await self._wait_for_loss(drone)
+                    lost_at = loop.time()
+                    logging.warning("Lost connection to %s", address)
+                await self._wait_for_link(address, drone, lost_at)
+            except asyncio.CancelledError:
+                raise
+            except grpc.RpcError as ex:
+                # The gRPC channel itself failed, so mavsdk_server is gone
+                if lost_at is None:
+                    lost_at = loop.time()
+                if not await self._restart(address, drone, ex):
+                    await asyncio.sleep(delay)
+                    delay = min(2.0 * delay, RESTART_MAX_DELAY)
+                    continue
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Connection monitor for %s failed, retrying", address)
+                await asyncio.sleep(delay)
+                delay = min(2.0 * delay, RESTART_MAX_DELAY)
+                continue
+
+            outage: float = loop.time() - lost_at
+            previous: ConnectionStats = self._stats[address]
+            self._stats[address] = previous._replace(reconnects=previous.reconnects + 1)
+            logging.info("Reconnected to %s after %.3f s", address, outage)
+            delay = RESTART_DELAY
+            lost_at = None
+
+    async def _wait_for_link(self, address: str, drone: System, lost_at: float) -> None:
+        """
+        Waits for the link of a drone to come back, warning every so often
+
+        Parameters
+        ----------
+        address : str
+            The system address of the drone
+        drone : System
+            The System whose link was lost
+        lost_at : float
+            Event loop time the link was lost at
+        """
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(wait_for_drone(drone), timeout=self.outage_warning_interval)
+                return
+            except asyncio.TimeoutError:
+                logging.warning("No link to %s for %.1f s", address, loop.time() - lost_at)
+
+    async def _restart(self, address: str, drone: System, error: BaseException) -> bool:
+        """
+        Restarts the mavsdk_server of a drone on the ground and waits for the link
+
+        Parameters
+        ----------
+        address : str
+            The system address of the drone
+        drone : System
+            The System whose mavsdk_server failed
+        error : BaseException
+            The gRPC error the server failed with
+
+        Returns
+        -------
+        restarted : bool
+            Whether the drone is connected through a new mavsdk_server
+        """
+        # The drone cannot be asked anymore, so the last sample of the hub decides
+        if telemetry_hub.get_hub(drone).latest("in_air"):
+            logging.error(
+                "mavsdk_server for %s failed in the air, not restarting it: %s", address, error
+            )
+            return False
+
+        logging.warning("Restarting mavsdk_server for %s: %s", address, error)
+        try:
+            # System.connect() stops the old server itself but then sleeps without
+            # yielding, so the server is stopped here and the pause awaited instead
+            drone._stop_mavsdk_server()  # pylint: disable=protected-access
+            await asyncio.sleep(SERVER_STOP_PAUSE)
+            await self._connect(drone, address)
+        except DroneNotFoundError:
+            logging.warning("No drone on %s after restarting mavsdk_server", address)
+            return False
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Restarting mavsdk_server for %s failed", address)
+            return False
+        return True
+
+    @staticmethod
+    async def _wait_for_loss(drone: System) -> None:
+        """
+        Returns once the drone reports that it is no longer connected
+
+        Parameters
+        ----------
+        drone : System
+            The System to watch
+        """
+        state: ConnectionState
+        async for state in drone.core.connection_state():
+            if not state.is_connected:
+                return
+
+
+MANAGER: ConnectionManager = ConnectionManager()
+
+
+async def get_drone(address: str, server_port: Optional[int] = None) -> System:
+    """
+    Returns the shared, connected System for an address from the default manager
+
+    Parameters
+    ----------
+    address : str
+        MAVSDK system address, such as udp://:14540 or serial:///dev/ttyUSB0
+    server_port : Optional[int]
+        gRPC port of the mavsdk_server started for the address, or None for the next free one
+
+    Returns
+    -------
+    drone : System
+        The shared, connected System for the address
+    """
+    return await MANAGER.get(address, server_port)
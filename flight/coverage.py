@@ -0,0 +1,544 @@
+"""
+Coverage paths for searching an area for the target. A boustrophedon path sweeps the
+area in parallel lines one sensor swath apart, flying each line in the opposite
+direction of the one before, so the whole area passes under the sensor once.
+
+The crossings of all sweep lines with every edge of the area are found in one NumPy
+pass, so areas with thousands of vertices are swept in milliseconds. Holes, notches and
+separate parts split the sweep lines into cells that are each swept on their own, and
+a leg between two lines that would leave the area is routed around along the sweep
+lines, so the path never crosses a keep-out zone.
+"""
+import heapq
+import math
+from typing import Optional, Union
+
+import numpy as np
+import numpy.typing as npt
+from shapely.geometry import JOIN_STYLE, LineString, MultiPolygon, Polygon
+from shapely.prepared import PreparedGeometry, prep
+
+from flight import geo
+
+FloatArray = npt.NDArray[np.float64]
+
+COLLINEAR_TOLERANCE: float = 0.05  # Meters a waypoint may be off the path and still be dropped
+HULL_TOLERANCE: float = 0.001  # Share of the size of an area its hull is simplified by
+TRANSIT_TOLERANCE: float = 0.01  # Meters a transit may stray outside the area, for rounding
+
+
+def sweep_angle(area: Union[Polygon, MultiPolygon]) -> float:
+    """
+    Returns the direction of the sweep lines that needs the fewest of them, along the
+    long side of the smallest rectangle around the area
+
+    Parameters
+    ----------
+    area : Union[Polygon, MultiPolygon]
+        The area to cover, in local meters
+
+    Returns
+    -------
+    angle : float
+        Angle of the sweep lines counterclockwise from east, in radians
+    """
+    # The smallest rectangle has a side along an edge of the convex hull, and dropping
+    # the hull vertices that barely bend it does not move the rectangle noticeably
+    hull: Polygon = area.convex_hull
+    hull = hull.simplify(HULL_TOLERANCE * math.sqrt(hull.area))
+    corners: FloatArray = np.asarray(hull.exterior.coords)[:, :2]
+    sides: FloatArray = np.diff(corners, axis=0)
+    lengths: FloatArray = np.hypot(sides[:, 0], sides[:, 1])
+    along: FloatArray = sides / lengths[:, np.newaxis]
+    across: FloatArray = np.column_stack((-along[:, 1], along[:, 0]))
+    # Extent of the hull along and across each of its edges
+    projected: FloatArray = corners @ along.T
+    spread: FloatArray = corners @ across.T
+    length: FloatArray = projected.max(axis=0) - projected.min(axis=0)
+    width: FloatArray = spread.max(axis=0) - spread.min(axis=0)
+    best: int = int(np.argmin(length * width))
+    direction: FloatArray = along[best] if length[best] >= width[best] else across[best]
+    return math.atan2(direction[1], direction[0])
+
+
+def _edges(area: Union[Polygon, MultiPolygon]) -> FloatArray:
+    polygons: list[Polygon] = list(area.geoms) if isinstance(area, MultiPolygon) else [area]
+    rings: list[FloatArray] = []
+    for polygon in polygons:
+        for ring in (polygon.exterior, *polygon.interiors):
+            coords: FloatArray = np.asarray(ring.coords, dtype=np.float64)[:, :2]
+            rings.append(np.hstack((coords[:-1], coords[1:])))
+    return np.vstack(rings)
+
+
+def _turns(
+    area: Union[Polygon, MultiPolygon], cos_a: float, sin_a: float
+) -> tuple[FloatArray, FloatArray]:
+    # Heights where the boundary turns back across the sweep lines with the area above,
+    # and with the area below
+    polygons: list[Polygon] = list(area.geoms) if isinstance(area, MultiPolygon) else [area]
+    bottoms: list[FloatArray] = []
+    tops: list[FloatArray] = []
+    for polygon in polygons:
+        for hole, ring in enumerate((polygon.exterior, *polygon.interiors)):
+            coords: FloatArray = np.asarray(ring.coords, dtype=np.float64)[:-1, :2]
+            x: FloatArray = coords[:, 0] * cos_a + coords[:, 1] * sin_a
+            y: FloatArray = coords[:, 1] * cos_a - coords[:, 0] * sin_a
+            before: FloatArray = np.roll(y, 1)
+            after: FloatArray = np.roll(y, -1)
+            turn: npt.NDArray[np.bool_] = ((y < before) & (y <= after)) | (
+                (y > before) & (y >= after)
+            )
+            # The area is on the left of an exterior going counterclockwise and of a hole
+            # going clockwise, so above a turn the ring passes going forward
+            forward: npt.NDArray[np.bool_] = np.roll(x, -1) > np.roll(x, 1)
+            counterclockwise: bool = (
+                float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) > 0.0
+            )
+            if counterclockwise == bool(hole):
+                forward = ~forward
+            bottoms.append(y[turn & forward])
+            tops.append(y[turn & ~forward])
+    return np.concatenate(bottoms), np.concatenate(tops)
+
+
+def _cells(
+    lines: npt.NDArray[np.int64], starts: FloatArray, ends: FloatArray
+) -> tuple[list[list[int]], list[tuple[int, int]]]:
+    cells: list[list[int]] = []
+    links: list[tuple[int, int]] = []
+    open_cells: list[int] = []  # Cells reaching the previous line
+    first: int = 0
+    while first < len(lines):
+        stop: int = first
+        while stop < len(lines) and lines[stop] == lines[first]:
+            stop += 1
+        if not first or lines[first] != lines[first - 1] + 1:
+            open_cells = []
+
+        # Overlaps of the last segments of the open cells with the segments of this line,
+        # both sorted along the line
+        previous: list[int] = sorted(open_cells, key=lambda cell: starts[cells[cell][-1]])
+        overlaps: list[tuple[int, int]] = []
+        index: int = 0
+        segment: int = first
+        while index < len(previous) and segment < stop:
+            last: int = cells[previous[index]][-1]
+            if starts[segment] < ends[last] and starts[last] < ends[segment]:
+                overlaps.append((previous[index], segment))
+                links.append((last, segment))
+            if ends[last] < ends[segment]:
+                index += 1
+            else:
+                segment += 1
+
+        # A cell only goes on where it overlaps a single segment overlapping nothing else,
+        # so each cell is swept back and forth without crossing a hole or a notch
+        cell_overlaps: dict[int, int] = {}
+        segment_overlaps: dict[int, int] = {}
+        for cell, segment in overlaps:
+            cell_overlaps[cell] = cell_overlaps.get(cell, 0) + 1
+            segment_overlaps[segment] = segment_overlaps.get(segment, 0) + 1
+        continued: dict[int, int] = {
+            segment: cell
+            for cell, segment in overlaps
+            if cell_overlaps[cell] == 1 and segment_overlaps[segment] == 1
+        }
+        open_cells = []
+        for segment in range(first, stop):
+            cell = continued.get(segment, -1)
+            if cell < 0:
+                cell = len(cells)
+                cells.append([])
+            cells[cell].append(segment)
+            open_cells.append(cell)
+        first = stop
+    return cells, links
+
+
+class _Transits:
+    """
+    Routes between the ends of the sweep segments that stay inside the area, along the
+    sweep segments and the legs joining the segments of neighbouring lines. Points after
+    the segment ends, where the path starts from or finishes at, join any end.
+    """
+
+    def __init__(
+        self,
+        area: Union[Polygon, MultiPolygon],
+        points: FloatArray,
+        ends: int,
+        links: list[tuple[int, int]],
+        cos_a: float,
+        sin_a: float,
+    ) -> None:
+        self._inside: PreparedGeometry = prep(
+            area.buffer(TRANSIT_TOLERANCE, join_style=JOIN_STYLE.mitre)
+        )
+        self._xs: list[float] = points[:, 0].tolist()
+        self._ys: list[float] = points[:, 1].tolist()
+        # Ends on the same side of the overlapping segments of neighbouring lines
+        self._adjacent: dict[int, list[int]] = {}
+        for lower, upper in links:
+            for side in (0, 1):
+                self._adjacent.setdefault(2 * lower + side, []).append(2 * upper + side)
+                self._adjacent.setdefault(2 * upper + side, []).append(2 * lower + side)
+        for point in range(ends, points.shape[0]):
+            self._adjacent[point] = list(range(ends))
+        self._ends: int = ends
+        self._cos_a: float = cos_a
+        self._sin_a: float = sin_a
+        self._graph: dict[int, list[tuple[int, float]]] = {}  # Neighbours of the ends reached
+
+    def inside(self, start: int, end: int) -> bool:
+        """
+        Returns whether the straight leg between two points stays inside the area
+
+        Parameters
+        ----------
+        start : int
+            The point the leg starts at, 2 * segment for the start of a segment and
+            2 * segment + 1 for its end
+        end : int
+            The point the leg ends at
+
+        Returns
+        -------
+        inside : bool
+            True if no part of the leg is outside the area
+        """
+        x1: float = self._xs[start]
+        y1: float = self._ys[start]
+        x2: float = self._xs[end]
+        y2: float = self._ys[end]
+        leg: LineString = LineString(
+            (
+                (x1 * self._cos_a - y1 * self._sin_a, x1 * self._sin_a + y1 * self._cos_a),
+                (x2 * self._cos_a - y2 * self._sin_a, x2 * self._sin_a + y2 * self._cos_a),
+            )
+        )
+        return bool(self._inside.covers(leg))
+
+    def route(self, start: int, end: int) -> list[int]:
+        """
+        Returns the points to fly through between two of them
+
+        Parameters
+        ----------
+        start : int
+            The point flown from
+        end : int
+            The point flown to
+
+        Returns
+        -------
+        route : list[int]
+            The points after start up to end, only end if the straight leg stays inside
+            the area or no route does
+        """
+        if self.inside(start, end):
+            return [end]
+        # A* search, the straight distance left never overestimates the route
+        xs: list[float] = self._xs
+        ys: list[float] = self._ys
+        goal_x: float = xs[end]
+        goal_y: float = ys[end]
+        distances: dict[int, float] = {start: 0.0}
+        previous: dict[int, int] = {}
+        queue: list[tuple[float, int]] = [(0.0, start)]
+        while queue:
+            _, node = heapq.heappop(queue)
+            if node == end:
+                break
+            distance: float = distances[node]
+            for neighbour, length in self._neighbours(node):
+                if distance + length < distances.get(neighbour, math.inf):
+                    distances[neighbour] = distance + length
+                    previous[neighbour] = node
+                    heapq.heappush(
+                        queue,
+                        (
+                            distance
+                            + length
+                            + math.hypot(xs[neighbour] - goal_x, ys[neighbour] - goal_y),
+                            neighbour,
+                        ),
+                    )
+        if end not in previous:
+            return [end]
+        route: list[int] = [end]
+        while route[-1] in previous and previous[route[-1]] != start:
+            route.append(previous[route[-1]])
+        route.reverse()
+        return route
+
+    def _neighbours(self, node: int) -> list[tuple[int, float]]:
+        # Legs to the neighbouring lines are only checked once the search reaches them
+        neighbours: Optional[list[tuple[int, float]]] = self._graph.get(node)
+        if neighbours is None:
+            neighbours = [
+                (
+                    other,
+                    math.hypot(self._xs[other] - self._xs[node], self._ys[other] - self._ys[node]),
+                )
+                for other in ([node ^ 1] if node < self._ends else [])
+                + [other for other in self._adjacent.get(node, ()) if self.inside(node, other)]
+            ]
+            self._graph[node] = neighbours
+        return neighbours
+
+
+def coverage_path(
+    area: Union[Polygon, MultiPolygon],
+    swath: float,
+    angle: Optional[float] = None,
+    start: Optional[tuple[float, float]] = None,
+    finish: Optional[tuple[float, float]] = None,
+) -> FloatArray:
+    """
+    Returns a boustrophedon path covering an area. Sweep lines are spread evenly
+    across the area, at most one swath apart and half of one from its sides, with
+    another line wherever a hole or notch leaves the area more than half a swath from
+    the nearest one. They are split into cells at holes, notches and separate parts,
+    each cell swept back and forth on its own, and the cells are flown nearest first.
+    Transits that would leave the area go around along the sweep lines instead. Where a
+    side slants across the lines, the corner between the ends of two lines that the
+    path does not turn at can stay outside the swath, always within half a swath of
+    that side.
+
+    Parameters
+    ----------
+    area : Union[Polygon, MultiPolygon]
+        The area to cover, in local meters
+    swath : float
+        Width in meters of the ground the sensor sees across the path
+    angle : Optional[float]
+        Angle of the sweep lines counterclockwise from east in radians, or None for
+        the one needing the fewest lines
+    start : Optional[tuple[float, float]]
+        East and north in meters the path is flown from, the cell nearest to it is
+        swept first. The path holds the waypoints that get from it into the area
+    finish : Optional[tuple[float, float]]
+        East and north in meters flown to after the path, which holds the waypoints
+        that get there inside the area
+
+    Returns
+    -------
+    path : NDArray[float64]
+        Array of shape (N, 2) holding the east and north of every waypoint in meters,
+        where each sweep line enters or leaves the area and where a transit turns
+
+    Raises
+    ------
+    ValueError
+        If the swath is not positive or the area is empty
+    """
+    if not swath > 0.0:
+        raise ValueError(f"The swath must be positive, got {swath}")
+    if area.is_empty:
+        raise ValueError("The area to cover is empty")
+    if angle is None:
+        angle = sweep_angle(area)
+    cos_a: float = math.cos(angle)
+    sin_a: float = math.sin(angle)
+
+    # Rotate the edges so the sweep lines run along x
+    edges: FloatArray = _edges(area)
+    x1: FloatArray = edges[:, 0] * cos_a + edges[:, 1] * sin_a
+    y1: FloatArray = edges[:, 1] * cos_a - edges[:, 0] * sin_a
+    x2: FloatArray = edges[:, 2] * cos_a + edges[:, 3] * sin_a
+    y2: FloatArray = edges[:, 3] * cos_a - edges[:, 2] * sin_a
+
+    bottom: float = float(min(y1.min(), y2.min()))
+    top: float = float(max(y1.max(), y2.max()))
+    lines: int = max(1, math.ceil((top - bottom) / swath))
+    spacing: float = (top - bottom) / lines
+    first: float = bottom + spacing / 2.0
+    heights: FloatArray = first + np.arange(lines) * spacing
+
+    # Above a hole or below a notch, the area may reach more than half a swath past the
+    # nearest line crossing it, and gets a line of its own halfway there
+    bottoms, tops = _turns(area, cos_a, sin_a)
+    above: FloatArray = np.minimum(first + np.ceil((bottoms - first) / spacing) * spacing, top)
+    below: FloatArray = np.maximum(first + np.floor((tops - first) / spacing) * spacing, bottom)
+    heights = np.unique(
+        np.concatenate(
+            (
+                heights,
+                ((bottoms + above) / 2.0)[above - bottoms > swath / 2.0],
+                ((tops + below) / 2.0)[tops - below > swath / 2.0],
+            )
+        )
+    )
+
+    # Each edge crosses the contiguous run of lines with y in [low, high), which counts
+    # a vertex once and gives every line an even number of crossings
+    low: FloatArray = np.minimum(y1, y2)
+    high: FloatArray = np.maximum(y1, y2)
+    first_line: npt.NDArray[np.int64] = np.searchsorted(heights, low)
+    stop: npt.NDArray[np.int64] = np.searchsorted(heights, high)
+    counts: npt.NDArray[np.int64] = stop - first_line
+    total: int = int(counts.sum())
+    if total == 0:
+        return np.empty((0, 2), dtype=np.float64)
+
+    edge: npt.NDArray[np.int64] = np.repeat(np.arange(edges.shape[0]), counts)
+    offsets: npt.NDArray[np.int64] = np.arange(total) - np.repeat(
+        np.cumsum(counts) - counts, counts
+    )
+    line: npt.NDArray[np.int64] = first_line[edge] + offsets
+    y: FloatArray = heights[line]
+    x: FloatArray = x1[edge] + (y - y1[edge]) * (x2[edge] - x1[edge]) / (y2[edge] - y1[edge])
+
+    # Sorted along each line, the crossings pair up into the segments inside the area,
+    # and the start and finish follow them
+    order: npt.NDArray[np.int64] = np.lexsort((x, line))
+    points: FloatArray = np.column_stack((x[order], y[order]))
+    segment_lines: npt.NDArray[np.int64] = line[order][::2]
+    cells, links = _cells(segment_lines, points[::2, 0], points[1::2, 0])
+    outside: list[tuple[float, float]] = [point for point in (start, finish) if point is not None]
+    if outside:
+        local: FloatArray = np.asarray(outside, dtype=np.float64)
+        points = np.vstack(
+            (
+                points,
+                np.column_stack(
+                    (
+                        local[:, 0] * cos_a + local[:, 1] * sin_a,
+                        local[:, 1] * cos_a - local[:, 0] * sin_a,
+                    )
+                ),
+            )
+        )
+    transits: _Transits = _Transits(area, points, total, links, cos_a, sin_a)
+
+    # Every cell can be entered at any of its four corners, the nearest one is taken
+    firsts: npt.NDArray[np.int64] = np.array([cell[0] for cell in cells])
+    lasts: npt.NDArray[np.int64] = np.array([cell[-1] for cell in cells])
+    corners: FloatArray = points[
+        np.column_stack((2 * firsts, 2 * firsts + 1, 2 * lasts, 2 * lasts + 1))
+    ]
+    unvisited: npt.NDArray[np.bool_] = np.ones(len(cells), dtype=bool)
+    route: list[int] = []
+    position: int = total if start is not None else -1
+    corner: int = 0
+    cell: int = 0
+    while True:
+        if position >= 0:
+            distances: FloatArray = np.hypot(
+                corners[:, :, 0] - points[position, 0], corners[:, :, 1] - points[position, 1]
+            )
+            distances[~unvisited] = math.inf
+            cell, corner = divmod(int(np.argmin(distances)), 4)
+        unvisited[cell] = False
+        segments: list[int] = cells[cell] if corner < 2 else cells[cell][::-1]
+        side: int = corner % 2
+        for segment in segments:
+            entry: int = 2 * segment + side
+            route.extend(transits.route(position, entry) if position >= 0 else [entry])
+            position = 2 * segment + 1 - side
+            route.append(position)
+            side = 1 - side
+        if not unvisited.any():
+            break
+    if finish is not None:
+        # Searched from the finish, the route back only needs reversing
+        back: list[int] = transits.route(points.shape[0] - 1, position)
+        route.extend(reversed(back[:-1]))
+
+    path: FloatArray = points[route]
+    x = path[:, 0].copy()
+    path[:, 0] = x * cos_a - path[:, 1] * sin_a
+    path[:, 1] = x * sin_a + path[:, 1] * cos_a
+    return path
+
+
+def remove_collinear(path: FloatArray, tolerance: float = COLLINEAR_TOLERANCE) -> FloatArray:
+    """
+    Drops the waypoints lying on the straight line between their neighbours, and
+    repeated waypoints, keeping the first and last
+
+    Parameters
+    ----------
+    path : NDArray[float64]
+        Array of shape (N, 2) of waypoints in meters
+    tolerance : float
+        Meters a waypoint may be off the line between its neighbours and be dropped
+
+    Returns
+    -------
+    path : NDArray[float64]
+        The waypoints left, in order
+    """
+    if path.shape[0] < 3:
+        return path
+    before: FloatArray = path[1:-1] - path[:-2]
+    after: FloatArray = path[2:] - path[1:-1]
+    across: FloatArray = path[2:] - path[:-2]
+    offset: FloatArray = np.abs(before[:, 0] * across[:, 1] - before[:, 1] * across[:, 0])
+    length: FloatArray = np.hypot(across[:, 0], across[:, 1])
+    # Waypoints where the path turns back are kept even when in line with their neighbours
+    onward: npt.NDArray[np.bool_] = np.einsum("ij,ij->i", before, after) >= 0.0
+    drop: npt.NDArray[np.bool_] = onward & (offset <= tolerance * np.maximum(length, 1e-9))
+    keep: npt.NDArray[np.bool_] = np.ones(path.shape[0], dtype=bool)
+    keep[1:-1] = ~drop
+    return path[keep]
+
+
+def path_waypoints(path: FloatArray, frame: geo.LocalFrame, altitude: float) -> FloatArray:
+    """
+    Returns the geodetic waypoints of a path in a local frame
+
+    Parameters
+    ----------
+    path : NDArray[float64]
+        Array of shape (N, 2) holding the east and north of every waypoint in meters
+    frame : LocalFrame
+        The local frame of the path
+    altitude : float
+        Altitude of every waypoint, in the unit and reference the caller flies them at
+
+    Returns
+    -------
+    waypoints : NDArray[float64]
+        Array of shape (N, 3) holding the latitude and longitude in degrees and the
+        altitude of every waypoint
+    """
+    enu: FloatArray = np.zeros((path.shape[0], 3), dtype=np.float64)
+    enu[:, :2] = path
+    waypoints: FloatArray = frame.from_enu_array(enu)
+    waypoints[:, 2] = altitude
+    return waypoints
+
+
+def coverage_waypoints(
+    area: Union[Polygon, MultiPolygon],
+    frame: geo.LocalFrame,
+    swath: float,
+    altitude: float,
+    angle: Optional[float] = None,
+) -> FloatArray:
+    """
+    Returns the geodetic waypoints of a simplified boustrophedon path covering an area
+
+    Parameters
+    ----------
+    area : Union[Polygon, MultiPolygon]
+        The area to cover, in meters of the local frame
+    frame : LocalFrame
+        The local frame of the area
+    swath : float
+        Width in meters of the ground the sensor sees across the path
+    altitude : float
+        Altitude of every waypoint, in the unit and reference the caller flies them at
+    angle : Optional[float]
+        Angle of the sweep lines counterclockwise from east in radians, or None for
+        the one needing the fewest lines
+
+    Returns
+    -------
+    waypoints : NDArray[float64]
+        Array of shape (N, 3) holding the latitude and longitude in degrees and the
+        altitude of every waypoint
+    """
+    return path_waypoints(remove_collinear(coverage_path(area, swath, angle)), frame, altitude)
@@ -0,0 +1,148 @@
+"""
+Plans the vertical speed of the landing descent. The time-minimal descent under a
+speed limit and a deceleration limit descends at the speed limit, then brakes as
+late as possible so the drone reaches the touchdown height at the touchdown speed.
+The plan is sampled once into an evenly spaced table, so looking up the commanded
+speed for an altitude inside the control loop is a constant time interpolation.
+"""
+import math
+from typing import NamedTuple
+
+from flight import geo
+
+MAX_TOUCHDOWN_SPEED: float = geo.feet_to_meters(1.5)  # m/s, downward speed at touchdown
+DECELERATION_MARGIN: float = 0.5  # Fraction of the vertical acceleration limit planned with
+TABLE_RESOLUTION: float = 0.1  # Meters of altitude between entries of the lookup table
+
+
+class DescentLimits(NamedTuple):
+    """
+    NamedTuple storing the vertical limits of the vehicle the descent is planned for.
+
+    Attributes
+    ----------
+    max_descent_rate : float
+        Maximum downward speed in m/s, PX4's MPC_Z_VEL_MAX_DN.
+    max_vertical_acceleration : float
+        Maximum vertical acceleration in m/s^2, PX4's MPC_ACC_DOWN_MAX.
+    """
+
+    max_descent_rate: float = 1.5
+    max_vertical_acceleration: float = 2.0
+
+
+class DescentProfile:
+    """
+    Lookup table of the downward speed to command at each altitude.
+
+    Attributes
+    ----------
+    floor : float
+        Altitude of the first table entry in meters, the touchdown height.
+    resolution : float
+        Meters of altitude between table entries.
+    speeds : list[float]
+        Downward speed in m/s at each table altitude, lowest altitude first.
+    duration : float
+        Predicted seconds to descend from the top of the table to the floor.
+    """
+
+    __slots__ = ("floor", "resolution", "speeds", "duration", "_scale", "_last")
+
+    def __init__(self, floor: float, resolution: float, speeds: list[float]) -> None:
+        self.floor: float = floor
+        self.resolution: float = resolution
+        self.speeds: list[float] = speeds
+
+        self._scale: float = 1.0 / resolution
+        self._last: int = len(speeds) - 1
+        # Time of each step at the mean speed of its ends
+        self.duration: float = sum(
+            2.0 * resolution / (speeds[index] + speeds[index + 1]) for index in range(self._last)
+        )
+
+    def rate(self, altitude: float) -> float:
+        """
+        Returns the downward speed to command at an altitude
+
+        Parameters
+        ----------
+        altitude : float
+            Altitude of the drone above the landing point in meters
+
+        Returns
+        -------
+        rate : float
+            Downward speed in m/s, clamped to the ends of the table outside it
+        """
+        position: float = (altitude - self.floor) * self._scale
+        if position <= 0.0:
+            return self.speeds[0]
+        index: int = int(position)
+        if index >= self._last:
+            return self.speeds[self._last]
+        fraction: float = position - index
+        return self.speeds[index] + (self.speeds[index + 1] - self.speeds[index]) * fraction
+
+
+def braking_speed(height: float, touchdown_speed: float, deceleration: float) -> float:
+    """
+    Returns the fastest downward speed from which the drone can still slow down to the
+    touchdown speed over a height
+
+    Parameters
+    ----------
+    height : float
+        Meters left above the touchdown height
+    touchdown_speed : float
+        Downward speed to reach the touchdown height at in m/s
+    deceleration : float
+        Deceleration available in m/s^2
+
+    Returns
+    -------
+    speed : float
+        Downward speed in m/s
+    """
+    return math.sqrt(touchdown_speed * touchdown_speed + 2.0 * deceleration * max(height, 0.0))
+
+
+def plan_descent(
+    start_altitude: float,
+    touchdown_height: float,
+    limits: DescentLimits = DescentLimits(),
+    touchdown_speed: float = MAX_TOUCHDOWN_SPEED,
+    resolution: float = TABLE_RESOLUTION,
+) -> DescentProfile:
+    """
+    Plans the time-minimal descent from an altitude to the touchdown height
+
+    Parameters
+    ----------
+    start_altitude : float
+        Altitude above the landing point the descent starts at in meters
+    touchdown_height : float
+        Altitude above the landing point the descent ends at in meters
+    limits : DescentLimits
+        Vertical limits of the vehicle
+    touchdown_speed : float
+        Maximum downward speed at the touchdown height in m/s
+    resolution : float
+        Meters of altitude between entries of the lookup table
+
+    Returns
+    -------
+    profile : DescentProfile
+        The descent as a lookup table from the touchdown height up to the start altitude
+    """
+    touchdown_speed = min(touchdown_speed, limits.max_descent_rate)
+    deceleration: float = limits.max_vertical_acceleration * DECELERATION_MARGIN
+    steps: int = max(1, math.ceil((start_altitude - touchdown_height) / resolution))
+    speeds: list[float] = [
+        min(
+            limits.max_descent_rate,
+            braking_speed(step * resolution, touchdown_speed, deceleration),
+        )
+        for step in range(steps + 1)
+    ]
+    return DescentProfile(touchdown_height, resolution, speeds)
@@ -0,0 +1,203 @@
+"""
+Streaming estimator of the horizontal drift of the drone and of how far its velocity
+lags behind the commands sent to it. The landing controller uses it to predict where
+the drone will be when its next setpoint goes out, and cancels the drift with
+feed-forward instead of waiting for the position error it causes.
+
+On each axis the velocity follows the commanded velocity u as a first order lag
+
+    dv/dt = (u + d - v) / T
+
+where the drift d is the part of the wind the flight controller has not cancelled
+yet, and the lag T lumps the telemetry latency and the response of the drone
+together. As dv/dt = a (u - v) + c with a = 1 / T and c = d / T the model is linear
+in [a, c_east, c_north], which recursive least squares fits one velocity sample at a
+time in constant time, with no history kept.
+"""
+import math
+from typing import Any
+
+from mavsdk.telemetry import Position, VelocityNed
+
+from flight import geo
+
+INITIAL_LAG: float = 0.5  # Seconds, the lag assumed before the fit has seen any samples
+MIN_LAG: float = 0.05  # Seconds, the fitted lag is kept within MIN_LAG and MAX_LAG
+MAX_LAG: float = 3.0
+MAX_SAMPLE_GAP: float = 1.0  # Seconds between velocity samples beyond which a pair is not fitted
+INITIAL_VARIANCE: tuple[float, float, float] = (4.0, 1.0, 1.0)  # Of [a, c_east, c_north]
+PARAMETER_WANDER: tuple[float, float, float] = (0.5, 0.2, 0.2)  # Variance growth per second
+ACCELERATION_NOISE: float = 1.0  # (m/s^2)^2, variance of the measured acceleration
+
+
+class DriftEstimator:
+    """
+    Fits the drift and lag of the drone from its position and velocity streams and the
+    velocity setpoints sent to it. update() is a telemetry hub listener.
+
+    Attributes
+    ----------
+    frame : LocalFrame
+        Local frame positions are estimated in, anchored on the target.
+    position : tuple[float, float]
+        East and north position in meters at the latest position sample.
+    velocity : tuple[float, float]
+        East and north velocity in m/s at the latest velocity sample.
+    command : tuple[float, float]
+        East and north velocity setpoint in m/s currently in effect.
+    fits : int
+        The number of velocity samples fitted.
+    """
+
+    def __init__(self, frame: geo.LocalFrame) -> None:
+        self.frame: geo.LocalFrame = frame
+        self.position: tuple[float, float] = (0.0, 0.0)
+        self.velocity: tuple[float, float] = (0.0, 0.0)
+        self.command: tuple[float, float] = (0.0, 0.0)
+        self.fits: int = 0
+
+        self._position_time: float = math.nan
+        self._velocity_time: float = math.nan
+        # Parameters [a, c_east, c_north] and their covariance, row by row
+        self._theta: list[float] = [1.0 / INITIAL_LAG, 0.0, 0.0]
+        self._covariance: list[list[float]] = [
+            [INITIAL_VARIANCE[row] if row == column else 0.0 for column in range(3)]
+            for row in range(3)
+        ]
+        # Integral of the setpoints since the last velocity sample, for their mean
+        self._command_time: float = math.nan
+        self._command_integral: list[float] = [0.0, 0.0]
+
+    @property
+    def lag(self) -> float:
+        """
+        Seconds the velocity of the drone lags behind its setpoints, telemetry included
+        """
+        return 1.0 / self._theta[0]
+
+    @property
+    def drift(self) -> tuple[float, float]:
+        """
+        East and north velocity in m/s the drone drifts with on top of its setpoint
+        """
+        return self._theta[1] / self._theta[0], self._theta[2] / self._theta[0]
+
+    def update(self, name: str, sample: Any, now: float) -> None:
+        """
+        Feeds one position or velocity sample to the estimator
+
+        Parameters
+        ----------
+        name : str
+            The hub name of the stream, position or velocity
+        sample : Any
+            The Position or VelocityNed sample
+        now : float
+            Time the sample arrived at in seconds
+        """
+        if name == "position":
+            position: Position = sample
+            east, north, _ = self.frame.to_enu(position.latitude_deg, position.longitude_deg)
+            self.position = (east, north)
+            self._position_time = now
+        elif name == "velocity":
+            velocity: VelocityNed = sample
+            self._fit(velocity.east_m_s, velocity.north_m_s, now)
+
+    def set_command(self, east: float, north: float, now: float) -> None:
+        """
+        Records a velocity setpoint sent to the drone
+
+        Parameters
+        ----------
+        east : float
+            East velocity in m/s
+        north : float
+            North velocity in m/s
+        now : float
+            Time the setpoint was sent at in seconds
+        """
+        self._integrate_command(now)
+        self.command = (east, north)
+
+    def predict(self, time: float) -> tuple[float, float]:
+        """
+        Predicts the position of the drone at a time, from the latest position and
+        velocity samples, assuming the current setpoint and drift hold until then
+
+        Parameters
+        ----------
+        time : float
+            The time to predict the position at in seconds, the event loop clock
+
+        Returns
+        -------
+        position : tuple[float, float]
+            East and north position in meters
+        """
+        horizon: float = time - self._position_time
+        if not horizon > 0.0:
+            return self.position
+        lag: float = self.lag
+        # Share of the way from the current velocity to the settled one covered in the horizon
+        settled_share: float = horizon - lag * (1.0 - math.exp(-horizon / lag))
+        drift: tuple[float, float] = self.drift
+        predicted: list[float] = []
+        for axis in range(2):
+            settled: float = self.command[axis] + drift[axis]
+            predicted.append(
+                self.position[axis]
+                + self.velocity[axis] * horizon
+                + (settled - self.velocity[axis]) * settled_share
+            )
+        return predicted[0], predicted[1]
+
+    def _integrate_command(self, now: float) -> None:
+        if not math.isnan(self._command_time):
+            elapsed: float = now - self._command_time
+            self._command_integral[0] += self.command[0] * elapsed
+            self._command_integral[1] += self.command[1] * elapsed
+        self._command_time = now
+
+    def _fit(self, east: float, north: float, now: float) -> None:
+        elapsed: float = now - self._velocity_time
+        self._integrate_command(now)
+        previous: tuple[float, float] = self.velocity
+        self.velocity = (east, north)
+        self._velocity_time = now
+        integral: list[float] = self._command_integral
+        mean_command: tuple[float, float] = (0.0, 0.0)
+        if elapsed > 0.0:
+            mean_command = (integral[0] / elapsed, integral[1] / elapsed)
+        integral[0] = integral[1] = 0.0
+        if not 0.0 < elapsed <= MAX_SAMPLE_GAP:
+            return
+
+        covariance: list[list[float]] = self._covariance
+        for index in range(3):
+            covariance[index][index] += PARAMETER_WANDER[index] * elapsed
+        # One scalar update per axis: acceleration = a (u - v) + c_axis
+        for axis in range(2):
+            regressor: list[float] = [mean_command[axis] - previous[axis], 0.0, 0.0]
+            regressor[axis + 1] = 1.0
+            acceleration: float = (self.velocity[axis] - previous[axis]) / elapsed
+            self._update(regressor, acceleration)
+        self._theta[0] = min(max(self._theta[0], 1.0 / MAX_LAG), 1.0 / MIN_LAG)
+        self.fits += 1
+
+    def _update(self, regressor: list[float], measured: float) -> None:
+        theta: list[float] = self._theta
+        covariance: list[list[float]] = self._covariance
+        spread: list[float] = [
+            sum(covariance[row][column] * regressor[column] for column in range(3))
+            for row in range(3)
+        ]
+        innovation_variance: float = ACCELERATION_NOISE + sum(
+            regressor[row] * spread[row] for row in range(3)
+        )
+        error: float = measured - sum(regressor[row] * theta[row] for row in range(3))
+        for row in range(3):
+            gain: float = spread[row] / innovation_variance
+            theta[row] += gain * error
+            for column in range(3):
+                covariance[row][column] -= gain * spread[column]
@@ -0,0 +1,185 @@
+"""
+Fleets of vehicles flown at the same time from one run. A fleet file lists every
+vehicle with its own system address, and optionally its own mavsdk_server gRPC port,
+target data file and search of the field:
+
+    {
+        "vehicles": [
+            {"name": "alpha", "address": "udp://:14540"},
+            {
+                "name": "bravo",
+                "address": "udp://:14541",
+                "server_port": 50061,                   # counted up from 50051 if not given
+                "target": "flight/data/golf_target.json", # the field default if not given
+                "search_swath_m": 20.0                  # no search if not given
+            }
+        ]
+    }
+
+Each vehicle flies the full run.start_flight pipeline with its own connection,
+telemetry hub, flight recording and log name, so vehicles never share state.
+"""
+import json
+import re
+from typing import Any, NamedTuple, Optional
+
+DEFAULT_NAME: str = "drone"  # Name of the vehicle when a single one is flown
+NAME_PATTERN: re.Pattern[str] = re.compile(r"[A-Za-z0-9_-]+")  # Names end up in file names
+SIM_FLEET_ADDRESS: str = "sim:///{name}"  # Offline simulator address of a generated vehicle
+
+
+class FleetError(ValueError):
+    """
+    Exception for when a fleet file does not match the schema
+    """
+
+
+class Vehicle(NamedTuple):
+    """
+    NamedTuple storing how to reach and fly a single vehicle of a fleet.
+
+    Attributes
+    ----------
+    name : str
+        The name of the vehicle, in its logs, metrics and flight recording.
+    address : str
+        The MAVSDK system address of the vehicle.
+    server_port : Optional[int]
+        The gRPC port of its mavsdk_server, or None for the next free one.
+    target_file : Optional[str]
+        The target data file it flies to, or None for the one of the field.
+    search_swath : Optional[float]
+        The swath in meters of the search of the field it flies first, or None to fly
+        straight to the target.
+    """
+
+    name: str
+    address: str
+    server_port: Optional[int] = None
+    target_file: Optional[str] = None
+    search_swath: Optional[float] = None
+
+
+def _text(data: dict[str, Any], key: str, where: str) -> Optional[str]:
+    value: Any = data.get(key)
+    if value is not None and (not isinstance(value, str) or not value):
+        raise FleetError(f"{where}.{key} must be a non-empty string, got {value!r}")
+    return value
+
+
+def parse_fleet(json_data: Any) -> list[Vehicle]:
+    """
+    Validates the contents of a fleet file
+
+    Parameters
+    ----------
+    json_data : Any
+        The decoded JSON document
+
+    Returns
+    -------
+    vehicles : list[Vehicle]
+        The vehicles in the file, in order
+
+    Raises
+    ------
+    FleetError
+        If the document does not match the schema, or two vehicles share a name,
+        address or server port
+    """
+    if not isinstance(json_data, dict):
+        raise FleetError("The file must hold a JSON object")
+    raw_vehicles: Any = json_data.get("vehicles")
+    if not isinstance(raw_vehicles, list) or not raw_vehicles:
+        raise FleetError("vehicles must be a list holding at least one vehicle")
+
+    vehicles: list[Vehicle] = []
+    for index, raw in enumerate(raw_vehicles):
+        where: str = f"vehicles[{index}]"
+        if not isinstance(raw, dict):
+            raise FleetError(f"{where} must be an object")
+        name: Optional[str] = _text(raw, "name", where)
+        if name is None or not NAME_PATTERN.fullmatch(name):
+            raise FleetError(f"{where}.name must be letters, digits, - and _, got {name!r}")
+        address: Optional[str] = _text(raw, "address", where)
+        if address is None:
+            raise FleetError(f"{where}.address is missing")
+        server_port: Any = raw.get("server_port")
+        if server_port is not None and (
+            isinstance(server_port, bool)
+            or not isinstance(server_port, int)
+            or not 0 < server_port < 65536
+        ):
+            raise FleetError(f"{where}.server_port must be a port number, got {server_port!r}")
+        search_swath: Any = raw.get("search_swath_m")
+        if search_swath is not None and (
+            isinstance(search_swath, bool)
+            or not isinstance(search_swath, (int, float))
+            or not search_swath > 0.0
+        ):
+            raise FleetError(
+                f"{where}.search_swath_m must be positive meters, got {search_swath!r}"
+            )
+        vehicles.append(
+            Vehicle(
+                name,
+                address,
+                server_port,
+                _text(raw, "target", where),
+                None if search_swath is None else float(search_swath),
+            )
+        )
+
+    for field in ("name", "address", "server_port"):
+        values: list[Any] = [
+            getattr(vehicle, field) for vehicle in vehicles if getattr(vehicle, field) is not None
+        ]
+        if len(set(values)) != len(values):
+            raise FleetError(f"Every vehicle needs its own {field}")
+    return vehicles
+
+
+def read_fleet(path: str) -> list[Vehicle]:
+    """
+    Reads a fleet file. It is read once before any event loop starts, so it is read
+    directly rather than in a worker thread.
+
+    Parameters
+    ----------
+    path : str
+        File path to the fleet JSON file.
+
+    Returns
+    -------
+    vehicles : list[Vehicle]
+        The vehicles in the file, in order
+
+    Raises
+    ------
+    FleetError
+        If the file does not match the schema
+    """
+    try:
+        with open(path, encoding="UTF-8") as data_file:
+            return parse_fleet(json.load(data_file))
+    except FleetError as ex:
+        raise FleetError(f"{path}: {ex}") from ex
+
+
+def simulated_fleet(count: int) -> list[Vehicle]:
+    """
+    Returns a fleet of vehicles flown by the offline simulator, all from the default
+    home position
+
+    Parameters
+    ----------
+    count : int
+        The number of vehicles
+
+    Returns
+    -------
+    vehicles : list[Vehicle]
+        The vehicles, named sim-00, sim-01 and so on
+    """
+    names: list[str] = [f"sim-{index:02d}" for index in range(count)]
+    return [Vehicle(name, SIM_FLEET_ADDRESS.format(name=name)) for name in names]
@@ -2,8 +2,11 @@
 import logging
 from mavsdk import System
 from mavsdk.core import ConnectionState
+from flight import triggers
+from flight.telemetry_hub import get_hub
 
 SIM_ADDR: str = "udp://:14540"  # Address to connect to the simulator
+OFFLINE_ADDR: str = "sim://"  # Address of the built-in offline simulator
 CONTROLLER_ADDR: str = "serial:///dev/ttyUSB0"  # Address to connect to a pixhawk board
 
 
@@ -12,8 +15,6 @@ class DroneNotFoundError(Exception):
     Exception for when the drone doesn't connect
     """
 
-    logging.warning("DRONE NOT FOUND!")
-
 
 async def log_flight_mode(drone: System) -> None:
     """
@@ -28,7 +29,7 @@ async def log_flight_mode(drone: System) -> None:
     previous_flight_mode: str = ""
     flight_mode: str
 
-    async for flight_mode in drone.telemetry.flight_mode():
+    async for flight_mode in get_hub(drone).samples("flight_mode"):
         if flight_mode is not previous_flight_mode:
             previous_flight_mode = flight_mode
             logging.debug("Flight mode: %s", flight_mode)
@@ -45,15 +46,9 @@ async def observe_is_in_air(drone: System) -> None:
         MAVSDK object for drone control
     """
 
-    was_in_air: bool = False
-    is_in_air: bool
-
-    async for is_in_air in drone.telemetry.in_air():
-        if is_in_air:
-            was_in_air = is_in_air
-
-        if was_in_air and not is_in_air:
-            return
+    engine: triggers.TriggerEngine = triggers.get_engine(drone)
+    await engine.wait(triggers.in_air("takeoff", True))
+    await engine.wait(triggers.in_air("landed", False))
 
 
 async def wait_for_drone(drone: System) -> None:
@@ -69,17 +64,5 @@ async def wait_for_drone(drone: System) -> None:
     state: ConnectionState
     async for state in drone.core.connection_state():
         if state.is_connected:
-            logging.info("Connected to drone with UUID: %s", state.uuid)
+            logging.info("Connected to drone")
             return
-
-
-async def check_for_exit() -> None:
-    """
-    Checks if program was ended through manual keyboard input
-    """
-    try:
-        pass
-    except KeyboardInterrupt:
-        # Ctrl-C was pressed
-        logging.info("Ctrl-C Pressed, quitting program")
-        quit()
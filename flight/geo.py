@@ -0,0 +1,326 @@
+"""
+Conversions between latitude/longitude/altitude and local East-North-Up meters,
+plus unit conversions and distance and bearing helpers, so the rest of the
+flight code never converts degrees, feet and meters inline.
+
+The local frame is the azimuthal equidistant projection PX4 uses for its own
+local position, so offsets computed here match the vehicle's local frame.
+"""
+import math
+
+import numpy as np
+import numpy.typing as npt
+
+EARTH_RADIUS: float = 6_371_000.0  # Meters, the spherical earth radius used by PX4
+FEET_TO_METERS: float = 0.3048
+METERS_TO_FEET: float = 1.0 / FEET_TO_METERS
+
+FloatArray = npt.NDArray[np.float64]
+
+
+def feet_to_meters(feet: float) -> float:
+    """
+    Converts a length in feet to meters
+
+    Parameters
+    ----------
+    feet : float
+        Length in feet
+
+    Returns
+    -------
+    meters : float
+        Length in meters
+    """
+    return feet * FEET_TO_METERS
+
+
+def meters_to_feet(meters: float) -> float:
+    """
+    Converts a length in meters to feet
+
+    Parameters
+    ----------
+    meters : float
+        Length in meters
+
+    Returns
+    -------
+    feet : float
+        Length in feet
+    """
+    return meters * METERS_TO_FEET
+
+
+class LocalFrame:
+    """
+    Local East-North-Up frame anchored at a reference point, with the
+    trigonometry of the anchor precomputed once.
+
+    Attributes
+    ----------
+    latitude : float
+        Latitude of the anchor in degrees.
+    longitude : float
+        Longitude of the anchor in degrees.
+    altitude : float
+        Altitude of the anchor in meters, in the same reference as the altitudes converted.
+    """
+
+    __slots__ = ("latitude", "longitude", "altitude", "_lat", "_lon", "_sin_lat", "_cos_lat")
+
+    def __init__(self, latitude: float, longitude: float, altitude: float = 0.0) -> None:
+        self.latitude: float = latitude
+        self.longitude: float = longitude
+        self.altitude: float = altitude
+
+        self._lat: float = math.radians(latitude)
+        self._lon: float = math.radians(longitude)
+        self._sin_lat: float = math.sin(self._lat)
+        self._cos_lat: float = math.cos(self._lat)
+
+    def to_enu(
+        self, latitude: float, longitude: float, altitude: float = 0.0
+    ) -> tuple[float, float, float]:
+        """
+        Converts one geodetic point to local meters
+
+        Parameters
+        ----------
+        latitude : float
+            Latitude of the point in degrees
+        longitude : float
+            Longitude of the point in degrees
+        altitude : float
+            Altitude of the point in meters
+
+        Returns
+        -------
+        enu : tuple[float, float, float]
+            East, north and up offsets from the anchor in meters
+        """
+        lat: float = math.radians(latitude)
+        d_lon: float = math.radians(longitude) - self._lon
+        sin_lat: float = math.sin(lat)
+        cos_lat: float = math.cos(lat)
+        cos_d_lon: float = math.cos(d_lon)
+
+        arg: float = self._sin_lat * sin_lat + self._cos_lat * cos_lat * cos_d_lon
+        c: float = math.acos(min(max(arg, -1.0), 1.0))
+        k: float = c / math.sin(c) if c > 1e-12 else 1.0
+
+        east: float = k * cos_lat * math.sin(d_lon) * EARTH_RADIUS
+        north: float = (
+            k * (self._cos_lat * sin_lat - self._sin_lat * cos_lat * cos_d_lon) * EARTH_RADIUS
+        )
+        return east, north, altitude - self.altitude
+
+    def from_enu(self, east: float, north: float, up: float = 0.0) -> tuple[float, float, float]:
+        """
+        Converts one local point back to geodetic coordinates
+
+        Parameters
+        ----------
+        east : float
+            East offset from the anchor in meters
+        north : float
+            North offset from the anchor in meters
+        up : float
+            Up offset from the anchor in meters
+
+        Returns
+        -------
+        position : tuple[float, float, float]
+            Latitude and longitude in degrees and altitude in meters
+        """
+        x: float = north / EARTH_RADIUS
+        y: float = east / EARTH_RADIUS
+        c: float = math.hypot(x, y)
+        if c < 1e-12:
+            return self.latitude, self.longitude, self.altitude + up
+
+        sin_c: float = math.sin(c)
+        cos_c: float = math.cos(c)
+        lat: float = math.asin(cos_c * self._sin_lat + x * sin_c * self._cos_lat / c)
+        lon: float = self._lon + math.atan2(
+            y * sin_c, c * self._cos_lat * cos_c - x * self._sin_lat * sin_c
+        )
+        return math.degrees(lat), math.degrees(lon), self.altitude + up
+
+    def to_enu_array(
+        self,
+        latitude: npt.ArrayLike,
+        longitude: npt.ArrayLike,
+        altitude: npt.ArrayLike = 0.0,
+    ) -> FloatArray:
+        """
+        Converts arrays of geodetic points to local meters in one vectorized pass
+
+        Parameters
+        ----------
+        latitude : ArrayLike
+            Latitudes in degrees
+        longitude : ArrayLike
+            Longitudes in degrees
+        altitude : ArrayLike
+            Altitudes in meters
+
+        Returns
+        -------
+        enu : NDArray[float64]
+            Array of shape (N, 3) holding the east, north and up offsets in meters
+        """
+        lat: FloatArray = np.radians(np.asarray(latitude, dtype=np.float64))
+        d_lon: FloatArray = np.radians(np.asarray(longitude, dtype=np.float64)) - self._lon
+        sin_lat: FloatArray = np.sin(lat)
+        cos_lat: FloatArray = np.cos(lat)
+        cos_d_lon: FloatArray = np.cos(d_lon)
+
+        arg: FloatArray = self._sin_lat * sin_lat + self._cos_lat * cos_lat * cos_d_lon
+        c: FloatArray = np.arccos(np.clip(arg, -1.0, 1.0))
+        sin_c: FloatArray = np.sin(c)
+        k: FloatArray = np.ones_like(c)
+        np.divide(c, sin_c, out=k, where=c > 1e-12)
+
+        enu: FloatArray = np.empty((lat.size, 3), dtype=np.float64)
+        enu[:, 0] = (k * cos_lat * np.sin(d_lon) * EARTH_RADIUS).ravel()
+        enu[:, 1] = (
+            k * (self._cos_lat * sin_lat - self._sin_lat * cos_lat * cos_d_lon) * EARTH_RADIUS
+        ).ravel()
+        enu[:, 2] = np.broadcast_to(
+            np.asarray(altitude, dtype=np.float64) - self.altitude, lat.shape
+        ).ravel()
+        return enu
+
+    def from_enu_array(self, enu: npt.ArrayLike) -> FloatArray:
+        """
+        Converts an array of local points back to geodetic coordinates in one vectorized pass
+
+        Parameters
+        ----------
+        enu : ArrayLike
+            Array of shape (N, 3) holding east, north and up offsets in meters
+
+        Returns
+        -------
+        positions : NDArray[float64]
+            Array of shape (N, 3) holding latitudes and longitudes in degrees
+            and altitudes in meters
+        """
+        points: FloatArray = np.asarray(enu, dtype=np.float64).reshape(-1, 3)
+        x: FloatArray = points[:, 1] / EARTH_RADIUS
+        y: FloatArray = points[:, 0] / EARTH_RADIUS
+        c: FloatArray = np.hypot(x, y)
+        sin_c: FloatArray = np.sin(c)
+        cos_c: FloatArray = np.cos(c)
+
+        # x * sin(c) / c tends to x as c goes to 0
+        x_ratio: FloatArray = x.copy()
+        np.divide(x * sin_c, c, out=x_ratio, where=c > 1e-12)
+
+        positions: FloatArray = np.empty_like(points)
+        positions[:, 0] = np.degrees(
+            np.arcsin(np.clip(cos_c * self._sin_lat + x_ratio * self._cos_lat, -1.0, 1.0))
+        )
+        positions[:, 1] = np.degrees(
+            self._lon + np.arctan2(y * sin_c, c * self._cos_lat * cos_c - x * self._sin_lat * sin_c)
+        )
+        positions[:, 2] = points[:, 2] + self.altitude
+        return positions
+
+
+def distance(latitude_1: float, longitude_1: float, latitude_2: float, longitude_2: float) -> float:
+    """
+    Returns the great circle distance between two points
+
+    Parameters
+    ----------
+    latitude_1 : float
+        Latitude of the first point in degrees
+    longitude_1 : float
+        Longitude of the first point in degrees
+    latitude_2 : float
+        Latitude of the second point in degrees
+    longitude_2 : float
+        Longitude of the second point in degrees
+
+    Returns
+    -------
+    distance : float
+        Distance between the points in meters
+    """
+    lat_1: float = math.radians(latitude_1)
+    lat_2: float = math.radians(latitude_2)
+    half_d_lat: float = (lat_2 - lat_1) / 2.0
+    half_d_lon: float = math.radians(longitude_2 - longitude_1) / 2.0
+    a: float = (
+        math.sin(half_d_lat) ** 2 + math.cos(lat_1) * math.cos(lat_2) * math.sin(half_d_lon) ** 2
+    )
+    return 2.0 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distance_array(
+    latitude_1: npt.ArrayLike,
+    longitude_1: npt.ArrayLike,
+    latitude_2: npt.ArrayLike,
+    longitude_2: npt.ArrayLike,
+) -> FloatArray:
+    """
+    Returns the great circle distances between arrays of points
+
+    Parameters
+    ----------
+    latitude_1 : ArrayLike
+        Latitudes of the first points in degrees
+    longitude_1 : ArrayLike
+        Longitudes of the first points in degrees
+    latitude_2 : ArrayLike
+        Latitudes of the second points in degrees
+    longitude_2 : ArrayLike
+        Longitudes of the second points in degrees
+
+    Returns
+    -------
+    distances : NDArray[float64]
+        Distances between the points in meters
+    """
+    lat_1: FloatArray = np.radians(np.asarray(latitude_1, dtype=np.float64))
+    lat_2: FloatArray = np.radians(np.asarray(latitude_2, dtype=np.float64))
+    half_d_lat: FloatArray = (lat_2 - lat_1) / 2.0
+    half_d_lon: FloatArray = (
+        np.radians(np.asarray(longitude_2, dtype=np.float64) - np.asarray(longitude_1)) / 2.0
+    )
+    a: FloatArray = (
+        np.sin(half_d_lat) ** 2 + np.cos(lat_1) * np.cos(lat_2) * np.sin(half_d_lon) ** 2
+    )
+    return 2.0 * EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def bearing(latitude_1: float, longitude_1: float, latitude_2: float, longitude_2: float) -> float:
+    """
+    Returns the initial bearing from the first point to the second
+
+    Parameters
+    ----------
+    latitude_1 : float
+        Latitude of the first point in degrees
+    longitude_1 : float
+        Longitude of the first point in degrees
+    latitude_2 : float
+        Latitude of the second point in degrees
+    longitude_2 : float
+        Longitude of the second point in degrees
+
+    Returns
+    -------
+    bearing : float
+        Bearing in degrees clockwise from north, in [0, 360)
+    """
+    lat_1: float = math.radians(latitude_1)
+    lat_2: float = math.radians(latitude_2)
+    d_lon: float = math.radians(longitude_2 - longitude_1)
+    y: float = math.sin(d_lon) * math.cos(lat_2)
+    x: float = math.cos(lat_1) * math.sin(lat_2) - math.sin(lat_1) * math.cos(lat_2) * math.cos(
+        d_lon
+    )
+    return math.degrees(math.atan2(y, x)) % 360.0
@@ -0,0 +1,478 @@
+"""
+Geofence of the flight field. Inclusion polygons the drone must stay inside and
+exclusion polygons it must stay out of are loaded from a JSON file next to the target
+data files, with positions in degrees:
+
+    {
+        "enforce": true,                # end the flight on a breach, for surveyed boundaries
+        "margin_m": 5.0,                # meters kept from every boundary
+        "inclusion": {"field": [[37.9, -91.7], [37.9, -91.8], [38.0, -91.8]]},
+        "exclusion": {"pond": [[37.95, -91.78], [37.95, -91.79], [37.96, -91.79]]}
+    }
+
+A breach of a geofence that is not enforced is logged but leaves the flight going, as
+boundaries that were never surveyed would end flights on false breaches.
+
+The polygons are projected once into a local frame in meters, grown or shrunk by the
+margin and prepared, and the exclusions are indexed with an STRtree. A passing check
+also remembers how far the position was from the nearest boundary, so the following
+samples within that distance pass with a single distance comparison and most checks
+never touch Shapely at all.
+"""
+import asyncio
+import json
+import logging
+import math
+import warnings
+from typing import Any, Awaitable, Callable, Optional
+
+import numpy as np
+import numpy.typing as npt
+from mavsdk.telemetry import Position
+from shapely.errors import ShapelyDeprecationWarning
+from shapely.geometry import JOIN_STYLE, Point, Polygon
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import unary_union
+from shapely.prepared import PreparedGeometry, prep
+from shapely.strtree import STRtree
+
+from flight import geo
+from flight.telemetry_hub import TelemetryHub
+
+GEOFENCE_FILE: str = "flight/data/geofence.json"  # Competition field
+GOLF_GEOFENCE_FILE: str = "flight/data/golf_geofence.json"  # Golf course test field
+MARGIN: float = 5.0  # Meters kept from every boundary when the file gives no margin
+BREACH_SAMPLES: int = 3  # Consecutive breaching samples before the failsafe, ignoring GPS spikes
+PATH_SPACING: float = 1.0  # Meters between the points of a planned path that are checked
+
+
+class GeofenceError(ValueError):
+    """
+    Exception for when a geofence file does not match the schema
+    """
+
+
+class Geofence:
+    """
+    Inclusion and exclusion zones in a local frame, ready for fast point checks.
+
+    Attributes
+    ----------
+    frame : LocalFrame
+        Local frame the zones are projected into, anchored at the mean of their vertices.
+    margin : float
+        Meters the drone must keep from every boundary.
+    inclusion : dict[str, Polygon]
+        Zones the drone must stay inside, by name, in local meters.
+    exclusion : dict[str, Polygon]
+        Zones the drone must stay out of, by name, in local meters.
+    enforced : bool
+        Whether a breach triggers the failsafe, only for surveyed boundaries.
+    """
+
+    def __init__(
+        self,
+        frame: geo.LocalFrame,
+        inclusion: dict[str, Polygon],
+        exclusion: dict[str, Polygon],
+        margin: float = MARGIN,
+        enforced: bool = False,
+    ) -> None:
+        self.frame: geo.LocalFrame = frame
+        self.margin: float = margin
+        self.enforced: bool = enforced
+        self.inclusion: dict[str, Polygon] = inclusion
+        self.exclusion: dict[str, Polygon] = exclusion
+
+        # Where the drone may be: inside an inclusion zone by at least the margin
+        self._allowed: Optional[BaseGeometry] = None
+        self._allowed_boundary: Optional[BaseGeometry] = None
+        self._allowed_prepared: Optional[PreparedGeometry] = None
+        self._inclusion_label: str = ", ".join(inclusion)
+        if inclusion:
+            allowed: BaseGeometry = unary_union(list(inclusion.values())).buffer(
+                -margin, join_style=JOIN_STYLE.mitre
+            )
+            if allowed.is_empty:
+                raise GeofenceError(f"The inclusion zones are narrower than twice {margin} m")
+            self._allowed = allowed
+            self._allowed_prepared = prep(allowed)
+            # Shapely builds a new geometry on every boundary access, so it is kept
+            self._allowed_boundary = allowed.boundary
+
+        # Where the drone may not be: inside an exclusion zone or within the margin of one
+        self._exclusion_names: list[str] = list(exclusion)
+        # Mitred corners keep the vertex count, and so the clearance checks, small
+        self._keep_out: list[BaseGeometry] = [
+            zone.buffer(margin, join_style=JOIN_STYLE.mitre) for zone in exclusion.values()
+        ]
+        self._keep_out_prepared: list[PreparedGeometry] = [prep(zone) for zone in self._keep_out]
+        self._keep_out_bounds: list[tuple[float, float, float, float]] = [
+            zone.bounds for zone in self._keep_out
+        ]
+        self._tree: Optional[STRtree] = None
+        if self._keep_out:
+            with warnings.catch_warnings():
+                # Shapely 1.8 warns that Shapely 2 changes the STRtree API, the pinned 1.8
+                # API used here queries item indices
+                warnings.simplefilter("ignore", ShapelyDeprecationWarning)
+                self._tree = STRtree(self._keep_out)
+
+        # Circle around the last passing check that holds no boundary
+        self._safe_east: float = 0.0
+        self._safe_north: float = 0.0
+        self._safe_radius_squared: float = -1.0
+
+    def check(self, latitude: float, longitude: float) -> Optional[str]:
+        """
+        Checks a position against every zone
+
+        Parameters
+        ----------
+        latitude : float
+            Latitude in degrees
+        longitude : float
+            Longitude in degrees
+
+        Returns
+        -------
+        zone : Optional[str]
+            None if the position keeps the margin from every zone, otherwise the name of
+            the exclusion zone it is in or the names of the inclusion zones it left
+        """
+        east, north, _ = self.frame.to_enu(latitude, longitude)
+        return self.check_local(east, north)
+
+    def check_local(self, east: float, north: float) -> Optional[str]:
+        """
+        Checks a position in the local frame against every zone
+
+        Parameters
+        ----------
+        east : float
+            East position in meters
+        north : float
+            North position in meters
+
+        Returns
+        -------
+        zone : Optional[str]
+            None if the position keeps the margin from every zone, otherwise the name of
+            the exclusion zone it is in or the names of the inclusion zones it left
+        """
+        offset_east: float = east - self._safe_east
+        offset_north: float = north - self._safe_north
+        if offset_east * offset_east + offset_north * offset_north < self._safe_radius_squared:
+            return None
+
+        point: Point = Point(east, north)
+        if self._allowed_prepared is not None and not self._allowed_prepared.contains(point):
+            return self._inclusion_label
+        if self._tree is not None:
+            for index in self._tree.query_items(point):
+                if self._keep_out_prepared[index].contains(point):
+                    return self._exclusion_names[index]
+
+        clearance: float = self._clearance(point, east, north, exact=False)
+        self._safe_east = east
+        self._safe_north = north
+        self._safe_radius_squared = clearance * clearance
+        return None
+
+    def check_path(
+        self, path: npt.NDArray[np.float64], spacing: float = PATH_SPACING
+    ) -> Optional[str]:
+        """
+        Checks a planned path in the local frame, at points along every leg
+
+        Parameters
+        ----------
+        path : NDArray[float64]
+            Array of shape (N, 2) holding the east and north of every waypoint in meters
+        spacing : float
+            Meters at most between two points checked along a leg
+
+        Returns
+        -------
+        breach : Optional[str]
+            None if the whole path keeps the margin from every zone, otherwise the leg
+            and the zone of the first breach
+        """
+        for leg, (start, end) in enumerate(zip(path[:-1].tolist(), path[1:].tolist())):
+            steps: int = max(1, math.ceil(math.dist(start, end) / spacing))
+            for step in range(steps + 1):
+                share: float = step / steps
+                zone: Optional[str] = self.check_local(
+                    start[0] + (end[0] - start[0]) * share, start[1] + (end[1] - start[1]) * share
+                )
+                if zone is not None:
+                    return f"leg {leg} in {zone}"
+        return None
+
+    def allowed_area(self, clearance: float = 0.0) -> BaseGeometry:
+        """
+        Returns where the drone may fly, shrunk so every point of it is further than the
+        margin and a clearance from each boundary, built like the zones the checks use
+
+        Parameters
+        ----------
+        clearance : float
+            Meters kept from each boundary on top of the margin
+
+        Returns
+        -------
+        area : BaseGeometry
+            The area in local meters, possibly empty
+
+        Raises
+        ------
+        GeofenceError
+            If the geofence has no inclusion zone, which leaves the area unbounded
+        """
+        if self._allowed is None:
+            raise GeofenceError("A geofence without inclusion zones does not bound an area")
+        area: BaseGeometry = self._allowed.buffer(-clearance, join_style=JOIN_STYLE.mitre)
+        if self._keep_out:
+            area = area.difference(
+                unary_union(self._keep_out).buffer(clearance, join_style=JOIN_STYLE.mitre)
+            )
+        return area
+
+    def clearance(self, latitude: float, longitude: float) -> float:
+        """
+        Returns how far a position is from breaching the geofence
+
+        Parameters
+        ----------
+        latitude : float
+            Latitude in degrees
+        longitude : float
+            Longitude in degrees
+
+        Returns
+        -------
+        clearance : float
+            Meters to the nearest boundary grown or shrunk by the margin, zero if the
+            position already breaches it
+        """
+        east, north, _ = self.frame.to_enu(latitude, longitude)
+        if self.check_local(east, north) is not None:
+            return 0.0
+        return self._clearance(Point(east, north), east, north, exact=True)
+
+    def _clearance(self, point: Point, east: float, north: float, exact: bool) -> float:
+        clearance: float = math.inf
+        if self._allowed_boundary is not None:
+            clearance = self._allowed_boundary.distance(point)
+        for index, (west, south, east_edge, north_edge) in enumerate(self._keep_out_bounds):
+            # Distance to the bounding box, a lower bound that is enough for the safe circle
+            # and much cheaper than a polygon distance, unless the point is inside the box
+            outside_east: float = max(west - east, east - east_edge, 0.0)
+            outside_north: float = max(south - north, north - north_edge, 0.0)
+            distance: float = math.hypot(outside_east, outside_north)
+            if exact or distance == 0.0:
+                distance = self._keep_out[index].distance(point)
+            clearance = min(clearance, distance)
+        return clearance
+
+
+class GeofenceMonitor:
+    """
+    Checks every position sample against a geofence as a telemetry hub listener, and
+    triggers a failsafe when the drone breaches it.
+
+    Attributes
+    ----------
+    fence : Geofence
+        The geofence checked.
+    checks : int
+        The number of samples checked.
+    breaches : int
+        The number of samples that breached the geofence.
+    zone : Optional[str]
+        The zone of the breach that triggered the failsafe, if one did.
+    """
+
+    def __init__(
+        self,
+        fence: Geofence,
+        failsafe: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> None:
+        self.fence: Geofence = fence
+        self.checks: int = 0
+        self.breaches: int = 0
+        self.zone: Optional[str] = None
+        self._failsafe: Optional[Callable[[], Awaitable[None]]] = failsafe
+        self._consecutive: int = 0
+        self._breached: asyncio.Event = asyncio.Event()
+
+    def update(self, name: str, sample: Any, now: float) -> None:
+        """
+        Checks one position sample
+
+        Parameters
+        ----------
+        name : str
+            The hub name of the stream, position
+        sample : Any
+            The Position sample
+        now : float
+            Time the sample arrived at in seconds
+        """
+        position: Position = sample
+        zone: Optional[str] = self.fence.check(position.latitude_deg, position.longitude_deg)
+        self.checks += 1
+        if zone is None:
+            self._consecutive = 0
+            return
+        self.breaches += 1
+        self._consecutive += 1
+        if self._consecutive >= BREACH_SAMPLES and self.zone is None:
+            self.zone = zone
+            if self.fence.enforced:
+                self._breached.set()
+            else:
+                logging.warning("Geofence breached: %s, not enforced", zone)
+
+    async def run(self, hub: TelemetryHub) -> None:
+        """
+        Checks every position sample of a hub until an enforced geofence is breached,
+        then triggers the failsafe and returns, so a supervisor can end the flight then.
+        A geofence that is not enforced is checked until the task is cancelled
+
+        Parameters
+        ----------
+        hub : TelemetryHub
+            The telemetry hub of the drone
+        """
+        hub.add_listener(self.update, ["position"])
+        try:
+            await self._breached.wait()
+        finally:
+            hub.remove_listener(self.update)
+        logging.critical("Geofence breached: %s, failsafe", self.zone)
+        if self._failsafe is not None:
+            await self._failsafe()
+
+
+def geofence_path(competition: bool) -> str:
+    """
+    Returns the path of the geofence file of the field flown
+
+    Parameters
+    ----------
+    competition : bool
+        Decides if the competition field is used or the golf course test one.
+
+    Returns
+    -------
+    path : str
+        Path of the geofence JSON file.
+    """
+    return GEOFENCE_FILE if competition else GOLF_GEOFENCE_FILE
+
+
+def _zones(json_data: dict[str, Any], key: str) -> dict[str, list[tuple[float, float]]]:
+    raw: Any = json_data.get(key, {})
+    if not isinstance(raw, dict):
+        raise GeofenceError(f"{key} must be an object of named polygons")
+    zones: dict[str, list[tuple[float, float]]] = {}
+    for name, points in raw.items():
+        where: str = f"{key}.{name}"
+        if not isinstance(points, list) or len(points) < 3:
+            raise GeofenceError(f"{where} must be a list of at least 3 positions")
+        vertices: list[tuple[float, float]] = []
+        for point in points:
+            if (
+                not isinstance(point, list)
+                or len(point) != 2
+                or not all(
+                    isinstance(value, (int, float)) and not isinstance(value, bool)
+                    for value in point
+                )
+                or not -90.0 <= point[0] <= 90.0
+                or not -180.0 <= point[1] <= 180.0
+            ):
+                raise GeofenceError(f"{where} holds an invalid position {point!r}")
+            vertices.append((float(point[0]), float(point[1])))
+        zones[name] = vertices
+    return zones
+
+
+def parse_geofence(json_data: Any) -> Geofence:
+    """
+    Validates the contents of a geofence file and projects it into meters
+
+    Parameters
+    ----------
+    json_data : Any
+        The decoded JSON document
+
+    Returns
+    -------
+    fence : Geofence
+        The geofence in the file
+
+    Raises
+    ------
+    GeofenceError
+        If the document does not match the schema or a polygon is invalid
+    """
+    if not isinstance(json_data, dict):
+        raise GeofenceError("The file must hold a JSON object")
+    margin: Any = json_data.get("margin_m", MARGIN)
+    if isinstance(margin, bool) or not isinstance(margin, (int, float)) or not margin >= 0.0:
+        raise GeofenceError(f"margin_m must be a number of meters, got {margin!r}")
+    enforce: Any = json_data.get("enforce", False)
+    if not isinstance(enforce, bool):
+        raise GeofenceError(f"enforce must be true or false, got {enforce!r}")
+    inclusion: dict[str, list[tuple[float, float]]] = _zones(json_data, "inclusion")
+    exclusion: dict[str, list[tuple[float, float]]] = _zones(json_data, "exclusion")
+    vertices: list[tuple[float, float]] = [
+        vertex for zone in [*inclusion.values(), *exclusion.values()] for vertex in zone
+    ]
+    if not vertices:
+        raise GeofenceError("The file must hold at least one zone")
+
+    frame: geo.LocalFrame = geo.LocalFrame(
+        sum(vertex[0] for vertex in vertices) / len(vertices),
+        sum(vertex[1] for vertex in vertices) / len(vertices),
+    )
+    polygons: list[dict[str, Polygon]] = [{}, {}]
+    for zones, projected in zip((inclusion, exclusion), polygons):
+        for name, zone in zones.items():
+            polygon: Polygon = Polygon([frame.to_enu(*vertex)[:2] for vertex in zone])
+            if not polygon.is_valid:
+                raise GeofenceError(f"Zone {name} is not a simple polygon")
+            projected[name] = polygon
+    return Geofence(frame, polygons[0], polygons[1], float(margin), enforce)
+
+
+def _read(path: str) -> Geofence:
+    with open(path, encoding="UTF-8") as data_file:
+        return parse_geofence(json.load(data_file))
+
+
+async def load_geofence(path: str) -> Geofence:
+    """
+    Reads a geofence file and prepares it for checks, in a worker thread
+
+    Parameters
+    ----------
+    path : str
+        File path to the geofence JSON file.
+
+    Returns
+    -------
+    fence : Geofence
+        The geofence in the file
+
+    Raises
+    ------
+    GeofenceError
+        If the file does not match the schema
+    """
+    try:
+        return await asyncio.to_thread(_read, path)
+    except GeofenceError as ex:
+        raise GeofenceError(f"{path}: {ex}") from ex
@@ -1,14 +1,188 @@
 """
 Contains the move_to function responsible
 for moving the drone to a certain location
-given latitude, longitude, and altitude.
+given latitude, longitude, and altitude,
+and the fly_route function flying a whole
+route of waypoints without stopping at each.
 """
 
 import asyncio
+import functools
+import logging
+import math
+from typing import Callable, NamedTuple, Optional
 from mavsdk import System
+from mavsdk.telemetry import Position
+from flight import commands, geo, intake_gps, metrics, terrain, triggers
+from flight.telemetry_hub import TelemetryHub, get_hub
 
+ACCEPTANCE_RADIUS: float = 1.0  # Meters from the waypoint that count as arrived
+DWELL_TIME: float = 0.3  # Seconds the drone must stay within the radius to have arrived
+BLEND_RADIUS: float = 8.0  # Meters from a route waypoint the next leg is started at
 
-async def move_to(drone: System, latitude: float, longitude: float, altitude: float) -> None:
+
+class ArrivalResult(NamedTuple):
+    """
+    NamedTuple storing the outcome of a single move_to call.
+
+    Attributes
+    ----------
+    arrived : bool
+        Whether the drone arrived before the timeout.
+    elapsed : float
+        Seconds from sending goto_location to arrival or timeout.
+    error : float
+        3D distance in meters between the drone and the waypoint at the last sample.
+    """
+
+    arrived: bool
+    elapsed: float
+    error: float
+
+
+class RouteResult(NamedTuple):
+    """
+    NamedTuple storing the outcome of a single fly_route call.
+
+    Attributes
+    ----------
+    arrived : bool
+        Whether the drone reached the end of the route before any leg timed out.
+    elapsed : float
+        Seconds from sending the first goto_location to the end of the route.
+    legs : list[ArrivalResult]
+        The outcome of each leg flown, the error taken when the next leg started.
+    """
+
+    arrived: bool
+    elapsed: float
+    legs: list[ArrivalResult]
+
+
+class ArrivalDetector:
+    """
+    Decides when the drone has arrived at a waypoint, one telemetry sample at a time.
+    The drone has arrived once it stays within the acceptance radius for the dwell time.
+
+    Attributes
+    ----------
+    latitude : float
+        Latitude of the waypoint in degrees.
+    longitude : float
+        Longitude of the waypoint in degrees.
+    altitude : float
+        Altitude of the waypoint relative to home in meters.
+    acceptance_radius : float
+        3D distance in meters from the waypoint that counts as inside.
+    dwell_time : float
+        Seconds the drone must stay inside before it has arrived.
+    error : float
+        3D distance in meters to the waypoint at the last update.
+    """
+
+    def __init__(
+        self,
+        latitude: float,
+        longitude: float,
+        altitude: float,
+        acceptance_radius: float = ACCEPTANCE_RADIUS,
+        dwell_time: float = DWELL_TIME,
+    ) -> None:
+        self.latitude: float = latitude
+        self.longitude: float = longitude
+        self.altitude: float = altitude
+        self.acceptance_radius: float = acceptance_radius
+        self.dwell_time: float = dwell_time
+        self.error: float = float("inf")
+
+        self._inside_since: Optional[float] = None
+        self._frame: geo.LocalFrame = geo.LocalFrame(latitude, longitude, altitude)
+
+    def update(self, position: Position, now: float) -> bool:
+        """
+        Feeds one position sample to the detector
+
+        Parameters
+        ----------
+        position : Position
+            The latest position sample of the drone
+        now : float
+            Time the sample arrived at in seconds
+
+        Returns
+        -------
+        arrived : bool
+            True once the drone has stayed within the radius for the dwell time
+        """
+        east, north, up = self._frame.to_enu(
+            position.latitude_deg, position.longitude_deg, position.relative_altitude_m
+        )
+        self.error = math.sqrt(east * east + north * north + up * up)
+
+        if self.error > self.acceptance_radius:
+            self._inside_since = None
+            return False
+        if self._inside_since is None:
+            self._inside_since = now
+        return now - self._inside_since >= self.dwell_time
+
+
+async def wait_for_arrival(hub: TelemetryHub, detector: ArrivalDetector) -> None:
+    """
+    Checks every position sample as soon as it arrives and returns once the detector
+    reports arrival
+
+    Parameters
+    ----------
+    hub : TelemetryHub
+        The telemetry hub of the drone
+    detector : ArrivalDetector
+        The detector of the waypoint being flown to
+    """
+    position: Position
+    async for position in hub.samples("position"):
+        if detector.update(position, hub.timestamp("position")):
+            return
+
+
+async def send_goto(drone: System, latitude: float, longitude: float, altitude: float) -> None:
+    """
+    Sends the drone to a location, replacing any goto still waiting to be sent
+
+    Parameters
+    ----------
+    drone : System
+        The connected drone
+    latitude : float
+        Latitude in degrees
+    longitude : float
+        Longitude in degrees
+    altitude : float
+        Altitude above mean sea level in meters
+    """
+    await commands.send(
+        drone,
+        "goto_location",
+        functools.partial(drone.action.goto_location, latitude, longitude, altitude, 0),
+        latitude,
+        longitude,
+        altitude,
+        0.0,
+        coalesce=True,
+    )
+
+
+@metrics.timed("move_to_seconds", "Seconds from sending goto_location to arrival or timeout")
+async def move_to(
+    drone: System,
+    latitude: float,
+    longitude: float,
+    altitude: float,
+    acceptance_radius: float = ACCEPTANCE_RADIUS,
+    dwell_time: float = DWELL_TIME,
+    timeout: Optional[float] = None,
+    ground: Optional[terrain.Terrain] = None,
+) -> ArrivalResult:
     """
     This function takes in a latitude, longitude and altitude and autonomously
     moves the drone to that waypoint. This function will also auto convert the altitude
@@ -23,42 +197,176 @@ async def move_to(drone: System, latitude: float, longitude: float, altitude: fl
     longitude : float
         a float containing the requested longitude to move to
     altitude : float
-        a float contatining the requested altitude to go to (in feet)
+        a float contatining the requested altitude to go to (in feet), above the ground
+        at the waypoint with a terrain and above home without one
+    acceptance_radius : float
+        the 3D distance in meters from the waypoint that counts as arrived
+    dwell_time : float
+        the seconds the drone must stay within the acceptance radius
+    timeout : Optional[float]
+        the seconds to wait for arrival before giving up, or None to wait forever
+    ground : Optional[Terrain]
+        the terrain of the field, or None to fly at the altitude above home
+
+    Returns
+    -------
+    result : ArrivalResult
+        whether the drone arrived, how long it took and the final 3D error in meters
     """
 
     # Convert the altitude given from feet into meters,
     # as MAVSDK returns altitude data in meters
-    altitude = altitude * 0.3048
+    altitude = geo.feet_to_meters(altitude)
 
-    # Constantly get the current absolute altitude and assign it to absolute_altitude
-    async for terrain_info in drone.telemetry.home():
-        absolute_altitude: float = terrain_info.absolute_altitude_m
-        break
+    # Get the absolute altitude of home from the shared telemetry cache
+    hub: TelemetryHub = get_hub(drone)
+    home_altitude: float = (await hub.wait_latest("home")).absolute_altitude_m
+    ground_altitude: float = home_altitude
+    if ground is not None:
+        ground_altitude += ground.relative_elevation(latitude, longitude)
+    absolute_altitude: float = altitude + ground_altitude
 
     # Use the built-in goto_location function from MAVSDK to start moving
-    await drone.action.goto_location(latitude, longitude, altitude + absolute_altitude, 0)
-    location_reached: bool = False
-
-    # Repeatedly check the drone's location while drone is in motion, and returning the function
-    # once the drone has reached the desired location.
-    while not location_reached:
-        async for position in drone.telemetry.position():
-            # Assign longitude/latitude (in degrees) and altitude (in meters) to variables
-            drone_lat: float = position.latitude_deg
-            drone_long: float = position.longitude_deg
-            drone_alt: float = position.relative_altitude_m
-
-            # If drone is within certain distance of the desired waypoint, break.
-            # Currently, this target is within .00000001 of a degree, or about a 0.011m radius.
-            # Formula: degrees / 111,139 = meters
-            if (
-                (round(drone_lat, 8) == round(latitude, 8))
-                and (round(drone_long, 8) == round(longitude, 8))
-                and (round(drone_alt, 3) == round(altitude, 3))
-            ):
-                location_reached = True
-                break
-
-        # Tell process to sleep to prevent contstant polling, preventing battery drain
-        await asyncio.sleep(1)
-    return
+    start: float = asyncio.get_running_loop().time()
+    await send_goto(drone, latitude, longitude, absolute_altitude)
+
+    # Arrival is checked on the altitude above home that telemetry reports
+    detector: ArrivalDetector = ArrivalDetector(
+        latitude, longitude, absolute_altitude - home_altitude, acceptance_radius, dwell_time
+    )
+
+    arrived: bool = True
+    try:
+        await asyncio.wait_for(wait_for_arrival(hub, detector), timeout)
+    except asyncio.TimeoutError:
+        arrived = False
+
+    result: ArrivalResult = ArrivalResult(
+        arrived, asyncio.get_running_loop().time() - start, detector.error
+    )
+    logging.debug(
+        "move_to %s after %.3f s, error %.3f m",
+        "arrived" if arrived else "timed out",
+        result.elapsed,
+        result.error,
+    )
+    return result
+
+
+def _near(
+    frame: geo.LocalFrame, point: tuple[float, float, float], radius: float
+) -> Callable[[Position], bool]:
+    def test(position: Position) -> bool:
+        east, north, up = frame.to_enu(
+            position.latitude_deg, position.longitude_deg, position.absolute_altitude_m
+        )
+        return math.hypot(east - point[0], north - point[1], up - point[2]) <= radius
+
+    return test
+
+
+@metrics.timed("fly_route_seconds", "Seconds from starting a route to reaching its end")
+async def fly_route(
+    drone: System,
+    waypoints: list[intake_gps.Waypoint],
+    blend_radius: float = BLEND_RADIUS,
+    acceptance_radius: float = ACCEPTANCE_RADIUS,
+    dwell_time: float = DWELL_TIME,
+    timeout: Optional[float] = None,
+) -> RouteResult:
+    """
+    Flies through a list of waypoints. The next goto_location is sent as soon as the
+    drone comes within the blend radius of a waypoint, so the drone carries its speed
+    through the route instead of stopping at every waypoint. Only the last waypoint is
+    flown to until arrival.
+
+    Parameters
+    ----------
+    drone : System
+        The connected drone
+    waypoints : list[Waypoint]
+        The waypoints in order, altitudes above mean sea level
+    blend_radius : float
+        The 3D distance in meters from a waypoint that starts the next leg, 0 to fly
+        to every waypoint until arrival
+    acceptance_radius : float
+        The 3D distance in meters from the last waypoint that counts as arrived
+    dwell_time : float
+        The seconds the drone must stay within the acceptance radius of a waypoint
+        flown to until arrival
+    timeout : Optional[float]
+        The seconds each leg may take before the route is given up, or None to wait forever
+
+    Returns
+    -------
+    result : RouteResult
+        Whether the drone reached the end of the route, the total time and each leg
+    """
+    hub: TelemetryHub = get_hub(drone)
+    engine: triggers.TriggerEngine = triggers.get_engine(drone)
+    home: Position = await hub.wait_latest("home")
+    # Every waypoint is converted to the home frame once, so each position sample
+    # needs a single conversion whatever leg is being flown
+    frame: geo.LocalFrame = geo.LocalFrame(
+        home.latitude_deg, home.longitude_deg, home.absolute_altitude_m
+    )
+    points: list[tuple[float, float, float]] = [
+        frame.to_enu(waypoint.latitude, waypoint.longitude, waypoint.altitude)
+        for waypoint in waypoints
+    ]
+
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    start: float = loop.time()
+    legs: list[ArrivalResult] = []
+    arrived: bool = True
+    for index, (waypoint, point) in enumerate(zip(waypoints, points)):
+        leg_start: float = loop.time()
+        await send_goto(drone, waypoint.latitude, waypoint.longitude, waypoint.altitude)
+
+        if blend_radius > 0.0 and index < len(waypoints) - 1:
+            conditions: list[triggers.Condition] = [
+                triggers.Condition("route_blend", "position", _near(frame, point, blend_radius))
+            ]
+            if timeout is not None:
+                conditions.append(triggers.timeout("route_timeout", timeout))
+            fired: triggers.Condition = await engine.wait(*conditions)
+            arrived = fired is conditions[0]
+            position: Position = hub.latest("position")
+            east, north, up = frame.to_enu(
+                position.latitude_deg, position.longitude_deg, position.absolute_altitude_m
+            )
+            error: float = math.hypot(east - point[0], north - point[1], up - point[2])
+        else:
+            detector: ArrivalDetector = ArrivalDetector(
+                waypoint.latitude,
+                waypoint.longitude,
+                point[2],
+                acceptance_radius,
+                dwell_time,
+            )
+            try:
+                await asyncio.wait_for(wait_for_arrival(hub, detector), timeout)
+            except asyncio.TimeoutError:
+                arrived = False
+            error = detector.error
+
+        legs.append(ArrivalResult(arrived, loop.time() - leg_start, error))
+        logging.debug(
+            "Route leg %d of %d %s after %.3f s, error %.3f m",
+            index + 1,
+            len(waypoints),
+            "done" if arrived else "timed out",
+            legs[-1].elapsed,
+            error,
+        )
+        if not arrived:
+            break
+
+    result: RouteResult = RouteResult(arrived, loop.time() - start, legs)
+    logging.info(
+        "Route of %d waypoints %s after %.3f s",
+        len(waypoints),
+        "flown" if arrived else "given up",
+        result.elapsed,
+    )
+    return result
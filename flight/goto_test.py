@@ -1,16 +1,24 @@
 """
-A flight path going to four different waypoints near the golf course to test the goto function.
+A flight path going to four different waypoints near the golf course to test the goto functions.
 """
 
+import argparse
 import asyncio
 
 from mavsdk import System
-from goto import move_to
+from mavsdk.telemetry import Position
+from flight import commands, geo, goto, intake_gps, terrain
+from flight.connection import get_drone
+from flight.flight import OFFLINE_ADDR, SIM_ADDR
+from flight.sim import clock
+from flight.telemetry_hub import get_hub
 
 # Home coordinates
 # PX4_HOME_LAT=37.9490953
 # PX4_HOME_LON=-91.7848293
 
+# Altitudes are feet above the ground at each waypoint
+
 waypoints = [
     [37.949803, -91.784440, 75],
     [37.949576, -91.783739, 75],
@@ -19,29 +27,69 @@ waypoints = [
 ]
 
 
-async def run() -> None:
-    """
-    Tests the goto function by moving the drone to four different waypoints.
+async def run(address: str = SIM_ADDR, blend_radius: float = goto.BLEND_RADIUS) -> None:
     """
-    drone = System()
-    await drone.connect(system_address="udp://:14540")
+    Tests the goto functions by flying the drone through four different waypoints.
+    Run with python3 -m flight.goto_test, adding -o to use the offline simulator
 
+    Parameters
+    ----------
+    address : str
+        The system address of the simulator to connect to
+    blend_radius : float
+        Meters from a waypoint the next one is flown to from, 0 to stop at every waypoint
+    """
     print("Waiting for drone to connect...")
-    async for state in drone.core.connection_state():
-        if state.is_connected:
-            print("Drone discovered!")
-            break
+    drone: System = await get_drone(address)
+    print("Drone discovered!")
 
     print("-- Arming")
-    await drone.action.arm()
+    await commands.send(drone, "arm", drone.action.arm)
+
+    targets: intake_gps.TargetData = await intake_gps.load_targets(intake_gps.GOLF_TARGET_FILE)
+    home: Position = await get_hub(drone).wait_latest("home")
+    ground: terrain.Terrain = await terrain.load_terrain(
+        terrain.GOLF_TERRAIN_FILE, targets.ground_altitude, home
+    )
+
+    print("-- Using move_to() to move to the first waypoint")
+    await goto.move_to(drone, waypoints[0][0], waypoints[0][1], waypoints[0][2], ground=ground)
 
-    print("-- Using move_to() to move to waypoints")
-    await move_to(drone, waypoints[0][0], waypoints[0][1], waypoints[0][2])
-    await move_to(drone, waypoints[1][0], waypoints[1][1], waypoints[1][2])
-    await move_to(drone, waypoints[2][0], waypoints[2][1], waypoints[2][2])
-    await move_to(drone, waypoints[3][0], waypoints[3][1], waypoints[3][2])
+    print("-- Using fly_route() to fly through every waypoint")
+    route: list[intake_gps.Waypoint] = [
+        intake_gps.Waypoint(
+            latitude,
+            longitude,
+            home.absolute_altitude_m
+            + ground.relative_elevation(latitude, longitude)
+            + geo.feet_to_meters(feet),
+        )
+        for latitude, longitude, feet in waypoints[1:] + waypoints[:1]
+    ]
+    result: goto.RouteResult = await goto.fly_route(drone, route, blend_radius)
+    for index, leg in enumerate(result.legs):
+        print(f"Leg {index + 1}: {leg.elapsed:.2f} s, {leg.error:.2f} m from the waypoint")
+    print(f"Route: {result.elapsed:.2f} s, {'arrived' if result.arrived else 'timed out'}")
 
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(run())
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-o",
+        "--offline",
+        help="Using the built-in offline simulator, faster than real time",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-b",
+        "--blend-radius",
+        help="Meters from a waypoint the next one is flown to from, 0 to stop at each",
+        type=float,
+        default=goto.BLEND_RADIUS,
+    )
+    args: argparse.Namespace = parser.parse_args()
+    if args.offline:
+        clock.run(run(OFFLINE_ADDR, args.blend_radius))
+    else:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(run(blend_radius=args.blend_radius))
@@ -1,10 +1,36 @@
 """
-Contains the extract_gps() function for extracting data out of
-a provided target waypoint data JSON file for the Argonia Cup competition.
+Loads target waypoint data JSON files for the Argonia Cup competition.
+
+A file holds the ground altitude of the launch area and one or more named targets,
+with altitudes in feet or meters, either AMSL or above the ground:
+
+    {
+        "units": "ft",                  # "ft" or "m", feet if not given
+        "altitude_reference": "AGL",    # "AGL" or "AMSL", AGL if not given
+        "ground_altitude_amsl": 1250,
+        "targets": {
+            "primary": {"latitude": 37.9, "longitude": -91.7, "altitude": 450},
+            "backup": {"latitude": 37.9, "longitude": -91.8, "altitude": 450}
+        },
+        "primary": "primary",           # the first target if not given
+        "alternates": ["backup"]
+    }
+
+A single "target" object in place of "targets" is also accepted. Loaded files are
+cached by path and modification time, and files are read off the event loop.
 """
 import asyncio
-from typing import Any, NamedTuple
 import json
+import math
+import os
+from typing import Any, NamedTuple, Optional
+
+from flight import geo
+
+TARGET_FILE: str = "flight/data/target_data.json"  # Competition targets
+GOLF_TARGET_FILE: str = "flight/data/golf_target.json"  # Golf course test targets
+UNITS: dict[str, float] = {"ft": geo.FEET_TO_METERS, "m": 1.0}  # Meters per unit
+ALTITUDE_REFERENCES: tuple[str, ...] = ("AGL", "AMSL")
 
 
 class Waypoint(NamedTuple):
@@ -18,7 +44,7 @@ class Waypoint(NamedTuple):
     longitude : float
         The longitude of the waypoint.
     altitude : float
-        The altitude of the waypoint.
+        The altitude of the waypoint in meters AMSL.
     """
 
     latitude: float
@@ -26,6 +52,171 @@ class Waypoint(NamedTuple):
     altitude: float
 
 
+class TargetData(NamedTuple):
+    """
+    NamedTuple storing every target of a target data file.
+
+    Attributes
+    ----------
+    targets : dict[str, Waypoint]
+        Every target by name.
+    primary : str
+        Name of the target to land on.
+    alternates : tuple[str, ...]
+        Names of the targets to use instead of the primary, in order of preference.
+    ground_altitude : float
+        Ground altitude of the launch area in meters AMSL.
+    """
+
+    targets: dict[str, Waypoint]
+    primary: str
+    alternates: tuple[str, ...]
+    ground_altitude: float
+
+    @property
+    def target(self) -> Waypoint:
+        """The primary target"""
+        return self.targets[self.primary]
+
+
+class TargetDataError(ValueError):
+    """
+    Exception for when a target data file does not match the schema
+    """
+
+
+# Parsed files and the modification time they were parsed at, by path
+_CACHE: dict[str, tuple[int, TargetData]] = {}
+
+
+def target_path(competition: bool) -> str:
+    """
+    Returns the path of the target data file to fly
+
+    Parameters
+    ----------
+    competition : bool
+        Decides if competition waypoints are used or the golf course test ones.
+
+    Returns
+    -------
+    path : str
+        Path of the target data JSON file.
+    """
+    return TARGET_FILE if competition else GOLF_TARGET_FILE
+
+
+def _number(data: dict[str, Any], key: str, where: str) -> float:
+    value: Any = data.get(key)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise TargetDataError(f"{where}.{key} must be a finite number, got {value!r}")
+    return float(value)
+
+
+def _choice(data: dict[str, Any], key: str, choices: tuple[str, ...], default: str) -> str:
+    value: Any = data.get(key, default)
+    if value not in choices:
+        raise TargetDataError(f"{key} must be one of {', '.join(choices)}, got {value!r}")
+    return str(value)
+
+
+def parse_targets(json_data: Any) -> TargetData:
+    """
+    Validates the contents of a target data file and converts it to meters AMSL
+
+    Parameters
+    ----------
+    json_data : Any
+        The decoded JSON document
+
+    Returns
+    -------
+    target_data : TargetData
+        The targets in the file
+
+    Raises
+    ------
+    TargetDataError
+        If the document does not match the schema
+    """
+    if not isinstance(json_data, dict):
+        raise TargetDataError("The file must hold a JSON object")
+
+    scale: float = UNITS[_choice(json_data, "units", tuple(UNITS), "ft")]
+    above_ground: bool = (
+        _choice(json_data, "altitude_reference", ALTITUDE_REFERENCES, "AGL") == "AGL"
+    )
+    ground_altitude: float = _number(json_data, "ground_altitude_amsl", "file") * scale
+
+    raw_targets: Any = json_data.get("targets")
+    if raw_targets is None and "target" in json_data:
+        raw_targets = {"target": json_data["target"]}
+    if not isinstance(raw_targets, dict) or not raw_targets:
+        raise TargetDataError("targets must be an object holding at least one named target")
+
+    targets: dict[str, Waypoint] = {}
+    for name, raw in raw_targets.items():
+        where: str = f"targets.{name}"
+        if not isinstance(raw, dict):
+            raise TargetDataError(f"{where} must be an object")
+        latitude: float = _number(raw, "latitude", where)
+        longitude: float = _number(raw, "longitude", where)
+        if not -90.0 <= latitude <= 90.0 or not -180.0 <= longitude <= 180.0:
+            raise TargetDataError(f"{where} is not a valid position: {latitude}, {longitude}")
+        altitude: float = _number(raw, "altitude", where) * scale
+        if above_ground:
+            altitude += ground_altitude
+        targets[name] = Waypoint(latitude, longitude, altitude)
+
+    primary: Any = json_data.get("primary", next(iter(targets)))
+    alternates: Any = json_data.get("alternates", [])
+    if not isinstance(alternates, list):
+        raise TargetDataError("alternates must be a list of target names")
+    for name in [primary, *alternates]:
+        if name not in targets:
+            raise TargetDataError(f"Unknown target {name!r}")
+
+    return TargetData(targets, primary, tuple(alternates), ground_altitude)
+
+
+def _read(path: str) -> TargetData:
+    with open(path, encoding="UTF-8") as data_file:
+        return parse_targets(json.load(data_file))
+
+
+async def load_targets(path: str) -> TargetData:
+    """
+    Returns the targets in a target data file, reading it only if it changed since
+    the last load. The file is read and parsed in a worker thread.
+
+    Parameters
+    ----------
+    path : str
+        File path to the target data JSON file.
+
+    Returns
+    -------
+    target_data : TargetData
+        The targets in the file, shared with every other caller loading the same file
+
+    Raises
+    ------
+    TargetDataError
+        If the file does not match the schema
+    """
+    modified: int = (await asyncio.to_thread(os.stat, path)).st_mtime_ns
+    cached: Optional[tuple[int, TargetData]] = _CACHE.get(path)
+    if cached is not None and cached[0] == modified:
+        return cached[1]
+
+    try:
+        target_data: TargetData = await asyncio.to_thread(_read, path)
+    except TargetDataError as ex:
+        raise TargetDataError(f"{path}: {ex}") from ex
+    _CACHE[path] = (modified, target_data)
+    return target_data
+
+
 async def extract_gps(path: str) -> tuple[Waypoint, float]:
     """
     Returns the target location and ground altitude from a json file specified by a parameter.
@@ -43,28 +234,13 @@ async def extract_gps(path: str) -> tuple[Waypoint, float]:
         longitude : float
             The longitude of the target.
         altitude : float
-            The altitude of the target.
+            The altitude of the target in meters AMSL.
     ground_altitude: float
-        The ground altitude of the launch area in ASML (above mean sea level), as the drone
-        must navigate using AMSL instead of relative launch altitude.
+        The ground altitude of the launch area in meters AMSL (above mean sea level), as
+        the drone must navigate using AMSL instead of relative launch altitude.
     """
-
-    # Load the JSON file as a Python dict to be able to easily access the data
-    with open(path, encoding="UTF-8") as data_file:
-        json_data: dict[str, Any] = json.load(data_file)
-
-    # Define variables for the target's location
-    latitude: float = json_data["target"]["latitude"]
-    longitude: float = json_data["target"]["longitude"]
-    altitude: float = json_data["target"]["altitude"]
-
-    # Package all data into the Waypoint NamedTuple to be exported
-    target_data: Waypoint = Waypoint(latitude, longitude, altitude)
-
-    # Name a variable for ground altitude to be exported
-    ground_altitude: float = json_data["ground_altitude_amsl"]
-
-    return target_data, ground_altitude
+    target_data: TargetData = await load_targets(path)
+    return target_data.target, target_data.ground_altitude
 
 
 async def main() -> None:
@@ -75,13 +251,11 @@ async def main() -> None:
     parser.add_argument("-file")
     args: argparse.Namespace = parser.parse_args()
 
-    # Unpack the tuple that is returned
-    target_location: Waypoint
-    launch_altitude: float
-
-    target_location, launch_altitude = await extract_gps(vars(args)["file"])
-    print(f"Target Location: {target_location}")
-    print(f"Altitude: {launch_altitude}")
+    target_data: TargetData = await load_targets(vars(args)["file"])
+    for name, waypoint in target_data.targets.items():
+        print(f"{name}: {waypoint}")
+    print(f"Primary: {target_data.primary}, alternates: {', '.join(target_data.alternates)}")
+    print(f"Ground altitude: {target_data.ground_altitude:.1f} m AMSL")
 
 
 # If run on it's own, use file path from command argument
@@ -1,20 +1,130 @@
 """
-Lands the drone precisely on the target using goto and slowing it down as it gets closer to the ground
+Lands the drone precisely on the target with an offboard velocity controller that
+slows the descent down as it gets closer to the ground
 """
-from mavsdk import System
-import mavsdk as sdk
+import asyncio
+import functools
 import logging
-from flight import goto
+import math
+from typing import NamedTuple, Optional
+from mavsdk import System
+from mavsdk.offboard import OffboardError, VelocityNedYaw
+from mavsdk.telemetry import Position
+from flight import (
+    commands,
+    descent,
+    estimator,
+    geo,
+    metrics,
+    telemetry_rates,
+    terrain,
+    triggers,
+)
+from flight.telemetry_hub import TelemetryHub, get_hub
+
+LOOP_RATE: float = 20.0  # Hz, rate velocity setpoints are sent at
+TOUCHDOWN_HEIGHT: float = geo.feet_to_meters(0.5)  # The drone is cut this high above the ground
+HORIZONTAL_GAIN: float = 0.8  # (m/s) of horizontal velocity commanded per meter of error
+MAX_HORIZONTAL_SPEED: float = 3.0  # m/s
+ALTITUDE_LOG_INTERVAL: float = 1.0  # Seconds between altitude log lines during the descent
+
+# Time from the position sample a setpoint was computed from to the setpoint going out
+SETPOINT_LATENCY: metrics.Histogram = metrics.histogram(
+    "landing_setpoint_latency_seconds", "Age of the position sample when its setpoint was sent"
+)
+
+
+class DescentStats(NamedTuple):
+    """
+    NamedTuple storing the timing and accuracy of a single descent.
+
+    Attributes
+    ----------
+    loop_rate : float
+        The requested rate of the control loop in hertz.
+    command_rate : float
+        The achieved rate of velocity setpoints in hertz.
+    jitter : float
+        Standard deviation of the time between setpoints in seconds.
+    commands : int
+        The number of velocity setpoints sent.
+    duration : float
+        Seconds from starting offboard mode to cutting the drone.
+    horizontal_error : float
+        Horizontal distance in meters from the target when the drone was cut.
+    """
+
+    loop_rate: float
+    command_rate: float
+    jitter: float
+    commands: int
+    duration: float
+    horizontal_error: float
+
+
+def height(position: Position, ground: Optional[terrain.Terrain]) -> float:
+    """
+    Returns the altitude of a position sample the landing is controlled by
+
+    Parameters
+    ----------
+    position : Position
+        A position sample of the drone
+    ground : Optional[Terrain]
+        The terrain of the field, or None
+
+    Returns
+    -------
+    height : float
+        Meters above the ground under the drone, or above home without a terrain
+    """
+    if ground is None:
+        return position.relative_altitude_m
+    return ground.height_above_ground(position)
+
+
+async def send_velocity(drone: System, north: float, east: float, down: float) -> None:
+    """
+    Sends an offboard velocity setpoint, replacing any setpoint still waiting to be sent
+
+    Parameters
+    ----------
+    drone : System
+        The drone in offboard mode
+    north : float
+        Velocity north in m/s
+    east : float
+        Velocity east in m/s
+    down : float
+        Velocity down in m/s
+    """
+    await commands.send(
+        drone,
+        "set_velocity_ned",
+        functools.partial(drone.offboard.set_velocity_ned, VelocityNedYaw(north, east, down, 0.0)),
+        north,
+        east,
+        down,
+        coalesce=True,
+    )
 
 
-async def manual_land(drone: System, Target_Latitude: float, Target_Longitude: float) -> None:
+@metrics.timed("manual_land_seconds", "Seconds from starting the landing to cutting the drone")
+async def manual_land(
+    drone: System,
+    Target_Latitude: float,
+    Target_Longitude: float,
+    rate: float = LOOP_RATE,
+    profile: Optional[descent.DescentProfile] = None,
+    feed_forward: bool = True,
+    ground: Optional[terrain.Terrain] = None,
+) -> DescentStats:
     """
-    Function to increasingly slowly land the drone while honing in on the target
-    by using goto to lower the drone closer to the ground and to stay above the Target
-    Latitude and Longitude, while getting slower everytime it uses goto to get lower
-    It calls itself to update the drones location in the code, so it will know its position
-    until it gets around 6 inches off the ground then it will shut off the drone allowing it
-    to get to the ground from a safe height
+    Function to increasingly slowly land the drone while honing in on the target.
+    A single offboard control loop sends velocity setpoints that steer the drone over
+    the Target Latitude and Longitude while descending at the speed the descent profile
+    gives for its altitude, until it gets around 6 inches off the ground, then it will shut off the
+    drone allowing it to get to the ground from a safe height
 
     Parameters
     ----------
@@ -24,38 +134,145 @@ async def manual_land(drone: System, Target_Latitude: float, Target_Longitude: f
         a float containing the target latitude that needs to be reached
     Target_Longitude : float
         a float containing the target longitude that needs to be reached
+    rate : float
+        the rate of the control loop in hertz
+    profile : Optional[DescentProfile]
+        the precomputed descent, planned from the current altitude if None
+    feed_forward : bool
+        steer from the position predicted for the next setpoint and cancel the estimated
+        drift, instead of steering from the latest position sample alone
+    ground : Optional[Terrain]
+        the terrain of the field, altitudes are taken above the ground under the drone
+        with it and above home without it
 
-    Notes
-    -----
-    Recursively calls itself to update its own position and when it calls itself
-    it should run the next goto to get even lower
+    Returns
+    -------
+    stats : DescentStats
+        the achieved command rate, jitter and landing error of the descent
     """
 
-    # Lands the drone using the goto command to get it centered on the target while landing slowly
     logging.info("Landing the drone")
-    async for position in drone.telemetry.position():
-        current_altitude: float = round(position.relative_altitude_m, 3) * 3.28084
-        logging.info(current_altitude)
-        if current_altitude > 30.0:
-            # Descends at 4.5 feet/s at altitudes > 30 feet down to 27 feet
-            await drone.action.set_current_speed(4.5)
-            await goto.move_to(drone, Target_Latitude, Target_Longitude, 27)
-            # Calls itself to update its location in the code
-            await manual_land(drone, Target_Latitude, Target_Longitude)
-            return
-        elif 30.0 > current_altitude > 3:
-            # Descends at 1.5 feet/s at altitudes < 30 feet and > 3 feet down to 6 inches
-            await drone.action.set_current_speed(1.5)
-            await goto.move_to(drone, Target_Latitude, Target_Longitude, 0.5)
-            # Calls itself to update its location in the code
-            await manual_land(drone, Target_Latitude, Target_Longitude)
-            return
-        else:
-            # Sets downward velocity to 0, so the drone will stop moving
-            await drone.offboard.set_velocity_body(
-                sdk.offboard.VelocityBodyYawspeed(0.0, 0.0, 0.0, 0.0)
+    await telemetry_rates.enter_phase(drone, "landing")
+    hub: TelemetryHub = get_hub(drone)
+    # Make sure a position is cached before the control loop reads it
+    position: Position = await hub.wait_latest("position")
+    if profile is None:
+        profile = descent.plan_descent(height(position, ground), TOUCHDOWN_HEIGHT)
+
+    # Local frame anchored on the target, so positions convert straight to offsets from it
+    frame: geo.LocalFrame = geo.LocalFrame(Target_Latitude, Target_Longitude)
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    drift_estimator: estimator.DriftEstimator = estimator.DriftEstimator(frame)
+    drift_estimator.update("position", position, hub.timestamp("position"))
+    drift_estimator.set_command(0.0, 0.0, loop.time())
+
+    # Offboard mode needs a setpoint before it can be started
+    await send_velocity(drone, 0.0, 0.0, 0.0)
+    try:
+        await commands.send(drone, "offboard_start", drone.offboard.start)
+    except OffboardError:
+        logging.exception("Could not start offboard mode, landing in place instead")
+        await commands.send(drone, "land", drone.action.land, priority=commands.FAILSAFE)
+        return DescentStats(rate, 0.0, 0.0, 0, 0.0, float("nan"))
+
+    period: float = 1.0 / rate
+    start: float = loop.time()
+    next_tick: float = start
+
+    # Running sums of the time between setpoints, so no history is kept
+    setpoints: int = 0
+    last_command: float = 0.0
+    interval_sum: float = 0.0
+    interval_square_sum: float = 0.0
+
+    hub.add_listener(drift_estimator.update, ["position", "velocity"])
+    # Fires on the position sample reaching TOUCHDOWN_HEIGHT, cutting the wait for the next tick
+    touchdown: triggers.Trigger = triggers.get_engine(drone).arm(
+        triggers.below("touchdown", TOUCHDOWN_HEIGHT, ground)
+    )
+    try:
+        while not touchdown.done():
+            position = hub.latest("position")
+            # Offset from the drone to the target is the negated offset of the drone
+            east, north, _ = frame.to_enu(position.latitude_deg, position.longitude_deg)
+            altitude: float = height(position, ground)
+            logging.debug(
+                "Altitude %.2f m, %.2f m from target",
+                altitude,
+                math.hypot(east, north),
+                extra={"rate_limit": ALTITUDE_LOG_INTERVAL},
+            )
+
+            drift: tuple[float, float] = (0.0, 0.0)
+            if feed_forward:
+                # Steer from where the drone will be when the next setpoint goes out
+                east, north = drift_estimator.predict(loop.time() + period)
+                drift = drift_estimator.drift
+            east, north = -east, -north
+            distance: float = math.hypot(east, north)
+
+            # Steer toward the target, cancel the drift, and limit the horizontal speed
+            speed: float = min(HORIZONTAL_GAIN * distance, MAX_HORIZONTAL_SPEED)
+            scale: float = speed / distance if distance > 0.0 else 0.0
+            velocity_east: float = east * scale - drift[0]
+            velocity_north: float = north * scale - drift[1]
+            limit: float = MAX_HORIZONTAL_SPEED / max(
+                MAX_HORIZONTAL_SPEED, math.hypot(velocity_east, velocity_north)
             )
-            # forcebly lands the drone by killing it
-            logging.info("Disarming the drone")
-            await drone.action.kill()
-            return
+            velocity_east *= limit
+            velocity_north *= limit
+            down: float = profile.rate(altitude)
+            await send_velocity(drone, velocity_north, velocity_east, down)
+
+            now: float = loop.time()
+            drift_estimator.set_command(velocity_east, velocity_north, now)
+            if metrics.enabled():
+                SETPOINT_LATENCY.record(now - hub.timestamp("position"))
+            if setpoints:
+                interval: float = now - last_command
+                interval_sum += interval
+                interval_square_sum += interval * interval
+            last_command = now
+            setpoints += 1
+
+            # Missed ticks are skipped rather than caught up with a burst of setpoints
+            next_tick = max(next_tick + period, loop.time())
+            await touchdown.wait(next_tick - loop.time())
+    finally:
+        touchdown.cancel()
+        hub.remove_listener(drift_estimator.update)
+    position = hub.latest("position")
+    east, north, _ = frame.to_enu(position.latitude_deg, position.longitude_deg)
+    horizontal_error: float = math.hypot(east, north)
+    logging.debug(
+        "Estimated drift %.2f m/s east, %.2f m/s north, lag %.3f s",
+        drift_estimator.drift[0],
+        drift_estimator.drift[1],
+        drift_estimator.lag,
+    )
+
+    # Sets velocity to 0, so the drone will stop moving
+    await send_velocity(drone, 0.0, 0.0, 0.0)
+    # forcebly lands the drone by killing it
+    logging.info("Disarming the drone")
+    await commands.send(drone, "kill", drone.action.kill, priority=commands.CRITICAL)
+
+    intervals: int = setpoints - 1
+    command_rate: float = 0.0
+    jitter: float = 0.0
+    if intervals > 0 and interval_sum > 0.0:
+        mean: float = interval_sum / intervals
+        command_rate = 1.0 / mean
+        jitter = math.sqrt(max(0.0, interval_square_sum / intervals - mean * mean))
+
+    stats: DescentStats = DescentStats(
+        rate, command_rate, jitter, setpoints, loop.time() - start, horizontal_error
+    )
+    logging.info(
+        "Descent done: %.1f Hz achieved of %.1f Hz requested, jitter %.4f s, error %.3f m",
+        command_rate,
+        rate,
+        jitter,
+        horizontal_error,
+    )
+    return stats
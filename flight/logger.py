@@ -1,24 +1,194 @@
-"""Logging configuration and functions"""
+"""
+Logging configuration and functions. Records are put on a bounded queue by a
+non-blocking handler and written to the console and a log file by a QueueListener
+thread, so the event loop never waits on disk or console I/O. When the queue is
+full, records are dropped and counted instead of blocking the flight code.
+
+Every record is tagged with the vehicle it is about, taken from the VEHICLE context
+variable, so the flights of a fleet sharing one log can be told apart. Tasks and
+worker threads inherit the vehicle of the code that started them.
+"""
+import contextvars
+import json
 import logging
-from typing import TextIO
+import multiprocessing
+import os
+import queue
+import threading
+import time
 from datetime import datetime
-from multiprocessing import Queue
-from logging import Formatter, FileHandler, StreamHandler
+from logging import FileHandler, Formatter, StreamHandler
 from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, TextIO
 
-LOG_FILE: str = f"logs/{datetime.now()}.log"
-LOG_FORMAT: str = "%(levelname)s | %(asctime)s @  %(processName)s:%(funcName)s > %(message)s"
+LOG_DIR: str = "logs"
+LOG_FILE: str = "{time:%Y-%m-%d_%H-%M-%S}.log"  # Name of the log file in LOG_DIR
+LOG_FORMAT: str = (
+    "%(levelname)s | %(asctime)s @  %(processName)s:%(vehicle)s:%(funcName)s > %(message)s"
+)
 LOG_LEVEL = logging.DEBUG
+QUEUE_SIZE: int = 10_000  # Records buffered for the listener before new records are dropped
+DEFAULT_VEHICLE: str = "drone"  # Vehicle of records logged outside of any vehicle's flight
+
+# Name of the vehicle the running code flies
+VEHICLE: contextvars.ContextVar[str] = contextvars.ContextVar("vehicle", default=DEFAULT_VEHICLE)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks: records that do not fit in the queue are dropped.
+
+    Attributes
+    ----------
+    dropped : int
+        The number of records dropped because the queue was full.
+    """
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]") -> None:
+        super().__init__(log_queue)
+        self.dropped: int = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """
+        Puts a record on the queue, dropping it if the queue is full
+
+        Parameters
+        ----------
+        record : LogRecord
+            The prepared record
+        """
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(QueueListener):
+    """
+    QueueListener whose stop waits for room in a full queue instead of raising, so
+    every record queued before stopping is still written out.
+    """
+
+    def enqueue_sentinel(self) -> None:
+        """
+        Puts the sentinel that stops the listener thread at the end of the queue
+        """
+        self.queue.put(self._sentinel)  # type: ignore[attr-defined]
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most one record per interval from each logging call that asks
+    for it with extra={"rate_limit": seconds}, so hot loops can log every iteration.
+    The next record let through says how many were suppressed in between.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        # Last time a record got through and records suppressed since, per call site
+        self._sites: dict[tuple[str, int], list[float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """
+        Decides whether a record is logged
+
+        Parameters
+        ----------
+        record : LogRecord
+            The record to check
+
+        Returns
+        -------
+        allowed : bool
+            False if the record is suppressed
+        """
+        interval: Optional[float] = getattr(record, "rate_limit", None)
+        if interval is None:
+            return True
+
+        now: float = time.monotonic()
+        site: list[float] = self._sites.setdefault((record.pathname, record.lineno), [-interval, 0])
+        if now - site[0] < interval:
+            site[1] += 1
+            return False
+
+        if site[1]:
+            record.msg = f"{record.msg} ({int(site[1])} suppressed)"
+        site[0] = now
+        site[1] = 0
+        return True
+
+
+class VehicleFilter(logging.Filter):
+    """
+    Tags every record with the vehicle of the context it was logged in, as
+    record.vehicle, before it leaves the logging thread or process.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """
+        Tags a record with its vehicle
+
+        Parameters
+        ----------
+        record : LogRecord
+            The record to tag
+
+        Returns
+        -------
+        allowed : bool
+            Always True
+        """
+        record.vehicle = VEHICLE.get()
+        return True
+
+
+class JsonFormatter(Formatter):
+    """
+    Formats records as compact JSON lines, for tools that read the logs after a flight.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Formats a record as one line of JSON
+
+        Parameters
+        ----------
+        record : LogRecord
+            The record to format
+
+        Returns
+        -------
+        line : str
+            The record as a JSON object
+        """
+        entry: dict[str, object] = {
+            "time": record.created,
+            "level": record.levelname,
+            "process": record.processName,
+            "vehicle": getattr(record, "vehicle", DEFAULT_VEHICLE),
+            "function": record.funcName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, separators=(",", ":"))
 
 
-def init_logger(queue: Queue[str]) -> QueueListener:
+def init_logger(
+    log_queue: "queue.Queue[logging.LogRecord]", json_lines: bool = False
+) -> QueueListener:
     """
     Creates a QueueListener that will process all log messages throughout the application
 
     Parameters
     ----------
-    queue: Queue[str]
+    log_queue: Queue[LogRecord]
         Queue object that holds logging processes
+    json_lines: bool
+        Write the log file as JSON lines instead of text
 
     Returns
     -------
@@ -26,27 +196,118 @@ def init_logger(queue: Queue[str]) -> QueueListener:
         Object to process log messages
     """
     console_formatter: Formatter = logging.Formatter(LOG_FORMAT)
-    file_formatter: Formatter = logging.Formatter(LOG_FORMAT)
+    file_formatter: Formatter = JsonFormatter() if json_lines else logging.Formatter(LOG_FORMAT)
 
-    file: FileHandler = logging.FileHandler(LOG_FILE, "a")
+    # The directory is only created once logging starts, not when the module is imported
+    os.makedirs(LOG_DIR, exist_ok=True)
+    file: FileHandler = logging.FileHandler(
+        os.path.join(LOG_DIR, LOG_FILE.format(time=datetime.now())), "a", encoding="UTF-8"
+    )
     file.setFormatter(file_formatter)
 
     console: StreamHandler[TextIO] = logging.StreamHandler()
     console.setFormatter(console_formatter)
 
-    return QueueListener(queue, file, console)
+    return DrainingQueueListener(log_queue, file, console, respect_handler_level=True)
 
 
-def worker_configurer(queue: Queue[str]) -> None:
+def worker_configurer(log_queue: "queue.Queue[logging.LogRecord]") -> DroppingQueueHandler:
     """
     It configures the logger of this process to submit logs to the logging process (QueueListener)
 
     Parameters
     ----------
-    queue: Queue[str]
+    log_queue: Queue[LogRecord]
         Queue object that holds logging processes
+
+    Returns
+    -------
+    queue_handler: DroppingQueueHandler
+        The handler installed on the root logger
     """
-    queue_handler: QueueHandler = QueueHandler(queue)  # Just the one handler needed
+    queue_handler: DroppingQueueHandler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter())
+    queue_handler.addFilter(VehicleFilter())
     root: logging.Logger = logging.getLogger()
     root.addHandler(queue_handler)
     root.setLevel(LOG_LEVEL)
+    return queue_handler
+
+
+_LISTENER: Optional[QueueListener] = None
+_HANDLER: Optional[DroppingQueueHandler] = None
+_QUEUE: "Optional[queue.Queue[logging.LogRecord]]" = None
+_LOCK: threading.Lock = threading.Lock()
+
+
+def start_logging(json_lines: bool = False, processes: bool = False) -> None:
+    """
+    Starts the listener thread and routes every log record of this process through it.
+    Does nothing if logging was already started.
+
+    Parameters
+    ----------
+    json_lines: bool
+        Write the log file as JSON lines instead of text
+    processes: bool
+        Use a queue other processes can log to as well, through worker_configurer
+        with shared_queue()
+    """
+    global _LISTENER, _HANDLER, _QUEUE
+    with _LOCK:
+        if _LISTENER is not None:
+            return
+        log_queue: queue.Queue[logging.LogRecord] = (
+            multiprocessing.Queue(QUEUE_SIZE)  # type: ignore[assignment]
+            if processes
+            else queue.Queue(QUEUE_SIZE)
+        )
+        _LISTENER = init_logger(log_queue, json_lines)
+        _LISTENER.start()
+        _HANDLER = worker_configurer(log_queue)
+        _QUEUE = log_queue
+
+
+def stop_logging() -> None:
+    """
+    Writes out every queued record, stops the listener thread and reports dropped records
+    """
+    global _LISTENER, _HANDLER, _QUEUE
+    with _LOCK:
+        if _LISTENER is None or _HANDLER is None:
+            return
+        dropped: int = _HANDLER.dropped
+        if dropped:
+            logging.warning("Dropped %d log records because the log queue was full", dropped)
+        logging.getLogger().removeHandler(_HANDLER)
+        # Stopping enqueues a sentinel and waits for the thread to drain the queue
+        _LISTENER.stop()
+        for handler in _LISTENER.handlers:
+            handler.close()
+        _LISTENER = None
+        _HANDLER = None
+        _QUEUE = None
+
+
+def shared_queue() -> "Optional[queue.Queue[logging.LogRecord]]":
+    """
+    Returns the queue the listener thread reads, for worker processes to log to
+
+    Returns
+    -------
+    log_queue : Optional[Queue[LogRecord]]
+        The queue, None if logging was not started
+    """
+    return _QUEUE
+
+
+def dropped_records() -> int:
+    """
+    Returns the number of log records dropped so far because the queue was full
+
+    Returns
+    -------
+    dropped : int
+        The number of dropped records, 0 if logging was not started
+    """
+    return _HANDLER.dropped if _HANDLER is not None else 0
@@ -0,0 +1,564 @@
+"""
+Lightweight metrics for the hot paths of the flight code. Counters, gauges and
+log-linear histograms live in one registry keyed by name and labels, and are exported
+in the Prometheus text format, to a file at the end of the flight or from an endpoint
+on localhost while it flies.
+
+Instrumentation is off until enable() is called. While it is off a timer costs a
+flag check and no clock reads, so the timers can stay in the control loops.
+"""
+import asyncio
+import functools
+import logging
+import os
+from types import TracebackType
+from typing import Any, Callable, Coroutine, Optional, ParamSpec, Type, TypeVar, Union
+
+from flight import logger
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+SUB_BUCKET_BITS: int = 7  # 64 histogram buckets per power of two, under 1% relative error
+HALF_BUCKETS: int = 1 << (SUB_BUCKET_BITS - 1)
+UNIT: float = 1e-6  # Resolution of histograms, values are counted in microseconds
+LOCALHOST: str = "127.0.0.1"  # Metrics are only served to the companion computer itself
+CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"  # Prometheus text format
+COMMAND_METRIC: str = "command_latency_seconds"  # Histogram of every command sent to the drone
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Counter:
+    """
+    A value that only goes up, such as the number of setpoints sent.
+
+    Attributes
+    ----------
+    name : str
+        Name of the metric.
+    description : str
+        Help text of the metric.
+    labels : Labels
+        Label names and values of this series of the metric.
+    value : float
+        The current count.
+    """
+
+    kind: str = "counter"
+
+    def __init__(self, name: str, description: str = "", labels: Labels = ()) -> None:
+        self.name: str = name
+        self.description: str = description
+        self.labels: Labels = labels
+        self.value: float = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        """
+        Adds to the count
+
+        Parameters
+        ----------
+        amount : float
+            The amount to add, never negative
+        """
+        self.value += amount
+
+    def samples(self) -> list[tuple[str, Labels, float]]:
+        """
+        Returns the series of the metric as name suffix, labels and value
+        """
+        return [("", self.labels, self.value)]
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, such as the age of the latest sample.
+
+    Attributes
+    ----------
+    name : str
+        Name of the metric.
+    description : str
+        Help text of the metric.
+    labels : Labels
+        Label names and values of this series of the metric.
+    value : float
+        The current value.
+    """
+
+    kind: str = "gauge"
+
+    def set(self, value: float) -> None:
+        """
+        Replaces the value
+
+        Parameters
+        ----------
+        value : float
+            The new value
+        """
+        self.value = value
+
+
+class Histogram:
+    """
+    Distribution of durations in seconds, in the style of an HDR histogram. Values are
+    counted in UNIT steps into buckets that are exact below 2**SUB_BUCKET_BITS steps and
+    then split every power of two into HALF_BUCKETS buckets, so the relative error stays
+    under 1% from microseconds to hours while recording is a few integer operations.
+
+    Attributes
+    ----------
+    name : str
+        Name of the metric.
+    description : str
+        Help text of the metric.
+    labels : Labels
+        Label names and values of this series of the metric.
+    counts : dict[int, int]
+        Samples in each bucket that has any, by bucket index.
+    count : int
+        The number of samples recorded.
+    total : float
+        Sum of every sample in seconds.
+    maximum : float
+        The largest sample in seconds.
+    """
+
+    kind: str = "histogram"
+
+    def __init__(self, name: str, description: str = "", labels: Labels = ()) -> None:
+        self.name: str = name
+        self.description: str = description
+        self.labels: Labels = labels
+        self.counts: dict[int, int] = {}
+        self.count: int = 0
+        self.total: float = 0.0
+        self.maximum: float = 0.0
+
+    def record(self, value: float) -> None:
+        """
+        Records one sample
+
+        Parameters
+        ----------
+        value : float
+            The sample in seconds, negative samples are counted as zero
+        """
+        steps: int = int(value / UNIT) if value > 0.0 else 0
+        shift: int = steps.bit_length() - SUB_BUCKET_BITS
+        index: int = shift * HALF_BUCKETS + (steps >> shift) if shift > 0 else steps
+        counts: dict[int, int] = self.counts
+        counts[index] = counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+
+    def percentile(self, percent: float) -> float:
+        """
+        Returns the upper bound of the bucket holding a percentile
+
+        Parameters
+        ----------
+        percent : float
+            The percentile, from 0 to 100
+
+        Returns
+        -------
+        value : float
+            Seconds, never more than the largest sample
+        """
+        if not self.count:
+            return 0.0
+        rank: float = self.count * percent / 100.0
+        seen: int = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(bucket_bound(index), self.maximum)
+        return self.maximum
+
+    def summary(self) -> str:
+        """
+        Returns the sample count, mean, p50, p99 and maximum as one line
+        """
+        mean: float = self.total / self.count if self.count else 0.0
+        return (
+            f"{self.count} samples, mean {mean * 1e3:.2f} ms, "
+            f"p50 {self.percentile(50.0) * 1e3:.2f} ms, p99 {self.percentile(99.0) * 1e3:.2f} ms, "
+            f"max {self.maximum * 1e3:.2f} ms"
+        )
+
+    def samples(self) -> list[tuple[str, Labels, float]]:
+        """
+        Returns the series of the metric as name suffix, labels and value, with a
+        cumulative bucket for every bucket that has samples
+        """
+        series: list[tuple[str, Labels, float]] = []
+        seen: int = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            bound: Labels = self.labels + (("le", f"{bucket_bound(index):.9g}"),)
+            series.append(("_bucket", bound, seen))
+        series.append(("_bucket", self.labels + (("le", "+Inf"),), self.count))
+        series.append(("_sum", self.labels, self.total))
+        series.append(("_count", self.labels, self.count))
+        return series
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class Timer:
+    """
+    Context manager recording the time spent inside it into a histogram.
+
+    Attributes
+    ----------
+    histogram : Histogram
+        The histogram the duration is recorded into.
+    """
+
+    __slots__ = ("histogram", "_start")
+
+    def __init__(self, histogram: Histogram) -> None:
+        self.histogram: Histogram = histogram
+        self._start: float = 0.0
+
+    def __enter__(self) -> "Timer":
+        self._start = asyncio.get_running_loop().time()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.histogram.record(asyncio.get_running_loop().time() - self._start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        pass
+
+
+_NULL_TIMER: _NullTimer = _NullTimer()
+_METRICS: dict[tuple[str, Labels], Metric] = {}
+_enabled: bool = False
+
+
+def enable() -> None:
+    """
+    Turns the instrumentation of the flight code on
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    """
+    Turns the instrumentation of the flight code off, keeping what was recorded
+    """
+    global _enabled
+    _enabled = False
+
+
+def enabled() -> bool:
+    """
+    Returns whether the instrumentation is on, for call sites that record values
+    themselves
+    """
+    return _enabled
+
+
+def bucket_bound(index: int) -> float:
+    """
+    Returns the upper bound of a histogram bucket
+
+    Parameters
+    ----------
+    index : int
+        Index of the bucket
+
+    Returns
+    -------
+    bound : float
+        Seconds, every sample in the bucket is below it
+    """
+    shift: int = max(0, index // HALF_BUCKETS - 1)
+    return ((index - shift * HALF_BUCKETS + 1) << shift) * UNIT
+
+
+def register(metric: Metric) -> Metric:
+    """
+    Adds a metric to the registry, replacing any with the same name and labels
+
+    Parameters
+    ----------
+    metric : Metric
+        The metric to export
+
+    Returns
+    -------
+    metric : Metric
+        The same metric
+    """
+    _METRICS[(metric.name, metric.labels)] = metric
+    return metric
+
+
+def _get(kind: Type[Metric], name: str, description: str, labels: dict[str, str]) -> Any:
+    key: tuple[str, Labels] = (name, tuple(sorted(labels.items())))
+    metric: Optional[Metric] = _METRICS.get(key)
+    if metric is None:
+        metric = _METRICS[key] = kind(name, description, key[1])
+    elif type(metric) is not kind:
+        raise ValueError(f"Metric {name} is a {metric.kind}, not a {kind.kind}")
+    return metric
+
+
+def counter(name: str, description: str = "", **labels: str) -> Counter:
+    """
+    Returns the counter with a name and labels, creating it the first time
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric
+    description : str
+        Help text of the metric
+    labels : str
+        Label values of the series, by label name
+
+    Returns
+    -------
+    counter : Counter
+        The registered counter
+    """
+    result: Counter = _get(Counter, name, description, labels)
+    return result
+
+
+def gauge(name: str, description: str = "", **labels: str) -> Gauge:
+    """
+    Returns the gauge with a name and labels, creating it the first time
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric
+    description : str
+        Help text of the metric
+    labels : str
+        Label values of the series, by label name
+
+    Returns
+    -------
+    gauge : Gauge
+        The registered gauge
+    """
+    result: Gauge = _get(Gauge, name, description, labels)
+    return result
+
+
+def histogram(name: str, description: str = "", **labels: str) -> Histogram:
+    """
+    Returns the histogram with a name and labels, creating it the first time
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric
+    description : str
+        Help text of the metric
+    labels : str
+        Label values of the series, by label name
+
+    Returns
+    -------
+    histogram : Histogram
+        The registered histogram
+    """
+    result: Histogram = _get(Histogram, name, description, labels)
+    return result
+
+
+def timer(histogram_metric: Histogram) -> Union[Timer, _NullTimer]:
+    """
+    Returns a context manager timing its body into a histogram, which does nothing
+    while the instrumentation is off
+
+    Parameters
+    ----------
+    histogram_metric : Histogram
+        The histogram the duration is recorded into
+
+    Returns
+    -------
+    timer : Union[Timer, _NullTimer]
+        The context manager
+    """
+    if not _enabled:
+        return _NULL_TIMER
+    return Timer(histogram_metric)
+
+
+def time_command(name: str) -> Union[Timer, _NullTimer]:
+    """
+    Returns a context manager timing a command sent to the drone, labelled with the
+    name of the command and the vehicle it was sent to
+
+    Parameters
+    ----------
+    name : str
+        Name of the command, as given to recorder.record_command
+
+    Returns
+    -------
+    timer : Union[Timer, _NullTimer]
+        The context manager
+    """
+    if not _enabled:
+        return _NULL_TIMER
+    return Timer(
+        histogram(
+            COMMAND_METRIC,
+            "Seconds until the drone acknowledged",
+            command=name,
+            vehicle=logger.VEHICLE.get(),
+        )
+    )
+
+
+def timed(
+    name: str, description: str = ""
+) -> Callable[[Callable[P, Coroutine[Any, Any, T]]], Callable[P, Coroutine[Any, Any, T]]]:
+    """
+    Decorates a coroutine function to time every call into a histogram
+
+    Parameters
+    ----------
+    name : str
+        Name of the histogram
+    description : str
+        Help text of the histogram
+
+    Returns
+    -------
+    decorator : Callable
+        Decorator of the coroutine function
+    """
+    histogram_metric: Histogram = histogram(name, description)
+
+    def decorate(
+        function: Callable[P, Coroutine[Any, Any, T]]
+    ) -> Callable[P, Coroutine[Any, Any, T]]:
+        @functools.wraps(function)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+            if not _enabled:
+                return await function(*args, **kwargs)
+            with Timer(histogram_metric):
+                return await function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render() -> str:
+    """
+    Returns every metric in the Prometheus text exposition format
+    """
+    by_name: dict[str, list[Metric]] = {}
+    for metric in _METRICS.values():
+        by_name.setdefault(metric.name, []).append(metric)
+
+    lines: list[str] = []
+    for name in sorted(by_name):
+        metrics: list[Metric] = by_name[name]
+        lines.append(f"# HELP {name} {_escape(metrics[0].description)}")
+        lines.append(f"# TYPE {name} {metrics[0].kind}")
+        for metric in sorted(metrics, key=lambda series: series.labels):
+            for suffix, labels, value in metric.samples():
+                label_text: str = ",".join(f'{key}="{_escape(text)}"' for key, text in labels)
+                lines.append(
+                    f"{name}{suffix}{{{label_text}}} {value!r}"
+                    if labels
+                    else f"{name}{suffix} {value!r}"
+                )
+    return "\n".join(lines) + "\n"
+
+
+def dump(path: str) -> None:
+    """
+    Writes every metric to a file in the Prometheus text format, replacing it
+    atomically so a scraper never reads half a file
+
+    Parameters
+    ----------
+    path : str
+        The file to write
+    """
+    directory: str = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    partial: str = f"{path}.tmp"
+    with open(partial, "w", encoding="utf-8") as file:
+        file.write(render())
+    os.replace(partial, path)
+    logging.info("Wrote %d metrics to %s", len(_METRICS), path)
+
+
+async def serve(port: int, host: str = LOCALHOST) -> asyncio.AbstractServer:
+    """
+    Serves the metrics over HTTP for Prometheus to scrape, on every path
+
+    Parameters
+    ----------
+    port : int
+        The TCP port to listen on
+    host : str
+        The address to listen on, localhost only by default
+
+    Returns
+    -------
+    server : AbstractServer
+        The listening server, close it to stop serving
+    """
+    server: asyncio.AbstractServer = await asyncio.start_server(_answer_scrape, host, port)
+    logging.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return server
+
+
+async def _answer_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        # Every request gets the metrics, so the request line and headers are skipped
+        while (await reader.readline()).strip():
+            pass
+        body: bytes = render().encode()
+        writer.write(
+            f"HTTP/1.0 200 OK\r\nContent-Type: {CONTENT_TYPE}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        logging.debug("Metrics scrape disconnected")
+    finally:
+        writer.close()
@@ -0,0 +1,393 @@
+"""
+Binary flight-data recorder. Every telemetry sample and every command sent to the
+drone is written as a fixed-size record into a ring buffer that lives in a
+memory-mapped file, so the record survives the flight code crashing or being killed,
+and a whole flight can be loaded back as a NumPy array without copying.
+
+File layout
+-----------
+A HEADER_SIZE byte header followed by `capacity` records of RECORD_SIZE bytes:
+
+    header : magic (8s), version (I), record size (I), capacity (Q), written (Q)
+    record : time (d), kind (H), reserved (H), sequence (I), values (6d)
+
+`written` counts every record ever written, so record i lives in slot i % capacity.
+"""
+import asyncio
+import logging
+import mmap
+import os
+import struct
+from typing import Any, Callable, Optional
+
+import numpy as np
+import numpy.typing as npt
+from mavsdk import System
+
+from flight.telemetry_hub import TelemetryHub
+
+MAGIC: bytes = b"ARGFDR01"
+VERSION: int = 1
+HEADER: struct.Struct = struct.Struct("<8sIIQQ")
+HEADER_SIZE: int = 64
+WRITTEN: struct.Struct = struct.Struct("<Q")
+WRITTEN_OFFSET: int = 24  # Byte offset of the written counter in the header
+RECORD: struct.Struct = struct.Struct("<dHHI6d")
+RECORD_SIZE: int = RECORD.size
+VALUES: int = 6  # Numeric values stored per record
+FLIGHT_DURATION: float = 1800.0  # Seconds of flight the default ring holds before wrapping
+# Records per second at most: the telemetry of the landing phase and its 20 Hz setpoints
+RECORD_RATE: float = 100.0
+DEFAULT_CAPACITY: int = int(FLIGHT_DURATION * RECORD_RATE)  # Records, about 11 MiB
+FLUSH_INTERVAL: float = 1.0  # Seconds between msyncs of the file to disk
+
+# Record kinds of telemetry streams
+STREAM_KINDS: dict[str, int] = {
+    "position": 1,
+    "home": 2,
+    "in_air": 3,
+    "flight_mode": 4,
+    "velocity": 5,
+    "battery": 6,
+    "attitude": 7,
+    "mission_progress": 8,
+}
+# Record kinds of commands sent to the drone
+COMMAND_KINDS: dict[str, int] = {
+    "arm": 100,
+    "kill": 101,
+    "land": 102,
+    "hold": 103,
+    "goto_location": 104,
+    "set_current_speed": 105,
+    "set_maximum_speed": 106,
+    "offboard_start": 107,
+    "offboard_stop": 108,
+    "set_velocity_ned": 109,
+    "set_velocity_body": 110,
+    "upload_mission": 111,
+    "clear_mission": 112,
+    "start_mission": 113,
+    "set_param": 114,
+    "set_rate": 115,
+}
+
+RECORD_DTYPE: np.dtype[Any] = np.dtype(
+    [
+        ("time", "<f8"),
+        ("kind", "<u2"),
+        ("reserved", "<u2"),
+        ("sequence", "<u4"),
+        ("values", "<f8", (VALUES,)),
+    ]
+)
+
+NAN: float = float("nan")
+
+
+class FlightRecorder:
+    """
+    Writes telemetry samples and commands into a memory-mapped ring buffer.
+
+    Attributes
+    ----------
+    path : str
+        Path of the recording file.
+    capacity : int
+        The number of records the ring buffer holds before overwriting the oldest.
+    written : int
+        The number of records written since the file was created.
+    """
+
+    def __init__(self, path: str, capacity: int = DEFAULT_CAPACITY) -> None:
+        self.path: str = path
+        self.capacity: int = capacity
+        self.written: int = 0
+
+        directory: str = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        size: int = HEADER_SIZE + capacity * RECORD_SIZE
+        self._fd: int = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(self._fd, size)
+        self._map: mmap.mmap = mmap.mmap(self._fd, size, mmap.MAP_SHARED)
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD_SIZE, capacity, 0)
+
+        # Record kind and bound writer of each stream, looked up once per sample
+        self._writers: dict[str, tuple[int, Callable[[int, Any, float], None]]] = {
+            "position": (STREAM_KINDS["position"], self._write_position),
+            "home": (STREAM_KINDS["home"], self._write_position),
+            "in_air": (STREAM_KINDS["in_air"], self._write_flag),
+            "flight_mode": (STREAM_KINDS["flight_mode"], self._write_enum),
+            "velocity": (STREAM_KINDS["velocity"], self._write_velocity),
+            "battery": (STREAM_KINDS["battery"], self._write_battery),
+            "attitude": (STREAM_KINDS["attitude"], self._write_attitude),
+            "mission_progress": (STREAM_KINDS["mission_progress"], self._write_progress),
+        }
+        self._flusher: Optional[asyncio.Task[None]] = None
+        self._hub: Optional[TelemetryHub] = None
+
+    def attach(self, hub: TelemetryHub) -> None:
+        """
+        Starts recording every sample of the hub's streams and flushing periodically
+
+        Parameters
+        ----------
+        hub : TelemetryHub
+            The telemetry hub of the drone being recorded
+        """
+        hub.add_listener(self.record_sample, list(self._writers))
+        self._hub = hub
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    def record_sample(self, name: str, sample: Any, now: float) -> None:
+        """
+        Writes one telemetry sample, matching the TelemetryHub listener signature
+
+        Parameters
+        ----------
+        name : str
+            The hub name of the stream
+        sample : Any
+            The telemetry sample
+        now : float
+            Event loop time the sample arrived at
+        """
+        kind: int
+        writer: Callable[[int, Any, float], None]
+        kind, writer = self._writers[name]
+        writer(kind, sample, now)
+
+    def record_command(
+        self,
+        name: str,
+        now: float,
+        a: float = NAN,
+        b: float = NAN,
+        c: float = NAN,
+        d: float = NAN,
+        e: float = NAN,
+        f: float = NAN,
+    ) -> None:
+        """
+        Writes one command sent to the drone, with up to six numeric arguments
+
+        Parameters
+        ----------
+        name : str
+            The command name, one of COMMAND_KINDS
+        now : float
+            Event loop time the command was sent at
+        a, b, c, d, e, f : float
+            The numeric arguments of the command, nan when unused
+        """
+        self._write(COMMAND_KINDS[name], now, a, b, c, d, e, f)
+
+    def flush(self) -> None:
+        """
+        Forces the mapped pages to disk. The data already survives the process dying
+        without this, flushing only protects against losing power.
+        """
+        self._map.flush()
+
+    async def close(self) -> None:
+        """
+        Stops recording and periodic flushing, flushes and closes the file
+        """
+        if self._hub is not None:
+            self._hub.remove_listener(self.record_sample)
+            self._hub = None
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await asyncio.to_thread(self.flush)
+        self._map.close()
+        os.close(self._fd)
+        logging.info("Recorded %d records to %s", self.written, self.path)
+
+    def _write(
+        self, kind: int, now: float, a: float, b: float, c: float, d: float, e: float, f: float
+    ) -> None:
+        """
+        Packs one record into its ring buffer slot, then publishes it in the header
+        """
+        offset: int = HEADER_SIZE + (self.written % self.capacity) * RECORD_SIZE
+        RECORD.pack_into(
+            self._map, offset, now, kind, 0, self.written & 0xFFFFFFFF, a, b, c, d, e, f
+        )
+        self.written += 1
+        WRITTEN.pack_into(self._map, WRITTEN_OFFSET, self.written)
+
+    def _write_position(self, kind: int, sample: Any, now: float) -> None:
+        self._write(
+            kind,
+            now,
+            sample.latitude_deg,
+            sample.longitude_deg,
+            sample.absolute_altitude_m,
+            sample.relative_altitude_m,
+            NAN,
+            NAN,
+        )
+
+    def _write_flag(self, kind: int, sample: Any, now: float) -> None:
+        self._write(kind, now, 1.0 if sample else 0.0, NAN, NAN, NAN, NAN, NAN)
+
+    def _write_enum(self, kind: int, sample: Any, now: float) -> None:
+        self._write(kind, now, sample.value, NAN, NAN, NAN, NAN, NAN)
+
+    def _write_velocity(self, kind: int, sample: Any, now: float) -> None:
+        self._write(kind, now, sample.north_m_s, sample.east_m_s, sample.down_m_s, NAN, NAN, NAN)
+
+    def _write_battery(self, kind: int, sample: Any, now: float) -> None:
+        self._write(kind, now, sample.voltage_v, sample.remaining_percent, NAN, NAN, NAN, NAN)
+
+    def _write_progress(self, kind: int, sample: Any, now: float) -> None:
+        self._write(kind, now, sample.current, sample.total, NAN, NAN, NAN, NAN)
+
+    def _write_attitude(self, kind: int, sample: Any, now: float) -> None:
+        self._write(
+            kind,
+            now,
+            sample.roll_deg,
+            sample.pitch_deg,
+            sample.yaw_deg,
+            sample.timestamp_us,
+            NAN,
+            NAN,
+        )
+
+    async def _flush_periodically(self) -> None:
+        """
+        Flushes the file to disk off the event loop every FLUSH_INTERVAL seconds
+        """
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await asyncio.to_thread(self.flush)
+
+
+def load_flight(path: str) -> npt.NDArray[Any]:
+    """
+    Loads every record still in a recording, oldest first, as a structured array
+    with the fields of RECORD_DTYPE. Works on files left behind by a crashed process.
+
+    Parameters
+    ----------
+    path : str
+        Path of the recording file
+
+    Returns
+    -------
+    records : NDArray
+        The records. This is a zero-copy view of the memory-mapped file unless the
+        ring buffer wrapped, in which case the two halves are joined into a copy.
+    """
+    magic: bytes
+    version: int
+    record_size: int
+    capacity: int
+    written: int
+    with open(path, "rb") as recording:
+        magic, version, record_size, capacity, written = HEADER.unpack(recording.read(HEADER.size))
+    if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+        raise ValueError(f"{path} is not a version {VERSION} flight recording")
+
+    ring: npt.NDArray[Any] = np.memmap(
+        path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(capacity,)
+    )
+    if written <= capacity:
+        return ring[:written]
+    head: int = written % capacity
+    return np.concatenate((ring[head:], ring[:head]))
+
+
+def select(records: npt.NDArray[Any], name: str) -> npt.NDArray[Any]:
+    """
+    Returns the records of one stream or command from a loaded flight
+
+    Parameters
+    ----------
+    records : NDArray
+        Records returned by load_flight
+    name : str
+        A stream name from STREAM_KINDS or a command name from COMMAND_KINDS
+
+    Returns
+    -------
+    selected : NDArray
+        The matching records, oldest first
+    """
+    kind: int = STREAM_KINDS[name] if name in STREAM_KINDS else COMMAND_KINDS[name]
+    return records[records["kind"] == kind]
+
+
+_RECORDERS: dict[System, FlightRecorder] = {}
+
+
+def start_recording(drone: System, hub: TelemetryHub, path: str) -> FlightRecorder:
+    """
+    Creates a recorder for a drone and attaches it to the drone's telemetry hub
+
+    Parameters
+    ----------
+    drone : System
+        The drone being recorded
+    hub : TelemetryHub
+        The telemetry hub of the drone
+    path : str
+        Path of the recording file to create
+
+    Returns
+    -------
+    recorder : FlightRecorder
+        The recorder of the drone
+    """
+    recorder: FlightRecorder = FlightRecorder(path)
+    recorder.attach(hub)
+    _RECORDERS[drone] = recorder
+    logging.info("Recording flight data to %s", path)
+    return recorder
+
+
+async def stop_recording(drone: System) -> None:
+    """
+    Closes the recorder of a drone, if it has one
+
+    Parameters
+    ----------
+    drone : System
+        The drone being recorded
+    """
+    recorder: Optional[FlightRecorder] = _RECORDERS.pop(drone, None)
+    if recorder is not None:
+        await recorder.close()
+
+
+def record_command(
+    drone: System,
+    name: str,
+    a: float = NAN,
+    b: float = NAN,
+    c: float = NAN,
+    d: float = NAN,
+    e: float = NAN,
+    f: float = NAN,
+) -> None:
+    """
+    Records a command sent to a drone if the drone is being recorded
+
+    Parameters
+    ----------
+    drone : System
+        The drone the command was sent to
+    name : str
+        The command name, one of COMMAND_KINDS
+    a, b, c, d, e, f : float
+        The numeric arguments of the command, nan when unused
+    """
+    recorder: Optional[FlightRecorder] = _RECORDERS.get(drone)
+    if recorder is not None:
+        recorder.record_command(name, asyncio.get_running_loop().time(), a, b, c, d, e, f)
@@ -2,81 +2,166 @@
 runs a mission from a json file to get the drone above a target and lands it
 """
 import asyncio
+import functools
 import logging
+from typing import Optional
 
 from mavsdk import System
-from flight import intake_gps, landing
+from flight import (
+    commands,
+    connection,
+    descent,
+    geo,
+    intake_gps,
+    landing,
+    metrics,
+    telemetry_rates,
+    terrain,
+    triggers,
+    upload_mission,
+)
+from flight.flight import OFFLINE_ADDR, SIM_ADDR
+from flight.sim import clock
+from flight.sim.system import is_simulated
+from flight.telemetry_hub import get_hub
 
 import argparse
 
+LANDING_ALTITUDE: float = 75.0  # Meters above the ground the landing controller takes over at
+DESCENT_RADIUS: float = 10.0  # Meters from the target within which the mission descends
 
-async def run_mission(competition: bool) -> None:
+# Time from starting the mission to the drone descending through LANDING_ALTITUDE
+TRANSIT_TIME: metrics.Histogram = metrics.histogram(
+    "mission_transit_seconds", "Seconds from starting the mission to the landing handover"
+)
+
+
+async def run_mission(
+    drone: System,
+    competition: bool,
+    targets: Optional[intake_gps.TargetData] = None,
+    profile: Optional[descent.DescentProfile] = None,
+) -> landing.DescentStats:
     """
     Uses data from a json file to retrieve a mission then runs it to get the drone above the target
-    once the drone gets 225 feet above the ground the landing code is run which brings it down
-    at progressively slower speeds precisely over the target till it lands the drone and shut down
+    once the drone gets 225 feet above the ground under it the landing code is run which brings
+    it down at progressively slower speeds precisely over the target till it lands the drone and
+    shut down
 
     Parameters
     ----------
+    drone : System
+        The shared, already connected drone object.
     competition : bool
         Decides if competition waypoint are used in the mission or not.
+    targets : Optional[TargetData]
+        The already loaded targets, loaded from the competition or golf course file if None.
+    profile : Optional[DescentProfile]
+        The landing descent, planned for the default vehicle limits if None.
+
+    Returns
+    -------
+    stats : DescentStats
+        The timing and accuracy of the landing
 
     Notes
     -----
     Drone will be shut off after this is run
-    It can be run by python3 run_mission.py -file {json file path}
+    It can be run by python3 -m flight.run_mission [-c]
     """
 
-    waypoint: str
-    if competition:
-        waypoint = "flight/data/target_data.json"
-    else:
-        waypoint = "flight/data/golf_target.json"
-
-    drone = System()
-    await drone.connect(system_address="udp://:14540")
-
-    logging.info("Waiting for drone to connect...")
-    async for state in drone.core.connection_state():
-        if state.is_connected:
-            logging.info("Drone discovered!")
-            break
-
-    # Set an initial speed limit
-    await drone.action.set_maximum_speed(20)
-
-    logging.info("Getting target location and ground altitude for landing...")
-    target_data: intake_gps.Waypoint
-    ground_altitude: float
-    target_data, ground_altitude = await intake_gps.extract_gps(waypoint)
-    target_latitude = target_data[0]
-    target_longitude = target_data[1]
-    await drone.mission.start_mission()
+    # Set an initial horizontal speed limit in m/s
+    await commands.send(
+        drone,
+        "set_maximum_speed",
+        functools.partial(drone.action.set_maximum_speed, 20),
+        20.0,
+        dedupe=True,
+    )
+
+    if targets is None:
+        logging.info("Getting target location and ground altitude for landing...")
+        targets = await intake_gps.load_targets(intake_gps.target_path(competition))
+    target_latitude: float = targets.target.latitude
+    target_longitude: float = targets.target.longitude
+    ground: terrain.Terrain = await terrain.load_terrain(
+        terrain.terrain_path(competition),
+        targets.ground_altitude,
+        await get_hub(drone).wait_latest("home"),
+    )
+    if profile is None:
+        # Plan the landing descent now, so the control loop only looks speeds up
+        profile = descent.plan_descent(LANDING_ALTITUDE, landing.TOUCHDOWN_HEIGHT)
+    await commands.send(drone, "start_mission", drone.mission.start_mission)
+    await telemetry_rates.enter_phase(drone, "cruise")
     logging.info("running the mission")
-    # Once the drone is below 75m the slow landing code begins to run
+    # Once the drone is below LANDING_ALTITUDE the landing code begins to run
     # This is needed as the mission won't end unless a break is included
-    async for position in drone.telemetry.position():
-        current_altitude: float = round(position.relative_altitude_m, 3)
-        if current_altitude < 75.0:
-            break
+    engine: triggers.TriggerEngine = triggers.get_engine(drone)
+    handover: triggers.Condition = triggers.below("landing_handover", LANDING_ALTITUDE, ground)
+    # The mission ends below LANDING_ALTITUDE, so finishing it first means it was cut short
+    finished: triggers.Condition = triggers.mission_item_reached("mission_finished", -1)
+    with metrics.timer(TRANSIT_TIME):
+        fired: triggers.Condition = await engine.wait(
+            handover,
+            finished,
+            triggers.within(
+                "descent_radius",
+                geo.LocalFrame(target_latitude, target_longitude),
+                DESCENT_RADIUS,
+            ),
+        )
+        if fired.name == "descent_radius":
+            # Over the target the mission descends, so the handover is watched closely
+            await telemetry_rates.enter_phase(drone, "descent")
+            fired = await engine.wait(handover, finished)
+    if fired is finished:
+        logging.warning("Mission finished above the landing altitude, landing from here")
 
     logging.info("Starting landing process...")
-    await landing.manual_land(drone, target_latitude, target_longitude)
+    return await landing.manual_land(
+        drone, target_latitude, target_longitude, profile=profile, ground=ground
+    )
+
+
+async def main(competition: bool, address: str = SIM_ADDR) -> None:
+    """
+    Connects to the simulator and runs the uploaded mission on its own.
+
+    Parameters
+    ----------
+    competition : bool
+        Decides if competition waypoint are used in the mission or not.
+    address : str
+        The system address of the simulator to connect to.
+    """
+    drone: System = await connection.get_drone(address)
+    if is_simulated(address):
+        # The offline simulator starts afresh with every run, so it has no mission yet
+        await upload_mission.upload_mission(drone, competition)
+    await run_mission(drone, competition)
 
 
 if __name__ == "__main__":
     """
     runs run_mission to land a drone with a mission from a json file then lands it precisely
     from the coordinates given by the json
-    This is run by python3 run_mission.py -file {json file path}
-    If no file path is specified it will use the default target data file path
+    This is run by python3 -m flight.run_mission [-c] [-o]
+    If -c is not given it will use the golf course target data file
+    -o uses the built-in offline simulator, uploading the mission first
     """
-    # Read file to be used as the data file using the -file argument
     parser: argparse.ArgumentParser = argparse.ArgumentParser()
-    parser.add_argument("-file")
+    parser.add_argument(
+        "-c", "--competition", help="Using the competition waypoints", action="store_true"
+    )
+    parser.add_argument(
+        "-o",
+        "--offline",
+        help="Using the built-in offline simulator, faster than real time",
+        action="store_true",
+    )
     args: argparse.Namespace = parser.parse_args()
-
-    DATA_PATH = vars(args)["file"]
-    if DATA_PATH is None:
-        DATA_PATH = "flight/data/target_data.json"
-    asyncio.run(run_mission(DATA_PATH))
+    if args.offline:
+        clock.run(main(args.competition, OFFLINE_ADDR))
+    else:
+        asyncio.run(main(args.competition))
@@ -0,0 +1,153 @@
+"""
+Virtual-time asyncio event loop. Whenever every task is waiting on a timer, the
+loop jumps its clock straight to the next timer instead of sleeping, so code that
+paces itself with asyncio.sleep and loop.time() runs faster than real time.
+"""
+import asyncio
+import selectors
+import time
+from asyncio import Future
+from typing import Any, Callable, Coroutine, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class VirtualTimeSelector(selectors.DefaultSelector):
+    """
+    Selector that advances a virtual clock instead of blocking on timeouts.
+
+    Attributes
+    ----------
+    time : float
+        The current virtual time in seconds.
+    speed : Optional[float]
+        Virtual seconds per real second, or None to run as fast as possible.
+    executor_jobs : int
+        Jobs of the loop running in worker threads. Time stands still until they finish,
+        as the clock cannot know how long they take.
+    """
+
+    def __init__(self, speed: Optional[float] = None) -> None:
+        super().__init__()
+        self.time: float = 0.0
+        self.speed: Optional[float] = speed
+        self.executor_jobs: int = 0
+
+    def select(self, timeout: Optional[float] = None) -> list[tuple[selectors.SelectorKey, int]]:
+        """
+        Returns ready I/O events, advancing the virtual clock by the timeout when
+        there are none
+
+        Parameters
+        ----------
+        timeout : Optional[float]
+            Seconds until the next timer of the loop, or None if there is none
+
+        Returns
+        -------
+        events : list[tuple[SelectorKey, int]]
+            The ready I/O events
+        """
+        if timeout is None:
+            # Nothing is scheduled, so only real I/O such as a worker thread can wake the loop
+            return super().select(None)
+        if timeout <= 0.0:
+            return super().select(0)
+        if self.executor_jobs:
+            # A finishing job wakes the loop through its self-pipe
+            return super().select(None)
+
+        if self.speed is None:
+            events: list[tuple[selectors.SelectorKey, int]] = super().select(0)
+            if not events:
+                self.time += timeout
+            return events
+
+        start: float = time.perf_counter()
+        events = super().select(timeout / self.speed)
+        if events:
+            self.time += min(timeout, (time.perf_counter() - start) * self.speed)
+        else:
+            self.time += timeout
+        return events
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop whose time() is the virtual clock of its VirtualTimeSelector.
+    """
+
+    def __init__(self, speed: Optional[float] = None) -> None:
+        self._virtual_selector: VirtualTimeSelector = VirtualTimeSelector(speed)
+        super().__init__(self._virtual_selector)
+
+    def time(self) -> float:
+        """
+        Returns the virtual time of the loop
+
+        Returns
+        -------
+        time : float
+            Virtual seconds since the loop was created
+        """
+        return self._virtual_selector.time
+
+    def run_in_executor(self, executor: Any, func: Callable[..., T], *args: Any) -> Future[T]:
+        """
+        Runs a function in an executor like SelectorEventLoop, holding the virtual
+        clock until it finishes
+
+        Parameters
+        ----------
+        executor : Any
+            The executor, or None for the default one
+        func : Callable[..., T]
+            The function to run
+        *args : Any
+            Arguments of the function
+
+        Returns
+        -------
+        future : Future[T]
+            Future of the result of the function
+        """
+        future: Future[T] = super().run_in_executor(executor, func, *args)
+        self._virtual_selector.executor_jobs += 1
+        future.add_done_callback(self._executor_job_done)
+        return future
+
+    def _executor_job_done(self, _: Future[Any]) -> None:
+        self._virtual_selector.executor_jobs -= 1
+
+
+def run(main: Coroutine[Any, Any, T], speed: Optional[float] = None) -> T:
+    """
+    Runs a coroutine to completion on a new virtual-time event loop, like asyncio.run
+
+    Parameters
+    ----------
+    main : Coroutine
+        The coroutine to run
+    speed : Optional[float]
+        Virtual seconds per real second, or None to run as fast as possible
+
+    Returns
+    -------
+    result : T
+        The return value of the coroutine
+    """
+    loop: VirtualTimeEventLoop = VirtualTimeEventLoop(speed)
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(main)
+    finally:
+        try:
+            tasks: set[asyncio.Task[Any]] = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.run_until_complete(loop.shutdown_default_executor())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
@@ -0,0 +1,581 @@
+"""
+Monte Carlo landing-accuracy harness. Flies thousands of simulated upload_mission,
+run_mission and manual_land episodes with randomized wind, GPS noise, telemetry
+latency, launch drift and target files, spread across a process pool, sweeping the
+descent speed parameters of the landing planner. With --landing-only, episodes
+start over the landing point off target, in wind the vehicle has not yet cancelled
+out, with more latency and without GPS error, and each is flown with and without the
+feed-forward of the landing, so its effect on the time to settle over the target shows.
+
+Results are streamed to a columnar directory: one raw little-endian file per
+column plus a columns.json index, appended in batches as episodes finish, so a
+sweep never holds its results in memory. load_results maps the columns back as
+NumPy arrays without copying.
+
+Run with python -m flight.sim.monte_carlo [-n episodes per sweep point]
+[--descent-rates 1.0,1.5,2.0] [--touchdown-speeds 0.3,0.5] [-o results_dir]
+[--landing-only]
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import itertools
+import json
+import logging
+import math
+import os
+import random
+from typing import Any, BinaryIO, NamedTuple
+
+import numpy as np
+import numpy.typing as npt
+
+from flight import descent, geo, intake_gps, landing, run_mission, upload_mission
+from flight.sim import clock
+from flight.sim.system import SimulatedSystem
+from flight.sim.vehicle import VehicleLimits
+from flight.telemetry_hub import get_hub, release_hub
+
+MAX_WIND: float = 8.0  # m/s, wind speeds are drawn uniformly up to this
+MAX_GPS_NOISE: float = 1.5  # Meters, GPS error standard deviations are drawn up to this
+MAX_LATENCY: float = 0.1  # Seconds, telemetry latencies are drawn up to this
+MAX_DRIFT: float = 150.0  # Meters, launch points are drawn up to this far from the target
+MAX_LANDING_LATENCY: float = 0.3  # Seconds, telemetry latencies of landing-only episodes
+MAX_LANDING_OFFSET: float = 8.0  # Meters, landing-only episodes start up to this off target
+SETTLE_RADIUS: float = 0.3  # Meters, the drone has settled once it stays this close to the target
+EPISODE_TIMEOUT: float = 900.0  # Simulated seconds before an episode counts as failed
+SETTLE_TIMEOUT: float = 10.0  # Simulated seconds allowed to fall after the drone is cut
+BATCH_SIZE: int = 8  # Episodes run by a worker per task
+INDEX_FILE: str = "columns.json"
+
+# Name and dtype of every result column
+COLUMNS: dict[str, str] = {
+    "episode": "<i8",
+    "seed": "<i8",
+    "target_file": "<i8",
+    "descent_rate": "<f8",
+    "touchdown_speed": "<f8",
+    "wind_east": "<f8",
+    "wind_north": "<f8",
+    "gps_noise": "<f8",
+    "latency": "<f8",
+    "landing_only": "<i1",
+    "feed_forward": "<i1",
+    "failed": "<i1",
+    "landing_error": "<f8",
+    "cut_error": "<f8",
+    "impact_speed": "<f8",
+    "time_to_land": "<f8",
+    "descent_time": "<f8",
+    "settle_time": "<f8",
+}
+
+
+class EpisodeConfig(NamedTuple):
+    """
+    NamedTuple storing the randomized conditions of one episode.
+
+    Attributes
+    ----------
+    episode : int
+        Index of the episode in the sweep.
+    seed : int
+        Seed of the simulated GPS error.
+    target_file : int
+        Index of the target data file in the sweep's list of files.
+    path : str
+        Path of the target data file.
+    descent_rate : float
+        Descent speed limit of the vehicle and the planner in m/s.
+    touchdown_speed : float
+        Downward speed the planner slows to by the touchdown height in m/s.
+    wind_east : float
+        East wind in m/s.
+    wind_north : float
+        North wind in m/s.
+    gps_noise : float
+        Standard deviation of the horizontal GPS error in meters.
+    latency : float
+        Telemetry latency in seconds.
+    drift_east : float
+        East offset of the launch point from the target in meters, or of the start
+        of the landing for landing-only episodes.
+    drift_north : float
+        North offset of the launch point from the target in meters, or of the start
+        of the landing for landing-only episodes.
+    landing_only : bool
+        Whether the episode starts over the landing point in uncancelled wind, instead
+        of flying the whole mission.
+    feed_forward : bool
+        Whether the landing steers with the feed-forward of the drift estimator.
+    """
+
+    episode: int
+    seed: int
+    target_file: int
+    path: str
+    descent_rate: float
+    touchdown_speed: float
+    wind_east: float
+    wind_north: float
+    gps_noise: float
+    latency: float
+    drift_east: float
+    drift_north: float
+    landing_only: bool = False
+    feed_forward: bool = True
+
+
+class ColumnWriter:
+    """
+    Appends rows to a columnar results directory.
+
+    Attributes
+    ----------
+    directory : str
+        The results directory.
+    rows : int
+        The number of rows written.
+    """
+
+    def __init__(self, directory: str, columns: dict[str, str]) -> None:
+        self.directory: str = directory
+        self.rows: int = 0
+        self._dtypes: dict[str, np.dtype[Any]] = {
+            name: np.dtype(dtype) for name, dtype in columns.items()
+        }
+        os.makedirs(directory, exist_ok=True)
+        # Files opened before one that fails to open are closed again
+        with contextlib.ExitStack() as stack:
+            self._files: dict[str, BinaryIO] = {
+                name: stack.enter_context(open(os.path.join(directory, f"{name}.bin"), "wb"))
+                for name in columns
+            }
+            self._stack: contextlib.ExitStack = stack.pop_all()
+        self._write_index()
+
+    def write(self, rows: list[tuple[Any, ...]]) -> None:
+        """
+        Appends rows, each holding one value per column in column order
+
+        Parameters
+        ----------
+        rows : list[tuple[Any, ...]]
+            The rows to append
+        """
+        if not rows:
+            return
+        for (name, dtype), values in zip(self._dtypes.items(), zip(*rows)):
+            np.asarray(values, dtype=dtype).tofile(self._files[name])
+        self.rows += len(rows)
+        self._write_index()
+
+    def close(self) -> None:
+        """
+        Closes the column files
+        """
+        self._stack.close()
+        self._write_index()
+
+    def _write_index(self) -> None:
+        """
+        Records the columns and the row count, after flushing the rows it counts
+        """
+        for column in self._files.values():
+            if not column.closed:
+                column.flush()
+        index: dict[str, Any] = {
+            "rows": self.rows,
+            "columns": {name: dtype.str for name, dtype in self._dtypes.items()},
+        }
+        with open(os.path.join(self.directory, INDEX_FILE), "w", encoding="UTF-8") as index_file:
+            json.dump(index, index_file)
+
+
+def load_results(directory: str) -> dict[str, npt.NDArray[Any]]:
+    """
+    Maps every column of a results directory as an array without copying
+
+    Parameters
+    ----------
+    directory : str
+        The results directory
+
+    Returns
+    -------
+    columns : dict[str, NDArray]
+        Every column by name, all of the same length
+    """
+    with open(os.path.join(directory, INDEX_FILE), encoding="UTF-8") as file:
+        index: dict[str, Any] = json.load(file)
+    rows: int = index["rows"]
+    columns: dict[str, npt.NDArray[Any]] = {}
+    for name, dtype in index["columns"].items():
+        if rows == 0:
+            columns[name] = np.empty(0, dtype=dtype)
+        else:
+            columns[name] = np.memmap(
+                os.path.join(directory, f"{name}.bin"), dtype=dtype, mode="r", shape=(rows,)
+            )
+    return columns
+
+
+def make_episodes(
+    episodes: int,
+    descent_rates: list[float],
+    touchdown_speeds: list[float],
+    paths: list[str],
+    seed: int,
+    landing_only: bool = False,
+) -> list[EpisodeConfig]:
+    """
+    Draws the conditions of every episode of a sweep
+
+    Parameters
+    ----------
+    episodes : int
+        Episodes per combination of descent rate and touchdown speed
+    descent_rates : list[float]
+        Descent speed limits to sweep in m/s
+    touchdown_speeds : list[float]
+        Touchdown speeds to sweep in m/s
+    paths : list[str]
+        Target data files to draw from
+    seed : int
+        Seed of the whole sweep
+    landing_only : bool
+        Whether to start the episodes over the landing point off target, in uncancelled
+        wind and without GPS error, each flown once with and once without feed-forward
+
+    Returns
+    -------
+    configs : list[EpisodeConfig]
+        The conditions of every episode
+    """
+    rng: random.Random = random.Random(seed)
+    configs: list[EpisodeConfig] = []
+    max_drift: float = MAX_LANDING_OFFSET if landing_only else MAX_DRIFT
+    max_latency: float = MAX_LANDING_LATENCY if landing_only else MAX_LATENCY
+    # Landing-only conditions are flown in pairs, so feed-forward is compared on equal terms
+    modes: tuple[bool, ...] = (True, False) if landing_only else (True,)
+    for descent_rate, touchdown_speed in itertools.product(descent_rates, touchdown_speeds):
+        for _ in range(episodes):
+            wind_speed: float = rng.uniform(0.0, MAX_WIND)
+            wind_direction: float = rng.uniform(0.0, 2.0 * math.pi)
+            drift: float = rng.uniform(0.0, max_drift)
+            drift_direction: float = rng.uniform(0.0, 2.0 * math.pi)
+            target_file: int = rng.randrange(len(paths))
+            drawn: EpisodeConfig = EpisodeConfig(
+                len(configs),
+                rng.randrange(2**31),
+                target_file,
+                paths[target_file],
+                descent_rate,
+                touchdown_speed,
+                wind_speed * math.sin(wind_direction),
+                wind_speed * math.cos(wind_direction),
+                # GPS error would hide how well the landing steers, so landing-only has none
+                0.0 if landing_only else rng.uniform(0.0, MAX_GPS_NOISE),
+                rng.uniform(0.0, max_latency),
+                drift * math.sin(drift_direction),
+                drift * math.cos(drift_direction),
+                landing_only,
+            )
+            for feed_forward in modes:
+                configs.append(drawn._replace(episode=len(configs), feed_forward=feed_forward))
+    return configs
+
+
+async def fly_episode(config: EpisodeConfig) -> tuple[float, float, float, float, float, float]:
+    """
+    Flies one episode on a fresh simulated drone
+
+    Parameters
+    ----------
+    config : EpisodeConfig
+        The conditions of the episode
+
+    Returns
+    -------
+    measurements : tuple[float, float, float, float, float, float]
+        Horizontal distance in meters from the target to where the drone hit the
+        ground, horizontal distance when it was cut, downward speed in m/s when it
+        was cut, simulated seconds from starting the mission to hitting the ground,
+        simulated seconds of the landing descent, and simulated seconds from starting
+        the descent to staying within SETTLE_RADIUS of the target
+    """
+    targets: intake_gps.TargetData = await intake_gps.load_targets(config.path)
+    target: intake_gps.Waypoint = targets.target
+    drone: SimulatedSystem
+    if config.landing_only:
+        # Home is the target and the drone starts over the landing point, off target
+        drone = SimulatedSystem(
+            home=(target.latitude, target.longitude, targets.ground_altitude),
+            start=(config.drift_east, config.drift_north, run_mission.LANDING_ALTITUDE),
+            limits=VehicleLimits(max_descent_rate=config.descent_rate),
+            wind=(config.wind_east, config.wind_north, 0.0),
+            gps_noise=config.gps_noise,
+            latency=config.latency,
+            seed=config.seed,
+            compensated=False,
+        )
+    else:
+        # Launch from a point the rocket drifted to, the drone starts above it
+        launch: tuple[float, float, float] = geo.LocalFrame(
+            target.latitude, target.longitude
+        ).from_enu(config.drift_east, config.drift_north, 0.0)
+        drone = SimulatedSystem(
+            home=(launch[0], launch[1], targets.ground_altitude),
+            limits=VehicleLimits(max_descent_rate=config.descent_rate),
+            wind=(config.wind_east, config.wind_north, 0.0),
+            gps_noise=config.gps_noise,
+            latency=config.latency,
+            seed=config.seed,
+        )
+    profile: descent.DescentProfile = descent.plan_descent(
+        run_mission.LANDING_ALTITUDE,
+        landing.TOUCHDOWN_HEIGHT,
+        descent.DescentLimits(max_descent_rate=config.descent_rate),
+        config.touchdown_speed,
+    )
+
+    await drone.connect()
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    east, north, _ = drone.link.frame.to_enu(target.latitude, target.longitude)
+    vehicle = drone.link.vehicle
+    # Last time the true position was outside SETTLE_RADIUS, as samples come in
+    unsettled_at: list[float] = [math.nan]
+
+    def track(_name: str, _sample: Any, now: float) -> None:
+        if math.hypot(vehicle.position[0] - east, vehicle.position[1] - north) > SETTLE_RADIUS:
+            unsettled_at[0] = now
+
+    get_hub(drone).add_listener(track, ["position"])
+    try:
+        start: float = loop.time()
+        stats: landing.DescentStats
+        if config.landing_only:
+            stats = await landing.manual_land(
+                drone,
+                target.latitude,
+                target.longitude,
+                profile=profile,
+                feed_forward=config.feed_forward,
+            )
+        else:
+            await upload_mission.upload_mission(drone, False, targets)
+            start = loop.time()
+            stats = await run_mission.run_mission(drone, False, targets, profile)
+        descent_start: float = loop.time() - stats.duration
+        settle_time: float = max(0.0, unsettled_at[0] - descent_start)
+
+        # Measure the drone where it was cut, then let it fall to the ground
+        drone.link.now()
+        cut_error: float = math.hypot(vehicle.position[0] - east, vehicle.position[1] - north)
+        impact_speed: float = -vehicle.velocity[2]
+        settle_end: float = loop.time() + SETTLE_TIMEOUT
+        while vehicle.in_air and loop.time() < settle_end:
+            await asyncio.sleep(0.02)
+            drone.link.now()
+        landing_error: float = math.hypot(vehicle.position[0] - east, vehicle.position[1] - north)
+        return (
+            landing_error,
+            cut_error,
+            impact_speed,
+            loop.time() - start,
+            stats.duration,
+            settle_time,
+        )
+    finally:
+        await release_hub(drone)
+
+
+def run_episode(config: EpisodeConfig) -> tuple[Any, ...]:
+    """
+    Flies one episode on its own virtual-time event loop and returns its result row
+
+    Parameters
+    ----------
+    config : EpisodeConfig
+        The conditions of the episode
+
+    Returns
+    -------
+    row : tuple[Any, ...]
+        One value per column of COLUMNS
+    """
+    failed: int = 0
+    measurements: tuple[float, ...] = (math.nan,) * 6
+    try:
+        measurements = clock.run(asyncio.wait_for(fly_episode(config), EPISODE_TIMEOUT))
+    except Exception:  # pylint: disable=broad-except
+        logging.exception("Episode %d failed", config.episode)
+        failed = 1
+    return (
+        config.episode,
+        config.seed,
+        config.target_file,
+        config.descent_rate,
+        config.touchdown_speed,
+        config.wind_east,
+        config.wind_north,
+        config.gps_noise,
+        config.latency,
+        int(config.landing_only),
+        int(config.feed_forward),
+        failed,
+        *measurements,
+    )
+
+
+def run_batch(configs: list[EpisodeConfig]) -> list[tuple[Any, ...]]:
+    """
+    Flies a batch of episodes in a worker process
+
+    Parameters
+    ----------
+    configs : list[EpisodeConfig]
+        The conditions of every episode of the batch
+
+    Returns
+    -------
+    rows : list[tuple[Any, ...]]
+        The result row of every episode
+    """
+    return [run_episode(config) for config in configs]
+
+
+def _quiet_worker() -> None:
+    # Only failures are worth logging from thousands of episodes
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def run_sweep(
+    configs: list[EpisodeConfig], directory: str, workers: int = 0
+) -> dict[str, npt.NDArray[Any]]:
+    """
+    Flies every episode across a process pool, streaming the results to disk
+
+    Parameters
+    ----------
+    configs : list[EpisodeConfig]
+        The conditions of every episode
+    directory : str
+        The results directory to write
+    workers : int
+        Worker processes, one per core if 0
+
+    Returns
+    -------
+    columns : dict[str, NDArray]
+        The results, mapped from the results directory
+    """
+    writer: ColumnWriter = ColumnWriter(directory, COLUMNS)
+    batches: list[list[EpisodeConfig]] = [
+        configs[start : start + BATCH_SIZE] for start in range(0, len(configs), BATCH_SIZE)
+    ]
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count(), initializer=_quiet_worker
+        ) as pool:
+            pending: set[concurrent.futures.Future[list[tuple[Any, ...]]]] = {
+                pool.submit(run_batch, batch) for batch in batches
+            }
+            for future in concurrent.futures.as_completed(pending):
+                writer.write(future.result())
+                logging.info("%d of %d episodes done", writer.rows, len(configs))
+    finally:
+        writer.close()
+    return load_results(directory)
+
+
+def summarize(columns: dict[str, npt.NDArray[Any]]) -> None:
+    """
+    Prints the landing error, time to land and time to settle of every sweep point,
+    with and without feed-forward
+
+    Parameters
+    ----------
+    columns : dict[str, NDArray]
+        Results loaded with load_results
+    """
+    print(
+        f"{'rate m/s':>9}{'td m/s':>8}{'ff':>4}{'runs':>6}{'fail':>6}{'err p50':>9}{'err p95':>9}"
+        f"{'err max':>9}{'impact p95':>11}{'land s p50':>11}{'settle p50':>11}{'settle p95':>11}"
+    )
+    points: npt.NDArray[Any] = np.unique(
+        np.stack(
+            (columns["descent_rate"], columns["touchdown_speed"], columns["feed_forward"]), axis=1
+        ),
+        axis=0,
+    )
+    for descent_rate, touchdown_speed, feed_forward in points:
+        selected: npt.NDArray[np.bool_] = (
+            (columns["descent_rate"] == descent_rate)
+            & (columns["touchdown_speed"] == touchdown_speed)
+            & (columns["feed_forward"] == feed_forward)
+        )
+        flown: npt.NDArray[np.bool_] = selected & (columns["failed"] == 0)
+        errors: npt.NDArray[np.float64] = np.asarray(columns["landing_error"][flown])
+        point: str = (
+            f"{descent_rate:>9.2f}{touchdown_speed:>8.2f}{'on' if feed_forward else 'off':>4}"
+        )
+        if errors.size == 0:
+            print(f"{point}{int(selected.sum()):>6}   all failed")
+            continue
+        settle: npt.NDArray[np.float64] = np.asarray(columns["settle_time"][flown])
+        print(
+            f"{point}{int(selected.sum()):>6}{int(selected.sum() - flown.sum()):>6}"
+            f"{np.percentile(errors, 50):>9.2f}{np.percentile(errors, 95):>9.2f}"
+            f"{errors.max():>9.2f}"
+            f"{np.percentile(columns['impact_speed'][flown], 95):>11.2f}"
+            f"{np.percentile(columns['time_to_land'][flown], 50):>11.1f}"
+            f"{np.percentile(settle, 50):>11.1f}{np.percentile(settle, 95):>11.1f}"
+        )
+
+
+def main() -> None:
+    """
+    Runs a sweep from the command line and prints a summary of it
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--episodes", type=int, default=100, help="Episodes per sweep point")
+    parser.add_argument(
+        "--descent-rates", default="1.0,1.5,2.0,3.0", help="Comma separated m/s to sweep"
+    )
+    parser.add_argument(
+        "--touchdown-speeds", default="0.3,0.46,0.8", help="Comma separated m/s to sweep"
+    )
+    parser.add_argument(
+        "-t",
+        "--targets",
+        default=f"{intake_gps.GOLF_TARGET_FILE},{intake_gps.TARGET_FILE}",
+        help="Comma separated target data files to draw from",
+    )
+    parser.add_argument("-o", "--output", default="logs/monte_carlo", help="Results directory")
+    parser.add_argument("-j", "--workers", type=int, default=0, help="Processes, 0 for every core")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the sweep")
+    parser.add_argument(
+        "--landing-only",
+        action="store_true",
+        help="Start over the landing point off target in uncancelled wind, with and without "
+        "feed-forward",
+    )
+    args: argparse.Namespace = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    configs: list[EpisodeConfig] = make_episodes(
+        args.episodes,
+        [float(rate) for rate in args.descent_rates.split(",")],
+        [float(speed) for speed in args.touchdown_speeds.split(",")],
+        args.targets.split(","),
+        args.seed,
+        args.landing_only,
+    )
+    summarize(run_sweep(configs, args.output, args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,656 @@
+"""
+Offline stand-in for mavsdk.System. SimulatedSystem is a System whose plugins are
+backed by a PointMassVehicle instead of mavsdk_server, implementing the parts of
+the core, telemetry, action, mission, param and offboard plugins the flight code
+uses. Everything is paced by the event loop clock, so on a VirtualTimeEventLoop
+a whole mission runs much faster than real time.
+"""
+import asyncio
+import math
+import random
+import time
+from typing import Any, AsyncIterator, Callable, NamedTuple, Optional, TypeVar
+from urllib.parse import urlparse
+
+from mavsdk import System
+from mavsdk.action import ActionError, ActionResult
+from mavsdk.core import ConnectionState
+from mavsdk.mission import MissionError, MissionPlan, MissionProgress, MissionResult
+from mavsdk.offboard import (
+    OffboardError,
+    OffboardResult,
+    VelocityBodyYawspeed,
+    VelocityNedYaw,
+)
+from mavsdk.param import AllParams, FloatParam, IntParam, ParamError, ParamResult
+from mavsdk.telemetry import (
+    Battery,
+    EulerAngle,
+    FlightMode,
+    Position,
+    TelemetryError,
+    TelemetryResult,
+    VelocityNed,
+)
+
+from flight import geo
+from flight.sim.vehicle import PointMassVehicle, VehicleLimits
+
+# Golf course home position, matching PX4_HOME_LAT/LON of our SITL setup
+HOME_LATITUDE: float = 37.9490953
+HOME_LONGITUDE: float = -91.7848293
+HOME_ALTITUDE: float = geo.feet_to_meters(1250.0)  # AMSL
+START_ALTITUDE: float = 150.0  # Meters above home the vehicle starts at, as after deployment
+
+# Default rate of each simulated telemetry stream in hertz
+STREAM_RATES: dict[str, float] = {
+    "position": 10.0,
+    "home": 1.0,
+    "in_air": 5.0,
+    "flight_mode": 5.0,
+    "velocity_ned": 10.0,
+    "battery": 1.0,
+    "attitude_euler": 10.0,
+    "mission_progress": 2.0,
+}
+
+# Result of reading a parameter the vehicle does not have, UNKNOWN in mavsdk versions
+# without NAME_NOT_FOUND
+PARAM_NOT_FOUND: Any = getattr(ParamResult.Result, "NAME_NOT_FOUND", ParamResult.Result.UNKNOWN)
+GPS_ERROR_TIME: float = 10.0  # Seconds, correlation time of the simulated GPS error
+
+T = TypeVar("T")
+
+
+class CommandRecord(NamedTuple):
+    """
+    NamedTuple storing a command received by the simulated vehicle.
+
+    Attributes
+    ----------
+    time : float
+        Simulation time the command arrived at in seconds.
+    wall_time : float
+        time.perf_counter() when the command arrived.
+    name : str
+        Name of the command.
+    telemetry_age : float
+        Wall-clock seconds since the latest position sample was delivered, which is
+        the telemetry-to-command latency of the flight code.
+    """
+
+    time: float
+    wall_time: float
+    name: str
+    telemetry_age: float
+
+
+class SimulatedVehicleLink:
+    """
+    Shared state between the simulated plugins: the vehicle model, the local frame
+    around home and the event loop clock that paces both.
+
+    Attributes
+    ----------
+    vehicle : PointMassVehicle
+        The simulated vehicle.
+    frame : LocalFrame
+        Local frame anchored at home, at the home AMSL altitude.
+    rates : dict[str, float]
+        Rate of each telemetry stream in hertz.
+    commands : list[CommandRecord]
+        Every command received, in order.
+    sample_wall_times : dict[str, float]
+        time.perf_counter() when the latest sample of each stream was delivered.
+    gps_noise : float
+        Standard deviation of the horizontal error of reported positions in meters, per
+        axis. Altitude comes from the barometer in PX4 and is reported without error.
+    latency : float
+        Seconds between a sample being taken and it being delivered.
+    gps_error : list[float]
+        East and north error of the reported position in meters.
+    """
+
+    def __init__(
+        self,
+        vehicle: PointMassVehicle,
+        frame: geo.LocalFrame,
+        gps_noise: float = 0.0,
+        latency: float = 0.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.vehicle: PointMassVehicle = vehicle
+        self.frame: geo.LocalFrame = frame
+        self.rates: dict[str, float] = dict(STREAM_RATES)
+        self.commands: list[CommandRecord] = []
+        self.sample_wall_times: dict[str, float] = {}
+        self.gps_noise: float = gps_noise
+        self.latency: float = latency
+        self.gps_error: list[float] = [0.0, 0.0]
+        self._random: random.Random = random.Random(seed)
+        self._gps_error_time: float = 0.0
+
+    def reported_position(self) -> tuple[float, float, float]:
+        """
+        Returns the vehicle position as the GPS reports it. The error is a first order
+        Gauss-Markov process, wandering slowly like real GPS error rather than jumping
+        every sample.
+
+        Returns
+        -------
+        enu : tuple[float, float, float]
+            East, north and up position relative to home in meters
+        """
+        position: list[float] = self.vehicle.position
+        if self.gps_noise <= 0.0:
+            return position[0], position[1], position[2]
+
+        elapsed: float = self.vehicle.time - self._gps_error_time
+        self._gps_error_time = self.vehicle.time
+        correlation: float = math.exp(-elapsed / GPS_ERROR_TIME)
+        spread: float = self.gps_noise * math.sqrt(1.0 - correlation * correlation)
+        for axis in range(2):
+            self.gps_error[axis] = self.gps_error[axis] * correlation + self._random.gauss(
+                0.0, spread
+            )
+        return position[0] + self.gps_error[0], position[1] + self.gps_error[1], position[2]
+
+    def now(self) -> float:
+        """
+        Returns the event loop time, advancing the vehicle model up to it
+
+        Returns
+        -------
+        now : float
+            The current event loop time in seconds
+        """
+        now: float = asyncio.get_running_loop().time()
+        self.vehicle.advance(now)
+        return now
+
+    def command(self, name: str) -> PointMassVehicle:
+        """
+        Logs a command and returns the vehicle, brought up to the current time
+
+        Parameters
+        ----------
+        name : str
+            Name of the command received
+
+        Returns
+        -------
+        vehicle : PointMassVehicle
+            The simulated vehicle
+        """
+        wall_time: float = time.perf_counter()
+        telemetry_age: float = wall_time - self.sample_wall_times.get("position", float("nan"))
+        self.commands.append(CommandRecord(self.now(), wall_time, name, telemetry_age))
+        return self.vehicle
+
+    def set_rate(self, name: str, rate: float) -> None:
+        """
+        Changes the rate of a telemetry stream, from its next sample on
+
+        Parameters
+        ----------
+        name : str
+            The mavsdk name of the stream, a key of STREAM_RATES
+        rate : float
+            The rate in hertz
+
+        Raises
+        ------
+        TelemetryError
+            If the rate is not positive, which the simulator does not support
+        """
+        self.command("set_rate")
+        if not rate > 0.0:
+            raise TelemetryError(
+                TelemetryResult(TelemetryResult.Result.UNSUPPORTED, "rate must be positive"),
+                f"set_rate_{name}()",
+            )
+        self.rates[name] = rate
+
+    def to_local(
+        self, latitude: float, longitude: float, altitude: float
+    ) -> tuple[float, float, float]:
+        """
+        Converts a position with AMSL altitude to the local frame around home
+
+        Parameters
+        ----------
+        latitude : float
+            Latitude in degrees
+        longitude : float
+            Longitude in degrees
+        altitude : float
+            Altitude AMSL in meters
+
+        Returns
+        -------
+        enu : tuple[float, float, float]
+            East, north and up position relative to home in meters
+        """
+        return self.frame.to_enu(latitude, longitude, altitude)
+
+    async def stream(self, name: str, sample: Callable[[], T]) -> AsyncIterator[T]:
+        """
+        Yields samples of a telemetry stream at its configured rate
+
+        Parameters
+        ----------
+        name : str
+            The mavsdk name of the stream, a key of STREAM_RATES
+        sample : Callable[[], T]
+            Builds a sample from the current vehicle state
+
+        Yields
+        ------
+        sample : T
+            The latest sample of the stream
+        """
+        while True:
+            # Samples are taken at the stream rate and delivered latency seconds later
+            latency: float = min(self.latency, 1.0 / self.rates[name])
+            await asyncio.sleep(1.0 / self.rates[name] - latency)
+            self.now()
+            value: T = sample()
+            if latency > 0.0:
+                await asyncio.sleep(latency)
+            self.sample_wall_times[name] = time.perf_counter()
+            yield value
+
+
+class SimulatedCore:
+    """
+    Stand-in for the mavsdk Core plugin.
+    """
+
+    def __init__(self, link: SimulatedVehicleLink) -> None:
+        self._link: SimulatedVehicleLink = link
+
+    async def connection_state(self) -> AsyncIterator[ConnectionState]:
+        """
+        Yields that the vehicle is connected, then stays connected for good
+        """
+        yield ConnectionState(True)
+        await asyncio.Event().wait()
+
+
+class SimulatedTelemetry:
+    """
+    Stand-in for the mavsdk Telemetry plugin.
+    """
+
+    def __init__(self, link: SimulatedVehicleLink) -> None:
+        self._link: SimulatedVehicleLink = link
+
+    def _position(self) -> Position:
+        latitude: float
+        longitude: float
+        altitude: float
+        reported: tuple[float, float, float] = self._link.reported_position()
+        latitude, longitude, altitude = self._link.frame.from_enu(*reported)
+        return Position(latitude, longitude, altitude, reported[2])
+
+    def _home(self) -> Position:
+        frame: geo.LocalFrame = self._link.frame
+        return Position(frame.latitude, frame.longitude, frame.altitude, 0.0)
+
+    def _velocity(self) -> VelocityNed:
+        velocity: list[float] = self._link.vehicle.velocity
+        return VelocityNed(velocity[1], velocity[0], -velocity[2])
+
+    def _attitude(self) -> EulerAngle:
+        # The point-mass model has no attitude, so it always reports level and facing north
+        return EulerAngle(0.0, 0.0, 0.0, int(self._link.vehicle.time * 1e6))
+
+    def _battery(self) -> Battery:
+        return Battery(
+            0, 16.8 - 0.024 * (100.0 - self._link.vehicle.battery), self._link.vehicle.battery
+        )
+
+    def position(self) -> AsyncIterator[Position]:
+        """Yields the position of the vehicle"""
+        return self._link.stream("position", self._position)
+
+    def home(self) -> AsyncIterator[Position]:
+        """Yields the home position"""
+        return self._link.stream("home", self._home)
+
+    def in_air(self) -> AsyncIterator[bool]:
+        """Yields whether the vehicle is in the air"""
+        return self._link.stream("in_air", lambda: self._link.vehicle.in_air)
+
+    def flight_mode(self) -> AsyncIterator[FlightMode]:
+        """Yields the flight mode of the vehicle"""
+        return self._link.stream("flight_mode", lambda: self._link.vehicle.flight_mode)
+
+    def velocity_ned(self) -> AsyncIterator[VelocityNed]:
+        """Yields the velocity of the vehicle in the NED frame"""
+        return self._link.stream("velocity_ned", self._velocity)
+
+    def battery(self) -> AsyncIterator[Battery]:
+        """Yields the battery state"""
+        return self._link.stream("battery", self._battery)
+
+    def attitude_euler(self) -> AsyncIterator[EulerAngle]:
+        """Yields the attitude of the vehicle"""
+        return self._link.stream("attitude_euler", self._attitude)
+
+    async def set_rate_position(self, rate_hz: float) -> None:
+        """Sets the rate of the position stream"""
+        self._link.set_rate("position", rate_hz)
+
+    async def set_rate_home(self, rate_hz: float) -> None:
+        """Sets the rate of the home position stream"""
+        self._link.set_rate("home", rate_hz)
+
+    async def set_rate_in_air(self, rate_hz: float) -> None:
+        """Sets the rate of whether the vehicle is in the air stream"""
+        self._link.set_rate("in_air", rate_hz)
+
+    async def set_rate_velocity_ned(self, rate_hz: float) -> None:
+        """Sets the rate of the velocity stream"""
+        self._link.set_rate("velocity_ned", rate_hz)
+
+    async def set_rate_battery(self, rate_hz: float) -> None:
+        """Sets the rate of the battery state stream"""
+        self._link.set_rate("battery", rate_hz)
+
+    async def set_rate_attitude(self, rate_hz: float) -> None:
+        """Sets the rate of the attitude stream"""
+        self._link.set_rate("attitude_euler", rate_hz)
+
+
+class SimulatedAction:
+    """
+    Stand-in for the mavsdk Action plugin.
+    """
+
+    def __init__(self, link: SimulatedVehicleLink) -> None:
+        self._link: SimulatedVehicleLink = link
+
+    async def arm(self) -> None:
+        """Arms the motors"""
+        self._link.command("arm").armed = True
+
+    async def disarm(self) -> None:
+        """Disarms the motors, which is refused in the air"""
+        vehicle: PointMassVehicle = self._link.command("disarm")
+        if vehicle.in_air:
+            raise ActionError(ActionResult(ActionResult.Result.COMMAND_DENIED, ""), "disarm()")
+        vehicle.armed = False
+
+    async def kill(self) -> None:
+        """Cuts the motors immediately"""
+        self._link.command("kill").kill()
+
+    async def land(self) -> None:
+        """Lands in place"""
+        self._link.command("land").land()
+
+    async def hold(self) -> None:
+        """Holds at the current position"""
+        self._link.command("hold").hold()
+
+    async def goto_location(
+        self, latitude_deg: float, longitude_deg: float, absolute_altitude_m: float, yaw_deg: float
+    ) -> None:
+        """Flies to a position with an AMSL altitude"""
+        vehicle: PointMassVehicle = self._link.command("goto_location")
+        if not vehicle.armed:
+            raise ActionError(
+                ActionResult(ActionResult.Result.COMMAND_DENIED, ""), "goto_location()"
+            )
+        vehicle.goto(self._link.to_local(latitude_deg, longitude_deg, absolute_altitude_m))
+
+    async def set_current_speed(self, speed_m_s: float) -> None:
+        """Sets the horizontal speed of the current flight mode"""
+        self._link.command("set_current_speed").speed = speed_m_s
+
+    async def set_maximum_speed(self, speed: float) -> None:
+        """Sets the horizontal speed limit of the vehicle"""
+        self._link.command("set_maximum_speed").max_speed = speed
+
+
+class SimulatedMission:
+    """
+    Stand-in for the mavsdk Mission plugin.
+    """
+
+    def __init__(self, link: SimulatedVehicleLink) -> None:
+        self._link: SimulatedVehicleLink = link
+        self._plan: MissionPlan = MissionPlan([])
+
+    async def upload_mission(self, mission_plan: MissionPlan) -> None:
+        """Stores a mission plan on the vehicle"""
+        vehicle: PointMassVehicle = self._link.command("upload_mission")
+        self._plan = MissionPlan(list(mission_plan.mission_items))
+        home: geo.LocalFrame = self._link.frame
+        vehicle.mission = [
+            (
+                self._link.to_local(
+                    item.latitude_deg, item.longitude_deg, home.altitude + item.relative_altitude_m
+                ),
+                item,
+            )
+            for item in self._plan.mission_items
+        ]
+        vehicle.mission_index = 0
+
+    async def download_mission(self) -> MissionPlan:
+        """Returns the mission plan stored on the vehicle"""
+        self._link.command("download_mission")
+        return MissionPlan(list(self._plan.mission_items))
+
+    async def clear_mission(self) -> None:
+        """Removes the mission plan from the vehicle"""
+        vehicle: PointMassVehicle = self._link.command("clear_mission")
+        self._plan = MissionPlan([])
+        vehicle.mission = []
+        vehicle.mission_index = 0
+
+    async def start_mission(self) -> None:
+        """Starts flying the stored mission"""
+        vehicle: PointMassVehicle = self._link.command("start_mission")
+        if not vehicle.mission:
+            raise MissionError(
+                MissionResult(MissionResult.Result.NO_MISSION_AVAILABLE, ""), "start_mission()"
+            )
+        vehicle.start_mission()
+
+    def mission_progress(self) -> AsyncIterator[MissionProgress]:
+        """Yields the current item and the number of items of the stored mission"""
+        return self._link.stream("mission_progress", self._progress)
+
+    def _progress(self) -> MissionProgress:
+        vehicle: PointMassVehicle = self._link.vehicle
+        return MissionProgress(vehicle.mission_index, len(vehicle.mission))
+
+
+class SimulatedParam:
+    """
+    Stand-in for the mavsdk Param plugin.
+    """
+
+    def __init__(self, link: SimulatedVehicleLink) -> None:
+        self._link: SimulatedVehicleLink = link
+        self.int_params: dict[str, int] = {}
+        self.float_params: dict[str, float] = {}
+
+    async def set_param_int(self, name: str, value: int) -> None:
+        """Sets an integer parameter"""
+        self._link.command("set_param_int")
+        self.int_params[name] = value
+
+    async def set_param_float(self, name: str, value: float) -> None:
+        """Sets a float parameter"""
+        self._link.command("set_param_float")
+        self.float_params[name] = value
+
+    async def get_param_int(self, name: str) -> int:
+        """Returns an integer parameter"""
+        self._link.command("get_param_int")
+        if name not in self.int_params:
+            raise ParamError(ParamResult(PARAM_NOT_FOUND, "not found"), "get_param_int()", name)
+        return self.int_params[name]
+
+    async def get_param_float(self, name: str) -> float:
+        """Returns a float parameter"""
+        self._link.command("get_param_float")
+        if name not in self.float_params:
+            raise ParamError(ParamResult(PARAM_NOT_FOUND, "not found"), "get_param_float()", name)
+        return self.float_params[name]
+
+    async def get_all_params(self) -> AllParams:
+        """Returns every parameter"""
+        self._link.command("get_all_params")
+        return AllParams(
+            [IntParam(name, value) for name, value in self.int_params.items()],
+            [FloatParam(name, value) for name, value in self.float_params.items()],
+            [],
+        )
+
+
+class SimulatedOffboard:
+    """
+    Stand-in for the mavsdk Offboard plugin.
+    """
+
+    def __init__(self, link: SimulatedVehicleLink) -> None:
+        self._link: SimulatedVehicleLink = link
+
+    async def start(self) -> None:
+        """Switches to offboard mode, which needs a setpoint first"""
+        vehicle: PointMassVehicle = self._link.command("offboard_start")
+        if vehicle.setpoint is None:
+            raise OffboardError(
+                OffboardResult(OffboardResult.Result.NO_SETPOINT_SET, ""), "start()"
+            )
+        vehicle.start_offboard()
+
+    async def stop(self) -> None:
+        """Leaves offboard mode, holding position"""
+        self._link.command("offboard_stop").hold()
+
+    async def is_active(self) -> bool:
+        """Returns whether offboard mode is active"""
+        return self._link.vehicle.flight_mode == FlightMode.OFFBOARD
+
+    async def set_velocity_ned(self, velocity_ned_yaw: VelocityNedYaw) -> None:
+        """Sets a velocity setpoint in the NED frame"""
+        vehicle: PointMassVehicle = self._link.command("set_velocity_ned")
+        vehicle.setpoint = (
+            velocity_ned_yaw.east_m_s,
+            velocity_ned_yaw.north_m_s,
+            -velocity_ned_yaw.down_m_s,
+        )
+        vehicle.setpoint_time = vehicle.time
+
+    async def set_velocity_body(self, velocity_body_yawspeed: VelocityBodyYawspeed) -> None:
+        """Sets a velocity setpoint in the body frame, which faces north in the model"""
+        vehicle: PointMassVehicle = self._link.command("set_velocity_body")
+        vehicle.setpoint = (
+            velocity_body_yawspeed.right_m_s,
+            velocity_body_yawspeed.forward_m_s,
+            -velocity_body_yawspeed.down_m_s,
+        )
+        vehicle.setpoint_time = vehicle.time
+
+
+class SimulatedSystem(System):
+    """
+    A mavsdk System backed by the offline vehicle model instead of mavsdk_server.
+
+    Attributes
+    ----------
+    link : SimulatedVehicleLink
+        The vehicle model and clock shared by the simulated plugins.
+    """
+
+    def __init__(
+        self,
+        home: tuple[float, float, float] = (HOME_LATITUDE, HOME_LONGITUDE, HOME_ALTITUDE),
+        start: tuple[float, float, float] = (0.0, 0.0, START_ALTITUDE),
+        limits: VehicleLimits = VehicleLimits(),
+        wind: tuple[float, float, float] = (0.0, 0.0, 0.0),
+        gps_noise: float = 0.0,
+        latency: float = 0.0,
+        seed: Optional[int] = None,
+        compensated: bool = True,
+    ) -> None:
+        super().__init__()
+        self.link: SimulatedVehicleLink = SimulatedVehicleLink(
+            PointMassVehicle(start, limits, wind, compensated),
+            geo.LocalFrame(*home),
+            gps_noise,
+            latency,
+            seed,
+        )
+
+    @classmethod
+    def from_address(cls, address: str) -> "SimulatedSystem":
+        """
+        Creates a simulated system from a sim:// address, which may give the home
+        position as sim://latitude,longitude,altitude with the altitude AMSL in meters.
+        Any path, as in sim:///alpha, only tells vehicles of a fleet apart.
+
+        Parameters
+        ----------
+        address : str
+            The sim:// address
+
+        Returns
+        -------
+        drone : SimulatedSystem
+            The simulated system
+        """
+        location: str = urlparse(address).netloc
+        if not location:
+            return cls()
+        latitude, longitude, altitude = (float(part) for part in location.split(","))
+        return cls(home=(latitude, longitude, altitude))
+
+    async def connect(self, system_address: Optional[str] = None) -> None:
+        """
+        Creates the simulated plugins, starting the vehicle model at the current loop time
+
+        Parameters
+        ----------
+        system_address : Optional[str]
+            Ignored, the simulated vehicle is always reachable
+        """
+        self.link.vehicle.time = asyncio.get_running_loop().time()
+        self.link.vehicle.setpoint_time = self.link.vehicle.time
+        plugins: dict[str, Any] = {
+            "core": SimulatedCore(self.link),
+            "telemetry": SimulatedTelemetry(self.link),
+            "action": SimulatedAction(self.link),
+            "mission": SimulatedMission(self.link),
+            "param": SimulatedParam(self.link),
+            "offboard": SimulatedOffboard(self.link),
+        }
+        self._plugins = plugins
+
+    def _stop_mavsdk_server(self) -> None:
+        """
+        Does nothing, as there is no mavsdk_server to stop
+        """
+
+
+def is_simulated(address: str) -> bool:
+    """
+    Returns whether an address refers to the offline simulator
+
+    Parameters
+    ----------
+    address : str
+        A system address
+
+    Returns
+    -------
+    simulated : bool
+        True for sim:// addresses
+    """
+    return address.startswith("sim://")
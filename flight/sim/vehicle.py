@@ -0,0 +1,305 @@
+"""
+Point-mass multirotor model behind the offline simulator. The vehicle lives in a
+local East-North-Up frame anchored at home and tracks velocity setpoints produced
+by the flight mode it is in, subject to speed and acceleration limits and wind.
+"""
+import math
+from typing import NamedTuple, Optional
+
+from mavsdk.mission import MissionItem
+from mavsdk.telemetry import FlightMode
+
+PHYSICS_RATE: float = 50.0  # Hz, the model is integrated in fixed steps at this rate
+POSITION_GAIN: float = 1.0  # (m/s) of velocity commanded per meter of position error
+BRAKING_SHARE: float = 0.5  # Share of the acceleration limit stops are planned with, for lag
+LAND_SPEED: float = 0.7  # m/s, descent rate of the LAND flight mode
+GRAVITY: float = 9.81  # m/s^2
+OFFBOARD_TIMEOUT: float = 1.0  # Seconds without a setpoint before offboard falls back to HOLD
+WIND_COMPENSATION_TIME: float = 2.0  # Seconds for the controller to cancel out a wind change
+DEFAULT_ACCEPTANCE_RADIUS: float = 1.0  # Meters, used for mission items that give none
+
+
+class VehicleLimits(NamedTuple):
+    """
+    NamedTuple storing the speed and acceleration limits of the vehicle.
+
+    Attributes
+    ----------
+    max_horizontal_speed : float
+        Maximum horizontal speed in m/s.
+    max_climb_rate : float
+        Maximum upward speed in m/s.
+    max_descent_rate : float
+        Maximum downward speed in m/s.
+    max_horizontal_acceleration : float
+        Maximum horizontal acceleration in m/s^2.
+    max_vertical_acceleration : float
+        Maximum vertical acceleration in m/s^2.
+    """
+
+    max_horizontal_speed: float = 12.0
+    max_climb_rate: float = 3.0
+    max_descent_rate: float = 1.5
+    max_horizontal_acceleration: float = 3.0
+    max_vertical_acceleration: float = 2.0
+
+
+class PointMassVehicle:
+    """
+    State and dynamics of the simulated vehicle.
+
+    Attributes
+    ----------
+    limits : VehicleLimits
+        The speed and acceleration limits of the vehicle.
+    time : float
+        The simulation time the state has been integrated up to, in seconds.
+    position : list[float]
+        East, north and up position relative to home in meters.
+    velocity : list[float]
+        East, north and up velocity over the ground in m/s.
+    wind : tuple[float, float, float]
+        East, north and up wind velocity in m/s.
+    armed : bool
+        Whether the motors are armed.
+    in_air : bool
+        Whether the vehicle is off the ground.
+    flight_mode : FlightMode
+        The current flight mode.
+    battery : float
+        Remaining battery in percent.
+    """
+
+    def __init__(
+        self,
+        position: tuple[float, float, float] = (0.0, 0.0, 0.0),
+        limits: VehicleLimits = VehicleLimits(),
+        wind: tuple[float, float, float] = (0.0, 0.0, 0.0),
+        compensated: bool = True,
+    ) -> None:
+        self.limits: VehicleLimits = limits
+        self.time: float = 0.0
+        self.position: list[float] = list(position)
+        self.velocity: list[float] = [0.0, 0.0, 0.0]
+        self.wind: tuple[float, float, float] = wind
+        self.in_air: bool = position[2] > 0.0
+        self.armed: bool = self.in_air
+        self.flight_mode: FlightMode = FlightMode.HOLD
+        self.battery: float = 100.0
+
+        self.speed: float = limits.max_horizontal_speed  # Current horizontal speed limit
+        self.max_speed: float = limits.max_horizontal_speed
+        self.target: Optional[tuple[float, float, float]] = None
+        self.setpoint: Optional[tuple[float, float, float]] = None  # Offboard velocity, ENU
+        self.setpoint_time: float = 0.0
+        self.mission: list[tuple[tuple[float, float, float], MissionItem]] = []
+        self.mission_index: int = 0
+
+        self._dt: float = 1.0 / PHYSICS_RATE
+        # Part of the wind the velocity controller has learned to cancel out, all of it
+        # after a long hover, none of it right after the wind changed
+        self._compensation: list[float] = list(wind) if compensated else [0.0, 0.0, 0.0]
+        self.hold()
+
+    def advance(self, now: float) -> None:
+        """
+        Integrates the model in fixed steps up to a simulation time
+
+        Parameters
+        ----------
+        now : float
+            The simulation time to advance to, in seconds
+        """
+        while self.time + self._dt <= now:
+            self._step(self._dt)
+            self.time += self._dt
+
+    def hold(self) -> None:
+        """
+        Switches to HOLD, stopping at the current position
+        """
+        self.flight_mode = FlightMode.HOLD
+        self.target = (self.position[0], self.position[1], max(self.position[2], 0.0))
+
+    def goto(self, target: tuple[float, float, float]) -> None:
+        """
+        Flies to a local position in HOLD mode, as PX4 does for goto_location
+
+        Parameters
+        ----------
+        target : tuple[float, float, float]
+            East, north and up position relative to home in meters
+        """
+        self.flight_mode = FlightMode.HOLD
+        self.target = target
+        if self.armed and target[2] > 0.0:
+            self.in_air = True
+
+    def start_mission(self) -> None:
+        """
+        Starts flying the uploaded mission from its current item
+        """
+        self.flight_mode = FlightMode.MISSION
+        self._load_mission_item()
+        if self.armed:
+            self.in_air = True
+
+    def land(self) -> None:
+        """
+        Switches to LAND, descending in place until touchdown
+        """
+        self.flight_mode = FlightMode.LAND
+        self.target = (self.position[0], self.position[1], 0.0)
+
+    def start_offboard(self) -> None:
+        """
+        Switches to OFFBOARD, following the latest velocity setpoint
+        """
+        self.flight_mode = FlightMode.OFFBOARD
+
+    def kill(self) -> None:
+        """
+        Disarms immediately, letting the vehicle fall if it is in the air
+        """
+        self.armed = False
+        self.target = None
+        self.setpoint = None
+
+    def _load_mission_item(self) -> None:
+        """
+        Targets the current mission item, holding after the last one
+        """
+        if self.mission_index >= len(self.mission):
+            self.hold()
+            return
+        target: tuple[float, float, float]
+        item: MissionItem
+        target, item = self.mission[self.mission_index]
+        self.target = target
+        if not math.isnan(item.speed_m_s) and item.speed_m_s > 0.0:
+            self.speed = item.speed_m_s
+
+    def _desired_velocity(self) -> tuple[float, float, float]:
+        """
+        Returns the velocity the flight controller asks for in the current mode
+        """
+        if self.flight_mode == FlightMode.OFFBOARD:
+            if self.setpoint is None or self.time - self.setpoint_time > OFFBOARD_TIMEOUT:
+                self.hold()
+            else:
+                return self.setpoint
+
+        if self.target is None:
+            return 0.0, 0.0, 0.0
+
+        east: float = self.target[0] - self.position[0]
+        north: float = self.target[1] - self.position[1]
+        up: float = self.target[2] - self.position[2]
+        distance: float = math.hypot(east, north)
+
+        if self.flight_mode == FlightMode.MISSION:
+            item: MissionItem = self.mission[self.mission_index][1]
+            # Like PX4, items are never accepted tighter than the default radius
+            radius: float = item.acceptance_radius_m
+            if math.isnan(radius) or radius < DEFAULT_ACCEPTANCE_RADIUS:
+                radius = DEFAULT_ACCEPTANCE_RADIUS
+            if math.hypot(distance, up) <= radius:
+                self.mission_index += 1
+                self._load_mission_item()
+
+        # Like a real position controller, slow down early enough to stop at the target
+        # within the acceleration limit rather than overshoot it
+        horizontal: float = min(
+            POSITION_GAIN * distance,
+            math.sqrt(2.0 * BRAKING_SHARE * self.limits.max_horizontal_acceleration * distance),
+            self.speed,
+            self.max_speed,
+        )
+        scale: float = horizontal / distance if distance > 0.0 else 0.0
+        vertical: float = POSITION_GAIN * up
+        if self.flight_mode == FlightMode.LAND:
+            vertical = -LAND_SPEED
+        return east * scale, north * scale, vertical
+
+    def _step(self, dt: float) -> None:
+        """
+        Integrates the model over one time step
+
+        Parameters
+        ----------
+        dt : float
+            Length of the step in seconds
+        """
+        self.battery = max(0.0, self.battery - 0.02 * dt)
+
+        if not self.armed:
+            # Unpowered, the vehicle falls straight down and keeps drifting with the wind
+            if self.in_air:
+                self.velocity[2] -= GRAVITY * dt
+                self.velocity[0] += (self.wind[0] - self.velocity[0]) * dt
+                self.velocity[1] += (self.wind[1] - self.velocity[1]) * dt
+            self._integrate(dt)
+            return
+
+        desired: tuple[float, float, float] = self._desired_velocity()
+        limits: VehicleLimits = self.limits
+
+        # Clamp the setpoint to the speed limits
+        east: float = desired[0]
+        north: float = desired[1]
+        horizontal: float = math.hypot(east, north)
+        top_speed: float = min(limits.max_horizontal_speed, self.max_speed)
+        if horizontal > top_speed:
+            east *= top_speed / horizontal
+            north *= top_speed / horizontal
+        up: float = min(max(desired[2], -limits.max_descent_rate), limits.max_climb_rate)
+
+        # The controller slowly learns the wind and cancels it out
+        blend: float = min(1.0, dt / WIND_COMPENSATION_TIME)
+        for axis in range(3):
+            self._compensation[axis] += (self.wind[axis] - self._compensation[axis]) * blend
+
+        # Track the setpoint with limited acceleration, the uncancelled wind pushes the vehicle
+        target: tuple[float, float, float] = (
+            east + self.wind[0] - self._compensation[0],
+            north + self.wind[1] - self._compensation[1],
+            up + self.wind[2] - self._compensation[2],
+        )
+        d_east: float = target[0] - self.velocity[0]
+        d_north: float = target[1] - self.velocity[1]
+        d_horizontal: float = math.hypot(d_east, d_north)
+        max_change: float = limits.max_horizontal_acceleration * dt
+        if d_horizontal > max_change:
+            d_east *= max_change / d_horizontal
+            d_north *= max_change / d_horizontal
+        self.velocity[0] += d_east
+        self.velocity[1] += d_north
+        max_change = limits.max_vertical_acceleration * dt
+        self.velocity[2] += min(max(target[2] - self.velocity[2], -max_change), max_change)
+
+        if self.velocity[2] > 0.0:
+            self.in_air = True
+        self._integrate(dt)
+
+    def _integrate(self, dt: float) -> None:
+        """
+        Moves the vehicle by its velocity and handles touching the ground
+
+        Parameters
+        ----------
+        dt : float
+            Length of the step in seconds
+        """
+        if not self.in_air:
+            self.velocity[0] = self.velocity[1] = self.velocity[2] = 0.0
+            return
+
+        for axis in range(3):
+            self.position[axis] += self.velocity[axis] * dt
+
+        if self.position[2] <= 0.0 and self.velocity[2] <= 0.0:
+            self.position[2] = 0.0
+            self.velocity[0] = self.velocity[1] = self.velocity[2] = 0.0
+            self.in_air = False
+            if self.flight_mode == FlightMode.LAND:
+                self.armed = False
@@ -0,0 +1,138 @@
+"""
+Structured supervision of the coroutines of a flight. Every coroutine runs as a task
+of one Supervisor; the flight ends when a task that ends the flight returns, when
+any task fails or on Ctrl-C, and every remaining task is then cancelled and awaited
+before the supervisor exits, so nothing outlives the flight. The flights of a fleet
+each run under their own supervisor, and Ctrl-C ends all of them.
+"""
+import asyncio
+import logging
+import signal
+from types import TracebackType
+from typing import Any, Coroutine, Optional, Type
+
+
+class Supervisor:
+    """
+    Runs a group of tasks until the flight ends, then cancels the rest. Works like
+    asyncio.TaskGroup, which needs Python 3.11.
+
+    Attributes
+    ----------
+    interrupted : bool
+        Whether the flight was ended by Ctrl-C.
+    ended_by : Optional[str]
+        Name of the task whose return ended the flight, if one did.
+    """
+
+    def __init__(self) -> None:
+        self.interrupted: bool = False
+        self.ended_by: Optional[str] = None
+        self._tasks: dict[asyncio.Task[Any], bool] = {}
+        self._error: Optional[BaseException] = None
+        self._finished: asyncio.Event = asyncio.Event()
+
+    async def __aenter__(self) -> "Supervisor":
+        global _SIGNAL_HANDLER
+        if not _ACTIVE:
+            try:
+                asyncio.get_running_loop().add_signal_handler(signal.SIGINT, _interrupt_all)
+                _SIGNAL_HANDLER = True
+            except (NotImplementedError, RuntimeError):
+                # Signal handlers can only be installed on Unix, from the main thread
+                pass
+        _ACTIVE.append(self)
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        global _SIGNAL_HANDLER
+        try:
+            if exc_type is None and self._tasks:
+                await self._finished.wait()
+        finally:
+            _ACTIVE.remove(self)
+            if _SIGNAL_HANDLER and not _ACTIVE:
+                asyncio.get_running_loop().remove_signal_handler(signal.SIGINT)
+                _SIGNAL_HANDLER = False
+            await self._cancel_all()
+
+        if self._error is not None and exc_type is None:
+            raise self._error
+
+    def start(
+        self, coroutine: Coroutine[Any, Any, Any], name: str, ends_flight: bool = False
+    ) -> "asyncio.Task[Any]":
+        """
+        Runs a coroutine as a supervised task
+
+        Parameters
+        ----------
+        coroutine : Coroutine
+            The coroutine to run
+        name : str
+            Name of the task, for the logs
+        ends_flight : bool
+            Whether the flight ends when this task returns
+
+        Returns
+        -------
+        task : Task
+            The supervised task
+        """
+        task: asyncio.Task[Any] = asyncio.create_task(coroutine, name=name)
+        self._tasks[task] = ends_flight
+        task.add_done_callback(self._task_done)
+        return task
+
+    def interrupt(self) -> None:
+        """
+        Ends the flight, as Ctrl-C does
+        """
+        logging.info("Ctrl-C Pressed, ending the flight")
+        self.interrupted = True
+        self._finished.set()
+
+    def _task_done(self, task: "asyncio.Task[Any]") -> None:
+        """
+        Ends the flight if a task failed or was one that ends it, or every task is done
+        """
+        if task.cancelled():
+            return
+        error: Optional[BaseException] = task.exception()
+        if error is not None:
+            if self._error is None:
+                logging.error("Task %s failed, ending the flight", task.get_name())
+                self._error = error
+            self._finished.set()
+        elif self._tasks[task] and not self._finished.is_set():
+            logging.debug("Task %s ended the flight", task.get_name())
+            self.ended_by = task.get_name()
+            self._finished.set()
+        elif all(other.done() for other in self._tasks):
+            self._finished.set()
+
+    async def _cancel_all(self) -> None:
+        """
+        Cancels every unfinished task and waits for them to finish
+        """
+        for task in self._tasks:
+            task.cancel()
+        results: list[Any] = await asyncio.gather(*self._tasks, return_exceptions=True)
+        for task, result in zip(self._tasks, results):
+            if isinstance(result, Exception) and result is not self._error:
+                logging.error("Task %s also failed: %r", task.get_name(), result)
+
+
+# Supervisors running, which share the one SIGINT handler of the loop
+_ACTIVE: list[Supervisor] = []
+_SIGNAL_HANDLER: bool = False
+
+
+def _interrupt_all() -> None:
+    for supervisor in list(_ACTIVE):
+        supervisor.interrupt()
@@ -0,0 +1,351 @@
+"""
+Subscribes once to each telemetry stream of a drone and fans the samples out
+to any number of consumers through a latest-value cache, so consumers never
+open their own gRPC streams.
+"""
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, NamedTuple, Optional
+
+from mavsdk import System
+
+# Hub stream name -> mavsdk plugin and method that produces it
+STREAMS: dict[str, str] = {
+    "position": "telemetry.position",
+    "home": "telemetry.home",
+    "in_air": "telemetry.in_air",
+    "flight_mode": "telemetry.flight_mode",
+    "velocity": "telemetry.velocity_ned",
+    "battery": "telemetry.battery",
+    "attitude": "telemetry.attitude_euler",
+    "mission_progress": "mission.mission_progress",
+}
+RESUBSCRIBE_DELAY: float = 0.5  # Seconds to wait before reopening a failed stream
+RATE_SMOOTHING: float = 0.1  # Weight of the newest interval in the sample rate average
+
+# Called synchronously with (stream name, sample, arrival time) for every sample
+Listener = Callable[[str, Any, float], None]
+
+
+class StreamStats(NamedTuple):
+    """
+    NamedTuple storing the counters of a single telemetry stream.
+
+    Attributes
+    ----------
+    name : str
+        The hub name of the stream.
+    samples : int
+        The number of samples received since the hub started.
+    rate_hz : float
+        Smoothed sample rate of the stream in hertz.
+    age_s : float
+        Seconds since the latest sample arrived, or infinity if none has.
+    max_gap_s : float
+        The longest time between two consecutive samples in seconds.
+    """
+
+    name: str
+    samples: int
+    rate_hz: float
+    age_s: float
+    max_gap_s: float
+
+
+class _Stream:
+    """
+    Latest-value cache and waiters of a single telemetry stream.
+    """
+
+    __slots__ = (
+        "name",
+        "latest",
+        "timestamp",
+        "count",
+        "interval",
+        "max_gap",
+        "waiter",
+        "listeners",
+    )
+
+    def __init__(self, name: str) -> None:
+        self.name: str = name
+        self.latest: Any = None
+        self.timestamp: float = float("nan")
+        self.count: int = 0
+        self.interval: float = float("nan")
+        self.max_gap: float = 0.0
+        self.waiter: Optional[asyncio.Future[Any]] = None
+        self.listeners: list[Listener] = []
+
+    def publish(self, sample: Any, now: float) -> None:
+        """
+        Stores a new sample and wakes every coroutine waiting for it
+
+        Parameters
+        ----------
+        sample : Any
+            The telemetry sample received from MAVSDK
+        now : float
+            Event loop time the sample arrived at
+        """
+        if self.count:
+            gap: float = now - self.timestamp
+            self.max_gap = max(self.max_gap, gap)
+            if self.count == 1:
+                self.interval = gap
+            else:
+                self.interval += RATE_SMOOTHING * (gap - self.interval)
+
+        self.latest = sample
+        self.timestamp = now
+        self.count += 1
+
+        for listener in self.listeners:
+            listener(self.name, sample, now)
+
+        if self.waiter is not None:
+            if not self.waiter.done():
+                self.waiter.set_result(sample)
+            self.waiter = None
+
+
+class TelemetryHub:
+    """
+    Owns one subscription per telemetry stream of a drone and shares the samples.
+
+    Attributes
+    ----------
+    drone : System
+        The drone whose telemetry is being shared.
+    """
+
+    def __init__(self, drone: System) -> None:
+        self.drone: System = drone
+        self._streams: dict[str, _Stream] = {name: _Stream(name) for name in STREAMS}
+        self._tasks: list[asyncio.Task[None]] = []
+
+    def start(self) -> None:
+        """
+        Opens the subscription of every stream if they are not already running
+        """
+        if self._tasks:
+            return
+        for name, method in STREAMS.items():
+            self._tasks.append(asyncio.create_task(self._subscribe(name, method)))
+
+    async def stop(self) -> None:
+        """
+        Closes every subscription and cancels any coroutine still waiting on a sample
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+        for stream in self._streams.values():
+            if stream.waiter is not None:
+                stream.waiter.cancel()
+                stream.waiter = None
+
+    def add_listener(self, listener: Listener, names: Optional[list[str]] = None) -> None:
+        """
+        Registers a callback that is run synchronously on every sample, before any
+        waiting coroutine wakes up. Listeners must be fast and must not block.
+
+        Parameters
+        ----------
+        listener : Listener
+            Callback taking the stream name, the sample and its arrival time
+        names : Optional[list[str]]
+            The streams to listen to, or None for every stream
+        """
+        for name in names if names is not None else list(STREAMS):
+            self._streams[name].listeners.append(listener)
+
+    def remove_listener(self, listener: Listener) -> None:
+        """
+        Unregisters a callback from every stream it was added to
+
+        Parameters
+        ----------
+        listener : Listener
+            The callback passed to add_listener
+        """
+        for stream in self._streams.values():
+            if listener in stream.listeners:
+                stream.listeners.remove(listener)
+
+    def latest(self, name: str) -> Any:
+        """
+        Returns the most recent sample of a stream without waiting
+
+        Parameters
+        ----------
+        name : str
+            The hub name of the stream, one of STREAMS
+
+        Returns
+        -------
+        sample : Any
+            The latest sample, or None if nothing has arrived yet
+        """
+        return self._streams[name].latest
+
+    def timestamp(self, name: str) -> float:
+        """
+        Returns the event loop time the latest sample of a stream arrived at
+
+        Parameters
+        ----------
+        name : str
+            The hub name of the stream, one of STREAMS
+
+        Returns
+        -------
+        timestamp : float
+            Arrival time of the latest sample, or nan if nothing has arrived yet
+        """
+        return self._streams[name].timestamp
+
+    async def next(self, name: str) -> Any:
+        """
+        Waits for the next sample of a stream
+
+        Parameters
+        ----------
+        name : str
+            The hub name of the stream, one of STREAMS
+
+        Returns
+        -------
+        sample : Any
+            The first sample to arrive after the call
+        """
+        stream: _Stream = self._streams[name]
+        if stream.waiter is None:
+            stream.waiter = asyncio.get_running_loop().create_future()
+        return await asyncio.shield(stream.waiter)
+
+    async def wait_latest(self, name: str) -> Any:
+        """
+        Returns the latest sample of a stream, waiting only if none has arrived yet
+
+        Parameters
+        ----------
+        name : str
+            The hub name of the stream, one of STREAMS
+
+        Returns
+        -------
+        sample : Any
+            The latest sample of the stream
+        """
+        stream: _Stream = self._streams[name]
+        if stream.count:
+            return stream.latest
+        return await self.next(name)
+
+    async def samples(self, name: str) -> AsyncIterator[Any]:
+        """
+        Yields each new sample of a stream, skipping any that arrive while the
+        consumer is still busy with the previous one
+
+        Parameters
+        ----------
+        name : str
+            The hub name of the stream, one of STREAMS
+
+        Yields
+        ------
+        sample : Any
+            The newest sample of the stream
+        """
+        while True:
+            yield await self.next(name)
+
+    def stats(self, name: str) -> StreamStats:
+        """
+        Returns the sample rate and staleness counters of a stream
+
+        Parameters
+        ----------
+        name : str
+            The hub name of the stream, one of STREAMS
+
+        Returns
+        -------
+        stats : StreamStats
+            The counters of the stream
+        """
+        stream: _Stream = self._streams[name]
+        age: float = float("inf")
+        if stream.count:
+            age = asyncio.get_running_loop().time() - stream.timestamp
+        rate: float = 0.0
+        if stream.interval > 0.0:
+            rate = 1.0 / stream.interval
+        return StreamStats(name, stream.count, rate, age, stream.max_gap)
+
+    async def _subscribe(self, name: str, method: str) -> None:
+        """
+        Reads a telemetry stream for as long as the hub runs, reopening it on failure
+
+        Parameters
+        ----------
+        name : str
+            The hub name of the stream
+        method : str
+            The mavsdk plugin and method producing the stream, as "plugin.method"
+        """
+        stream: _Stream = self._streams[name]
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        plugin: str
+        plugin, method = method.split(".")
+        while True:
+            try:
+                async for sample in getattr(getattr(self.drone, plugin), method)():
+                    stream.publish(sample, loop.time())
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Telemetry stream %s failed, resubscribing", name)
+            await asyncio.sleep(RESUBSCRIBE_DELAY)
+
+
+_HUBS: dict[System, TelemetryHub] = {}
+
+
+def get_hub(drone: System) -> TelemetryHub:
+    """
+    Returns the running telemetry hub of a drone, creating and starting it on first use
+
+    Parameters
+    ----------
+    drone : System
+        The drone whose telemetry should be shared
+
+    Returns
+    -------
+    hub : TelemetryHub
+        The single hub of the drone
+    """
+    hub: Optional[TelemetryHub] = _HUBS.get(drone)
+    if hub is None:
+        hub = _HUBS[drone] = TelemetryHub(drone)
+    hub.start()
+    return hub
+
+
+async def release_hub(drone: System) -> None:
+    """
+    Stops the telemetry hub of a drone and forgets it, if it has one
+
+    Parameters
+    ----------
+    drone : System
+        The drone whose hub should be stopped
+    """
+    hub: Optional[TelemetryHub] = _HUBS.pop(drone, None)
+    if hub is not None:
+        await hub.stop()
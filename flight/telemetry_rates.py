@@ -0,0 +1,269 @@
+"""
+Telemetry rate policy tied to the phases of the flight. Entering a phase asks the
+drone for the rates that phase needs, raising the streams it consumes and lowering
+the rest to save radio bandwidth, then measures the rate each stream actually
+arrives at through a telemetry hub listener and logs any that fall short.
+"""
+import asyncio
+import functools
+import logging
+import weakref
+from typing import Any, NamedTuple, Optional, Union
+
+from mavsdk import System
+
+from flight import commands
+from flight.telemetry_hub import TelemetryHub, get_hub
+
+# Hub stream name -> name of the mavsdk Telemetry method that sets its rate
+RATE_METHODS: dict[str, str] = {
+    "position": "set_rate_position",
+    "home": "set_rate_home",
+    "in_air": "set_rate_in_air",
+    "velocity": "set_rate_velocity_ned",
+    "battery": "set_rate_battery",
+    "attitude": "set_rate_attitude",
+}
+# Rates in hertz of each stream by phase. Position stays at 2 Hz or more, so the
+# watchdog never sees a healthy stream as stalled
+PHASE_RATES: dict[str, dict[str, float]] = {
+    "connect": {
+        "position": 2.0,
+        "home": 1.0,
+        "in_air": 2.0,
+        "velocity": 2.0,
+        "battery": 1.0,
+        "attitude": 2.0,
+    },
+    # The mission protocol shares the radio, so everything is kept low during the upload
+    "upload": {
+        "position": 2.0,
+        "home": 0.5,
+        "in_air": 1.0,
+        "velocity": 1.0,
+        "battery": 0.5,
+        "attitude": 1.0,
+    },
+    # Flying the mission, only the altitude of the landing handover is watched
+    "cruise": {
+        "position": 4.0,
+        "home": 0.5,
+        "in_air": 1.0,
+        "velocity": 2.0,
+        "battery": 1.0,
+        "attitude": 2.0,
+    },
+    # Descending above the target toward the landing handover altitude
+    "descent": {
+        "position": 10.0,
+        "home": 0.5,
+        "in_air": 2.0,
+        "velocity": 10.0,
+        "battery": 1.0,
+        "attitude": 2.0,
+    },
+    # The landing controller and drift estimator read position and velocity at 20 Hz
+    "landing": {
+        "position": 20.0,
+        "home": 0.5,
+        "in_air": 5.0,
+        "velocity": 20.0,
+        "battery": 0.5,
+        "attitude": 2.0,
+    },
+}
+RATE_SETTLE_TIME: float = 0.5  # Seconds after a change before its rate is measured
+RATE_CHECK_WINDOW: float = 2.0  # Seconds of samples the achieved rate is measured over
+RATE_TOLERANCE: float = 0.2  # Fraction below the requested rate still counted as achieved
+
+
+class RateCheck(NamedTuple):
+    """
+    NamedTuple storing the requested and achieved rate of a single stream.
+
+    Attributes
+    ----------
+    name : str
+        The hub name of the stream.
+    phase : str
+        The phase the rate was requested for.
+    requested : float
+        The requested rate in hertz.
+    achieved : float
+        The measured rate in hertz.
+    ok : bool
+        Whether the achieved rate is within RATE_TOLERANCE of the requested one.
+    """
+
+    name: str
+    phase: str
+    requested: float
+    achieved: float
+    ok: bool
+
+
+class RatePolicy:
+    """
+    Rates requested from one drone and the measurement of the rates achieved.
+    update() is a telemetry hub listener.
+
+    Attributes
+    ----------
+    phase : Optional[str]
+        The phase entered last, None before the first.
+    requested : dict[str, float]
+        The rate in hertz requested for each stream.
+    checks : dict[str, RateCheck]
+        The latest measurement of each stream.
+    """
+
+    def __init__(self) -> None:
+        self.phase: Optional[str] = None
+        self.requested: dict[str, float] = {}
+        self.checks: dict[str, RateCheck] = {}
+        # Per stream being measured: start of measuring, first sample time and sample count
+        self._windows: dict[str, list[float]] = {}
+
+    def start(self, phase: str, changed: list[str], now: float) -> None:
+        """
+        Enters a phase, measuring the streams whose rate was changed
+
+        Parameters
+        ----------
+        phase : str
+            The phase entered
+        changed : list[str]
+            The streams whose rate was set
+        now : float
+            Event loop time the rates were set at
+        """
+        self.phase = phase
+        for name in changed:
+            self._windows[name] = [now + RATE_SETTLE_TIME, float("nan"), 0.0]
+
+    def update(self, name: str, sample: Any, now: float) -> None:
+        """
+        Counts one sample toward the measurement of its stream
+
+        Parameters
+        ----------
+        name : str
+            The hub name of the stream
+        sample : Any
+            The sample, unused
+        now : float
+            Time the sample arrived at in seconds
+        """
+        window: Optional[list[float]] = self._windows.get(name)
+        if window is None or now < window[0]:
+            return
+        if window[2] == 0.0:
+            window[1] = now
+        window[2] += 1.0
+        elapsed: float = now - window[1]
+        if elapsed < RATE_CHECK_WINDOW:
+            return
+
+        del self._windows[name]
+        requested: float = self.requested[name]
+        achieved: float = (window[2] - 1.0) / elapsed
+        check: RateCheck = RateCheck(
+            name,
+            self.phase or "",
+            requested,
+            achieved,
+            achieved >= requested * (1.0 - RATE_TOLERANCE),
+        )
+        self.checks[name] = check
+        if check.ok:
+            logging.debug("Telemetry %s at %.1f Hz of %.1f Hz requested", name, achieved, requested)
+        else:
+            logging.warning(
+                "Telemetry %s only at %.1f Hz of %.1f Hz requested in phase %s",
+                name,
+                achieved,
+                requested,
+                check.phase,
+            )
+
+
+# Policy of each hub, dropped with the hub. The policy must not reference its hub
+_POLICIES: weakref.WeakKeyDictionary[TelemetryHub, RatePolicy] = weakref.WeakKeyDictionary()
+
+
+def get_policy(drone: System) -> RatePolicy:
+    """
+    Returns the rate policy of a drone, creating it the first time
+
+    Parameters
+    ----------
+    drone : System
+        The connected drone
+
+    Returns
+    -------
+    policy : RatePolicy
+        The rate policy of the drone
+    """
+    hub: TelemetryHub = get_hub(drone)
+    policy: Optional[RatePolicy] = _POLICIES.get(hub)
+    if policy is None:
+        policy = _POLICIES[hub] = RatePolicy()
+        hub.add_listener(policy.update, list(RATE_METHODS))
+    return policy
+
+
+async def set_rate(drone: System, name: str, rate: float) -> None:
+    """
+    Sets the rate of one telemetry stream
+
+    Parameters
+    ----------
+    drone : System
+        The connected drone
+    name : str
+        The hub name of the stream, a key of RATE_METHODS
+    rate : float
+        The rate in hertz
+    """
+    await commands.send(
+        drone,
+        "set_rate",
+        functools.partial(getattr(drone.telemetry, RATE_METHODS[name]), rate),
+        rate,
+        priority=commands.ROUTINE,
+        key=f"set_rate:{name}",
+    )
+
+
+async def enter_phase(drone: System, phase: str) -> None:
+    """
+    Sets the telemetry rates of a phase of the flight, only changing the streams that
+    are not at their rate already. A rate the drone refuses is logged, not raised, as
+    the flight can go on at the old rate.
+
+    Parameters
+    ----------
+    drone : System
+        The connected drone
+    phase : str
+        The phase entered, a key of PHASE_RATES
+    """
+    policy: RatePolicy = get_policy(drone)
+    pending: list[tuple[str, float]] = [
+        (name, rate)
+        for name, rate in PHASE_RATES[phase].items()
+        if policy.requested.get(name) != rate
+    ]
+    outcomes: list[Union[None, BaseException]] = await asyncio.gather(
+        *(set_rate(drone, name, rate) for name, rate in pending), return_exceptions=True
+    )
+    changed: list[str] = []
+    for (name, rate), outcome in zip(pending, outcomes):
+        if isinstance(outcome, BaseException):
+            logging.warning("Could not set telemetry %s to %.1f Hz: %s", name, rate, outcome)
+        else:
+            policy.requested[name] = rate
+            changed.append(name)
+    policy.start(phase, changed, asyncio.get_running_loop().time())
+    logging.debug("Telemetry rates for %s, %d changed", phase, len(changed))
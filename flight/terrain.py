@@ -0,0 +1,498 @@
+"""
+Terrain elevation of the flight field, for altitudes above the ground under the drone
+rather than above home. A field's elevation model is a compact binary grid next to
+the target data files, converted once from an ESRI ASCII grid, which GDAL writes from
+a GeoTIFF with gdal_translate -of AAIGrid:
+
+    python -m flight.terrain convert field.asc flight/data/golf_terrain.dem
+
+The grid file is memory-mapped, never read whole. It is split into square tiles that
+are decoded to Python floats on first use and kept in a small LRU cache, with one row
+and column of overlap so the four cells around any point are in the same tile, and
+every elevation query is a bilinear interpolation in constant time. A field without
+a grid file is taken as flat at the ground altitude of its target data file.
+
+Heights are taken from the altitude above home that the vehicle reports, corrected by
+how much higher the ground under the drone is than the ground at home. Only elevation
+differences within the grid are used, never the GPS altitude against the elevation of
+the grid or of the target data file, so an offset between the two cannot put the
+ground meters above or below the drone.
+"""
+import argparse
+import asyncio
+import copy
+import logging
+import math
+import os
+import struct
+from collections import OrderedDict
+from typing import Any, Optional
+
+import numpy as np
+import numpy.typing as npt
+from mavsdk.telemetry import Position
+
+TERRAIN_FILE: str = "flight/data/terrain.dem"  # Competition field
+GOLF_TERRAIN_FILE: str = "flight/data/golf_terrain.dem"  # Golf course test field
+MAGIC: bytes = b"DEM1"
+# Magic, rows, columns, latitude of the first row and longitude of the first column of
+# cell centres in degrees, latitude and longitude steps in degrees, meters per stored
+# step and meters of stored zero, nodata value, padded to 64 bytes
+HEADER: struct.Struct = struct.Struct("<4sIIddddddh6x")
+NODATA: int = -32768  # Stored value of cells without elevation
+STORED_RANGE: int = 65534  # Stored steps from -32767 to 32767
+MIN_SCALE: float = 0.001  # Meters per stored step of the flattest grids
+TILE_SIZE: int = 32  # Cells per side of a decoded tile, plus one of overlap
+TILE_CACHE: int = 64  # Decoded tiles kept, about 35 kB each
+
+
+class TerrainError(ValueError):
+    """
+    Exception for when a terrain file is not a valid elevation grid
+    """
+
+
+class Terrain:
+    """
+    Ground elevation that does not change over the field.
+
+    Attributes
+    ----------
+    ground_altitude : float
+        Elevation of the ground in meters AMSL.
+    home_elevation : float
+        Elevation in meters AMSL of the ground at the home of the drone, see anchor().
+    """
+
+    def __init__(self, ground_altitude: float) -> None:
+        self.ground_altitude: float = ground_altitude
+        self.home_elevation: float = ground_altitude
+
+    def anchor(
+        self, latitude: float, longitude: float, ground_altitude: Optional[float] = None
+    ) -> "Terrain":
+        """
+        Returns the terrain with heights taken relative to the ground at a home position.
+        The terrain itself is left as it is, as it is shared by the drones of a fleet
+
+        Parameters
+        ----------
+        latitude : float
+            Latitude of home in degrees
+        longitude : float
+            Longitude of home in degrees
+        ground_altitude : Optional[float]
+            Elevation of the ground in meters AMSL where there is no data, the one of
+            this terrain if None
+
+        Returns
+        -------
+        terrain : Terrain
+            The terrain anchored at home, sharing the elevations of this one
+        """
+        anchored: Terrain = copy.copy(self)
+        if ground_altitude is not None:
+            anchored.ground_altitude = ground_altitude
+        anchored.home_elevation = self.elevation(latitude, longitude)
+        return anchored
+
+    def elevation(self, latitude: float, longitude: float) -> float:
+        """
+        Returns the elevation of the ground at a position
+
+        Parameters
+        ----------
+        latitude : float
+            Latitude in degrees
+        longitude : float
+            Longitude in degrees
+
+        Returns
+        -------
+        elevation : float
+            Elevation of the ground in meters AMSL
+        """
+        return self.ground_altitude
+
+    def relative_elevation(self, latitude: float, longitude: float) -> float:
+        """
+        Returns how much higher the ground at a position is than the ground at home
+
+        Parameters
+        ----------
+        latitude : float
+            Latitude in degrees
+        longitude : float
+            Longitude in degrees
+
+        Returns
+        -------
+        rise : float
+            Meters the ground rises from home to the position, negative where it falls
+        """
+        return self.elevation(latitude, longitude) - self.home_elevation
+
+    def height_above_ground(self, position: Position) -> float:
+        """
+        Returns how high a position sample is above the ground under it, from its
+        altitude above home. Flat ground gives the altitude above home itself
+
+        Parameters
+        ----------
+        position : Position
+            A position sample of the drone
+
+        Returns
+        -------
+        height : float
+            Meters above the ground
+        """
+        return position.relative_altitude_m - self.relative_elevation(
+            position.latitude_deg, position.longitude_deg
+        )
+
+
+class ElevationGrid(Terrain):
+    """
+    Ground elevation interpolated from a memory-mapped grid file. Positions beyond
+    the grid take the elevation of its nearest edge.
+
+    Attributes
+    ----------
+    ground_altitude : float
+        Elevation in meters AMSL where every cell around a position has no data.
+    home_elevation : float
+        Elevation in meters AMSL of the ground at the home of the drone, see anchor().
+    rows : int
+        Rows of the grid, north to south.
+    columns : int
+        Columns of the grid, west to east.
+    tile_loads : int
+        The number of tiles decoded, cache misses included.
+    """
+
+    def __init__(self, path: str, ground_altitude: float) -> None:
+        super().__init__(ground_altitude)
+        with open(path, "rb") as grid_file:
+            header: bytes = grid_file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise TerrainError(f"{path} is too short for a terrain header")
+        magic: bytes
+        (
+            magic,
+            rows,
+            columns,
+            north,
+            west,
+            step_latitude,
+            step_longitude,
+            scale,
+            offset,
+            _,
+        ) = HEADER.unpack(header)
+        if magic != MAGIC or rows < 2 or columns < 2 or step_latitude <= 0 or step_longitude <= 0:
+            raise TerrainError(f"{path} is not a terrain grid")
+        if os.path.getsize(path) != HEADER.size + 2 * rows * columns:
+            raise TerrainError(f"{path} does not hold {rows} by {columns} cells")
+
+        self.rows: int = rows
+        self.columns: int = columns
+        self.tile_loads: int = 0
+        self._north: float = north
+        self._west: float = west
+        self._scale: float = scale
+        self._offset: float = offset
+        self._grid: npt.NDArray[np.int16] = np.memmap(
+            path, dtype="<i2", mode="r", offset=HEADER.size, shape=(rows, columns)
+        )
+        self._rows_per_degree: float = 1.0 / step_latitude
+        self._columns_per_degree: float = 1.0 / step_longitude
+        self._last_top: int = rows - 2
+        self._last_left: int = columns - 2
+        # Decoded cells of each tile, row by row, and whether every cell has data
+        self._tiles: OrderedDict[tuple[int, int], tuple[list[float], bool]] = OrderedDict()
+        # Tile of the previous query, which the next one is almost always in
+        self._last_key: tuple[int, int] = (-1, -1)
+        self._last_tile: list[float] = []
+        self._last_complete: bool = False
+
+    def elevation(self, latitude: float, longitude: float) -> float:
+        """
+        Returns the elevation of the ground at a position, interpolated between the four
+        cells around it
+
+        Parameters
+        ----------
+        latitude : float
+            Latitude in degrees
+        longitude : float
+            Longitude in degrees
+
+        Returns
+        -------
+        elevation : float
+            Elevation of the ground in meters AMSL
+        """
+        row: float = (self._north - latitude) * self._rows_per_degree
+        column: float = (longitude - self._west) * self._columns_per_degree
+        if not (0.0 <= row < self._last_top and 0.0 <= column < self._last_left):
+            # The last row and column are only reached through the cells before them
+            row = min(max(row, 0.0), self.rows - 1)
+            column = min(max(column, 0.0), self.columns - 1)
+        top: int = min(int(row), self.rows - 2)
+        left: int = min(int(column), self.columns - 2)
+        south_share: float = row - top
+        east_share: float = column - left
+
+        key: tuple[int, int] = (top // TILE_SIZE, left // TILE_SIZE)
+        if key != self._last_key:
+            self._load(key)
+        tile: list[float] = self._last_tile
+        index: int = (top % TILE_SIZE) * (TILE_SIZE + 1) + left % TILE_SIZE
+        north_west: float = tile[index]
+        north_east: float = tile[index + 1]
+        south_west: float = tile[index + TILE_SIZE + 1]
+        south_east: float = tile[index + TILE_SIZE + 2]
+        if self._last_complete:
+            north_value: float = north_west + (north_east - north_west) * east_share
+            south_value: float = south_west + (south_east - south_west) * east_share
+            return north_value + (south_value - north_value) * south_share
+
+        # Cells without data are nan, and left out of the interpolation
+        total: float = 0.0
+        weight_sum: float = 0.0
+        for value, weight in (
+            (north_west, (1.0 - south_share) * (1.0 - east_share)),
+            (north_east, (1.0 - south_share) * east_share),
+            (south_west, south_share * (1.0 - east_share)),
+            (south_east, south_share * east_share),
+        ):
+            if not math.isnan(value):
+                total += value * weight
+                weight_sum += weight
+        return total / weight_sum if weight_sum > 0.0 else self.ground_altitude
+
+    def _load(self, key: tuple[int, int]) -> None:
+        cached: Optional[tuple[list[float], bool]] = self._tiles.get(key)
+        if cached is None:
+            top: int = key[0] * TILE_SIZE
+            left: int = key[1] * TILE_SIZE
+            stored: npt.NDArray[np.int16] = np.full((TILE_SIZE + 1, TILE_SIZE + 1), NODATA, "<i2")
+            cells: npt.NDArray[np.int16] = self._grid[
+                top : top + TILE_SIZE + 1, left : left + TILE_SIZE + 1
+            ]
+            stored[: cells.shape[0], : cells.shape[1]] = cells
+            missing: npt.NDArray[np.bool_] = stored == NODATA
+            meters: npt.NDArray[np.float64] = stored * self._scale + self._offset
+            meters[missing] = math.nan
+            cached = self._tiles[key] = (meters.ravel().tolist(), not missing.any())
+            self.tile_loads += 1
+            if len(self._tiles) > TILE_CACHE:
+                self._tiles.popitem(last=False)
+        else:
+            self._tiles.move_to_end(key)
+        self._last_key = key
+        self._last_tile, self._last_complete = cached
+
+
+def terrain_path(competition: bool) -> str:
+    """
+    Returns the path of the terrain file of the field flown
+
+    Parameters
+    ----------
+    competition : bool
+        Decides if the competition field is used or the golf course test one.
+
+    Returns
+    -------
+    path : str
+        Path of the terrain grid file, which may not exist.
+    """
+    return TERRAIN_FILE if competition else GOLF_TERRAIN_FILE
+
+
+# Grids by path, with the modification time they were loaded at
+_CACHE: dict[str, tuple[int, ElevationGrid]] = {}
+
+
+async def load_terrain(path: str, ground_altitude: float, home: Position) -> Terrain:
+    """
+    Returns the terrain of a field anchored at the home of a drone, memory-mapping its
+    grid file, or flat ground at the ground altitude if the field has none
+
+    Parameters
+    ----------
+    path : str
+        File path to the terrain grid file.
+    ground_altitude : float
+        Elevation of the ground in meters AMSL, from the target data file, where the
+        grid has no data or there is no grid.
+    home : Position
+        The home position of the drone, heights are corrected from the ground there
+
+    Returns
+    -------
+    terrain : Terrain
+        The terrain of the field, anchored at home
+
+    Raises
+    ------
+    TerrainError
+        If the file is not a valid elevation grid
+    """
+    try:
+        modified: int = (await asyncio.to_thread(os.stat, path)).st_mtime_ns
+    except FileNotFoundError:
+        logging.info("No terrain file %s, heights are taken above home", path)
+        return Terrain(ground_altitude)
+    cached: Optional[tuple[int, ElevationGrid]] = _CACHE.get(path)
+    grid: ElevationGrid
+    if cached is not None and cached[0] == modified:
+        grid = cached[1]
+    else:
+        grid = await asyncio.to_thread(ElevationGrid, path, ground_altitude)
+        _CACHE[path] = (modified, grid)
+        logging.info("Terrain %s: %d by %d cells", path, grid.rows, grid.columns)
+    # The cached grid is shared, so the ground altitude of this caller only goes on its copy
+    return grid.anchor(home.latitude_deg, home.longitude_deg, ground_altitude)
+
+
+def write_grid(
+    path: str,
+    elevations: npt.NDArray[np.float64],
+    north: float,
+    west: float,
+    step_latitude: float,
+    step_longitude: float,
+) -> None:
+    """
+    Writes elevations as a terrain grid file
+
+    Parameters
+    ----------
+    path : str
+        File path of the grid file to write
+    elevations : NDArray[float64]
+        Elevations in meters AMSL by row north to south and column west to east, nan
+        where there is no data
+    north : float
+        Latitude of the centres of the first row in degrees
+    west : float
+        Longitude of the centres of the first column in degrees
+    step_latitude : float
+        Degrees of latitude between rows
+    step_longitude : float
+        Degrees of longitude between columns
+
+    Raises
+    ------
+    TerrainError
+        If no cell has an elevation
+    """
+    valid: npt.NDArray[np.bool_] = ~np.isnan(elevations)
+    if not valid.any():
+        raise TerrainError("The grid has no elevations")
+    low: float = float(elevations[valid].min())
+    high: float = float(elevations[valid].max())
+    scale: float = max((high - low) / STORED_RANGE, MIN_SCALE)
+    offset: float = (low + high) / 2.0
+    stored: npt.NDArray[np.int16] = np.full(elevations.shape, NODATA, "<i2")
+    stored[valid] = np.round((elevations[valid] - offset) / scale).astype("<i2")
+    rows, columns = elevations.shape
+    with open(path, "wb") as grid_file:
+        grid_file.write(
+            HEADER.pack(
+                MAGIC,
+                rows,
+                columns,
+                north,
+                west,
+                step_latitude,
+                step_longitude,
+                scale,
+                offset,
+                NODATA,
+            )
+        )
+        grid_file.write(stored.tobytes())
+
+
+def convert_ascii_grid(source: str, destination: str) -> None:
+    """
+    Converts an ESRI ASCII grid with latitude and longitude coordinates and elevations
+    in meters to a terrain grid file
+
+    Parameters
+    ----------
+    source : str
+        File path of the ASCII grid
+    destination : str
+        File path of the grid file to write
+
+    Raises
+    ------
+    TerrainError
+        If the header is incomplete or the cells do not match it
+    """
+    header: dict[str, float] = {}
+    with open(source, encoding="UTF-8") as grid_file:
+        while True:
+            position: int = grid_file.tell()
+            line: str = grid_file.readline()
+            fields: list[str] = line.split()
+            if len(fields) != 2 or not fields[0][0].isalpha():
+                grid_file.seek(position)
+                break
+            header[fields[0].lower()] = float(fields[1])
+        elevations: npt.NDArray[np.float64] = np.loadtxt(grid_file, dtype=np.float64, ndmin=2)
+
+    try:
+        rows: int = int(header["nrows"])
+        columns: int = int(header["ncols"])
+        cell_size: float = header["cellsize"]
+    except KeyError as ex:
+        raise TerrainError(f"{source} has no {ex.args[0]} in its header") from ex
+    if elevations.shape != (rows, columns):
+        raise TerrainError(f"{source} does not hold {rows} by {columns} cells")
+    if "nodata_value" in header:
+        elevations[elevations == header["nodata_value"]] = math.nan
+
+    # Corner coordinates are the outer edges of the cells, centre ones their middles
+    half_cell: float = 0.0 if "xllcenter" in header else cell_size / 2.0
+    west: float = header.get("xllcenter", header.get("xllcorner", math.nan)) + half_cell
+    south: float = header.get("yllcenter", header.get("yllcorner", math.nan)) + half_cell
+    if math.isnan(west) or math.isnan(south):
+        raise TerrainError(f"{source} has no lower left corner in its header")
+    write_grid(destination, elevations, south + (rows - 1) * cell_size, west, cell_size, cell_size)
+
+
+def main() -> None:
+    """
+    Converts ASCII grids to terrain grid files, or queries the elevation of a position
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    commands: Any = parser.add_subparsers(dest="command", required=True)
+    convert: argparse.ArgumentParser = commands.add_parser(
+        "convert", help="Convert an ESRI ASCII grid to a terrain grid file"
+    )
+    convert.add_argument("source", help="ESRI ASCII grid in degrees and meters")
+    convert.add_argument("destination", help="Terrain grid file to write")
+    query: argparse.ArgumentParser = commands.add_parser(
+        "query", help="Print the elevation of a position"
+    )
+    query.add_argument("path", help="Terrain grid file")
+    query.add_argument("latitude", type=float)
+    query.add_argument("longitude", type=float)
+    args: argparse.Namespace = parser.parse_args()
+
+    if args.command == "convert":
+        convert_ascii_grid(args.source, args.destination)
+        grid: ElevationGrid = ElevationGrid(args.destination, math.nan)
+        print(f"Wrote {grid.rows} by {grid.columns} cells to {args.destination}")
+    else:
+        print(f"{ElevationGrid(args.path, math.nan).elevation(args.latitude, args.longitude):.2f}")
+
+
+if __name__ == "__main__":
+    main()
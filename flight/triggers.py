@@ -0,0 +1,425 @@
+"""
+Declarative triggers for the transitions between the phases of a flight. A phase
+waits on conditions such as the drone descending below an altitude, coming within a
+distance of a point, reaching a mission item, landing, or a timeout, instead of
+running its own loop over a telemetry stream.
+
+Every condition depends on a single hub stream, and the armed conditions are indexed
+by that stream. One telemetry hub listener per drone evaluates them against each
+sample as it arrives, so adding a phase adds neither a stream nor a polling loop.
+The time from the sample that satisfied a condition to the waiting phase resuming is
+recorded per trigger.
+"""
+import asyncio
+import logging
+import math
+import weakref
+from typing import Any, Callable, NamedTuple, Optional
+
+from mavsdk import System
+
+from flight import geo, logger, metrics, terrain
+from flight.telemetry_hub import TelemetryHub, get_hub
+
+TRIGGER_METRIC: str = "trigger_latency_seconds"  # Histogram of every trigger, by name
+
+
+class Condition(NamedTuple):
+    """
+    NamedTuple storing a single condition a phase can wait on.
+
+    Attributes
+    ----------
+    name : str
+        The name of the trigger, in logs and in its latency histogram.
+    stream : Optional[str]
+        The hub stream the condition is evaluated on, or None for a timeout.
+    test : Callable[[Any], bool]
+        Returns whether a sample of the stream satisfies the condition.
+    seconds : float
+        Seconds after arming a timeout fires at, infinity for stream conditions.
+    """
+
+    name: str
+    stream: Optional[str]
+    test: Callable[[Any], bool]
+    seconds: float = math.inf
+
+
+def _never(sample: Any) -> bool:
+    return False
+
+
+def below(name: str, altitude: float, ground: Optional[terrain.Terrain] = None) -> Condition:
+    """
+    Fires when the drone is at or below an altitude
+
+    Parameters
+    ----------
+    name : str
+        The name of the trigger
+    altitude : float
+        The altitude in meters
+    ground : Optional[Terrain]
+        The terrain of the field, the altitude is taken above the ground under the drone
+        with it and above home without it
+
+    Returns
+    -------
+    condition : Condition
+        The condition on the position stream
+    """
+    if ground is None:
+        return Condition(
+            name, "position", lambda position: position.relative_altitude_m <= altitude
+        )
+    height_above_ground: Callable[[Any], float] = ground.height_above_ground
+    return Condition(name, "position", lambda position: height_above_ground(position) <= altitude)
+
+
+def within(name: str, frame: geo.LocalFrame, distance: float) -> Condition:
+    """
+    Fires when the drone is horizontally within a distance of a point
+
+    Parameters
+    ----------
+    name : str
+        The name of the trigger
+    frame : LocalFrame
+        A local frame anchored on the point
+    distance : float
+        The distance in meters
+
+    Returns
+    -------
+    condition : Condition
+        The condition on the position stream
+    """
+
+    def test(position: Any) -> bool:
+        east, north, _ = frame.to_enu(position.latitude_deg, position.longitude_deg)
+        return math.hypot(east, north) <= distance
+
+    return Condition(name, "position", test)
+
+
+def mission_item_reached(name: str, index: int) -> Condition:
+    """
+    Fires once the drone has reached a mission item and moved on past it
+
+    Parameters
+    ----------
+    name : str
+        The name of the trigger
+    index : int
+        The index of the mission item, negative indices count from the end
+
+    Returns
+    -------
+    condition : Condition
+        The condition on the mission_progress stream
+    """
+
+    def test(progress: Any) -> bool:
+        if progress.total <= 0:
+            return False
+        return progress.current > (index if index >= 0 else progress.total + index)
+
+    return Condition(name, "mission_progress", test)
+
+
+def in_air(name: str, flying: bool) -> Condition:
+    """
+    Fires when the drone is in the air, or when it is on the ground
+
+    Parameters
+    ----------
+    name : str
+        The name of the trigger
+    flying : bool
+        Whether to fire in the air rather than on the ground
+
+    Returns
+    -------
+    condition : Condition
+        The condition on the in_air stream
+    """
+    return Condition(name, "in_air", lambda sample: bool(sample) == flying)
+
+
+def timeout(name: str, seconds: float) -> Condition:
+    """
+    Fires a time after being armed, whatever the telemetry
+
+    Parameters
+    ----------
+    name : str
+        The name of the trigger
+    seconds : float
+        Seconds from arming to firing
+
+    Returns
+    -------
+    condition : Condition
+        The timeout condition
+    """
+    return Condition(name, None, _never, seconds)
+
+
+class Trigger:
+    """
+    Armed set of conditions, fired by the first of them to be satisfied.
+
+    Attributes
+    ----------
+    conditions : tuple[Condition, ...]
+        The conditions armed together.
+    fired : Optional[Condition]
+        The condition that fired, None until one does.
+    fired_at : float
+        Event loop time the sample that satisfied it arrived at, nan until then.
+    """
+
+    __slots__ = ("conditions", "fired", "fired_at", "_future", "_engine")
+
+    def __init__(self, engine: "TriggerEngine", conditions: tuple[Condition, ...]) -> None:
+        self.conditions: tuple[Condition, ...] = conditions
+        self.fired: Optional[Condition] = None
+        self.fired_at: float = math.nan
+        self._future: asyncio.Future[Condition] = asyncio.get_running_loop().create_future()
+        self._engine: TriggerEngine = engine
+
+    def done(self) -> bool:
+        """
+        Returns whether one of the conditions has fired
+
+        Returns
+        -------
+        done : bool
+            True once fired, or after cancel()
+        """
+        return self._future.done()
+
+    def cancel(self) -> None:
+        """
+        Disarms the conditions without firing
+        """
+        self._engine.disarm(self)
+        self._future.cancel()
+
+    async def wait(self, timeout_s: Optional[float] = None) -> Optional[Condition]:
+        """
+        Waits for one of the conditions to fire, recording the transition latency
+
+        Parameters
+        ----------
+        timeout_s : Optional[float]
+            Seconds to wait at most, None to wait until a condition fires. The
+            conditions stay armed when this runs out
+
+        Returns
+        -------
+        condition : Optional[Condition]
+            The condition that fired, or None if timeout_s ran out first
+        """
+        if not self._future.done():
+            await asyncio.wait((self._future,), timeout=timeout_s)
+            if not self._future.done():
+                return None
+        condition: Condition = self._future.result()
+        latency: float = asyncio.get_running_loop().time() - self.fired_at
+        if metrics.enabled():
+            metrics.histogram(
+                TRIGGER_METRIC,
+                "Seconds from the sample satisfying a trigger to its phase resuming",
+                trigger=condition.name,
+                vehicle=logger.VEHICLE.get(),
+            ).record(latency)
+        logging.debug("Trigger %s fired, %.4f s to resume", condition.name, latency)
+        return condition
+
+    def fire(self, condition: Condition, now: float) -> None:
+        """
+        Fires the trigger, disarming every one of its conditions
+
+        Parameters
+        ----------
+        condition : Condition
+            The condition that was satisfied
+        now : float
+            Event loop time the satisfying sample arrived at
+        """
+        if self._future.done():
+            return
+        self._engine.disarm(self)
+        self.fired = condition
+        self.fired_at = now
+        self._future.set_result(condition)
+
+    def fail(self, error: BaseException) -> None:
+        """
+        Disarms the trigger and passes an error raised by a condition to its waiter
+
+        Parameters
+        ----------
+        error : BaseException
+            The error raised while testing a sample
+        """
+        if self._future.done():
+            return
+        self._engine.disarm(self)
+        self._future.set_exception(error)
+
+
+class TriggerEngine:
+    """
+    Armed conditions of one drone, indexed by the hub stream they are evaluated on.
+    dispatch() is the telemetry hub listener evaluating them.
+    """
+
+    def __init__(self, hub: TelemetryHub) -> None:
+        # The engine is stored by its hub, so it must not keep the hub alive
+        self._hub: weakref.ref[TelemetryHub] = weakref.ref(hub)
+        self._index: dict[str, list[tuple[Condition, Trigger]]] = {}
+        self._timers: dict[Trigger, list[asyncio.TimerHandle]] = {}
+
+    def arm(self, *conditions: Condition) -> Trigger:
+        """
+        Starts evaluating conditions on the samples of their streams. Each condition is
+        also tested once on the latest sample already cached, so a condition that
+        already holds fires right away.
+
+        Parameters
+        ----------
+        *conditions : Condition
+            The conditions, the first one satisfied fires the trigger
+
+        Returns
+        -------
+        trigger : Trigger
+            The armed trigger
+        """
+        trigger: Trigger = Trigger(self, conditions)
+        hub: Optional[TelemetryHub] = self._hub()
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        for condition in conditions:
+            if condition.stream is None:
+                self._timers.setdefault(trigger, []).append(
+                    loop.call_later(condition.seconds, self._expire, trigger, condition)
+                )
+                continue
+            armed: Optional[list[tuple[Condition, Trigger]]] = self._index.get(condition.stream)
+            if armed is None:
+                armed = self._index[condition.stream] = []
+                if hub is not None:
+                    hub.add_listener(self.dispatch, [condition.stream])
+            armed.append((condition, trigger))
+
+        if hub is not None:
+            for condition in conditions:
+                if condition.stream is None or trigger.done():
+                    continue
+                if not math.isnan(hub.timestamp(condition.stream)):
+                    # Latency counts from arming, as the sample arrived before the phase asked
+                    self._test(condition, trigger, hub.latest(condition.stream), loop.time())
+        return trigger
+
+    async def wait(self, *conditions: Condition) -> Condition:
+        """
+        Arms conditions and waits for the first of them to fire
+
+        Parameters
+        ----------
+        *conditions : Condition
+            The conditions to wait on
+
+        Returns
+        -------
+        condition : Condition
+            The condition that fired
+        """
+        trigger: Trigger = self.arm(*conditions)
+        try:
+            condition: Optional[Condition] = await trigger.wait()
+        finally:
+            if not trigger.done():
+                trigger.cancel()
+        assert condition is not None
+        return condition
+
+    def disarm(self, trigger: Trigger) -> None:
+        """
+        Stops evaluating the conditions of a trigger
+
+        Parameters
+        ----------
+        trigger : Trigger
+            The trigger returned by arm()
+        """
+        for timer in self._timers.pop(trigger, ()):
+            timer.cancel()
+        for condition in trigger.conditions:
+            if condition.stream is None:
+                continue
+            armed: Optional[list[tuple[Condition, Trigger]]] = self._index.get(condition.stream)
+            if armed:
+                armed[:] = [entry for entry in armed if entry[1] is not trigger]
+
+    def dispatch(self, name: str, sample: Any, now: float) -> None:
+        """
+        Tests one sample against every condition armed on its stream
+
+        Parameters
+        ----------
+        name : str
+            The hub name of the stream
+        sample : Any
+            The telemetry sample
+        now : float
+            Event loop time the sample arrived at
+        """
+        armed: Optional[list[tuple[Condition, Trigger]]] = self._index.get(name)
+        if not armed:
+            return
+        # Firing disarms, which rebuilds the list, so iterate over the current entries
+        for condition, trigger in tuple(armed):
+            if not trigger.done():
+                self._test(condition, trigger, sample, now)
+
+    @staticmethod
+    def _test(condition: Condition, trigger: Trigger, sample: Any, now: float) -> None:
+        try:
+            if condition.test(sample):
+                trigger.fire(condition, now)
+        except Exception as ex:  # pylint: disable=broad-except
+            # Raising here would break the telemetry stream, so the waiting phase gets it
+            trigger.fail(ex)
+
+    @staticmethod
+    def _expire(trigger: Trigger, condition: Condition) -> None:
+        trigger.fire(condition, asyncio.get_running_loop().time())
+
+
+# Engine of each hub, dropped with the hub
+_ENGINES: weakref.WeakKeyDictionary[TelemetryHub, TriggerEngine] = weakref.WeakKeyDictionary()
+
+
+def get_engine(drone: System) -> TriggerEngine:
+    """
+    Returns the trigger engine of a drone, creating it the first time
+
+    Parameters
+    ----------
+    drone : System
+        The connected drone
+
+    Returns
+    -------
+    engine : TriggerEngine
+        The trigger engine of the drone
+    """
+    hub: TelemetryHub = get_hub(drone)
+    engine: Optional[TriggerEngine] = _ENGINES.get(hub)
+    if engine is None:
+        engine = _ENGINES[hub] = TriggerEngine(hub)
+    return engine
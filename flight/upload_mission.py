@@ -1,105 +1,428 @@
 """
-Connects to the drone and uploads the mission plan for landing the drone.
+Uploads the mission plan for landing the drone, optionally after a coverage search of
+the field. Plans are compared by a hash of their canonical form, so a plan already on
+the vehicle is not uploaded again.
 """
 import argparse
 import asyncio
+import functools
+import hashlib
 import logging
+import math
+import struct
+import weakref
+from typing import Optional
+
+import numpy as np
+import numpy.typing as npt
 from mavsdk import System
-from mavsdk.mission import MissionItem, MissionPlan
-from flight import intake_gps
+from mavsdk.mission import MissionError, MissionItem, MissionPlan
+from mavsdk.telemetry import Position
+from shapely.geometry.base import BaseGeometry
+from flight import (
+    commands,
+    connection,
+    coverage,
+    geofence,
+    intake_gps,
+    telemetry_rates,
+    terrain,
+)
+from flight.telemetry_hub import get_hub
+from flight.flight import OFFLINE_ADDR, SIM_ADDR
+from flight.sim import clock
+
+# Mission items above the target. Altitudes are meters above the ground under the target,
+# converted to the meters above home of MissionItem when the plan is made, and speeds are
+# the horizontal speeds in m/s, the unit of MissionItem and action.set_current_speed
+TRANSIT_ALTITUDE: float = 122.0  # 400 ft
+TRANSIT_SPEED: float = 20.0
+APPROACH_ALTITUDE: float = 50.0
+APPROACH_SPEED: float = 6.0
+# The search stays above the landing handover altitude of run_mission
+SEARCH_ALTITUDE: float = 100.0
+SEARCH_SPEED: float = 12.0
+SEARCH_ACCEPTANCE_RADIUS: float = 2.0  # Meters, search waypoints only need passing near
+SEARCH_TURN_OVERSHOOT: float = 3.0  # Meters a turn between search lines swings out past the path
+# Meters the ground under the target may be above or below home, more means a bad grid
+MAX_GROUND_OFFSET: float = 30.0
+MAX_MISSION_ITEMS: int = 65535  # MISSION_COUNT holds the number of items in a uint16
+
+# MAVLink 2 frame sizes of the mission protocol messages, 12 bytes of framing plus payload
+MISSION_ITEM_BYTES: int = 12 + 38  # MISSION_ITEM_INT
+MISSION_REQUEST_BYTES: int = 12 + 5  # MISSION_REQUEST_INT
+MISSION_COUNT_BYTES: int = 12 + 5  # MISSION_COUNT
+MISSION_ACK_BYTES: int = 12 + 4  # MISSION_ACK
+MISSION_CLEAR_BYTES: int = 12 + 3  # MISSION_CLEAR_ALL
+
+# Canonical item layout: coordinates as the 1e-7 degree integers sent over MAVLink and
+# every other number as the float32 it is stored as on the vehicle
+CANONICAL_ITEM: struct.Struct = struct.Struct("<iif?fffBfffff")
+CANONICAL_NAN: float = float("nan")  # Every nan is packed as this one bit pattern
+
+# Hash of the plan known to be on each drone, so an unchanged plan is not even downloaded
+_VEHICLE_PLANS: weakref.WeakKeyDictionary[System, str] = weakref.WeakKeyDictionary()
+
+
+def _canonical(value: float) -> float:
+    return CANONICAL_NAN if math.isnan(value) else value
+
+
+def mission_hash(mission_plan: MissionPlan) -> str:
+    """
+    Hashes a mission plan in a canonical form, rounded to the precision the vehicle
+    stores, so a plan hashes the same before uploading and after downloading
+
+    Parameters
+    ----------
+    mission_plan : MissionPlan
+        The plan to hash
+
+    Returns
+    -------
+    digest : str
+        Hex SHA-256 digest of the canonical plan
+    """
+    digest = hashlib.sha256()
+    item: MissionItem
+    for item in mission_plan.mission_items:
+        digest.update(
+            CANONICAL_ITEM.pack(
+                round(item.latitude_deg * 1e7),
+                round(item.longitude_deg * 1e7),
+                _canonical(item.relative_altitude_m),
+                item.is_fly_through,
+                _canonical(item.speed_m_s),
+                _canonical(item.gimbal_pitch_deg),
+                _canonical(item.gimbal_yaw_deg),
+                item.camera_action.value,
+                _canonical(item.loiter_time_s),
+                _canonical(item.camera_photo_interval_s),
+                _canonical(item.acceptance_radius_m),
+                _canonical(item.yaw_deg),
+                _canonical(item.camera_photo_distance_m),
+            )
+        )
+    return digest.hexdigest()
+
+
+def mission_items(
+    waypoints: npt.NDArray[np.float64], speed: float, acceptance_radius: float
+) -> list[MissionItem]:
+    """
+    Converts waypoints to fly-through mission items in one pass, however many there are
+
+    Parameters
+    ----------
+    waypoints : NDArray[float64]
+        Array of shape (N, 3) holding the latitude and longitude in degrees and the
+        altitude above home in meters of every waypoint
+    speed : float
+        The horizontal speed in m/s to fly to each waypoint at
+    acceptance_radius : float
+        Meters from each waypoint that count as reaching it
+
+    Returns
+    -------
+    items : list[MissionItem]
+        One mission item per waypoint, in order
+    """
+    nan: float = float("nan")
+    no_action: MissionItem.CameraAction = MissionItem.CameraAction.NONE
+    return [
+        MissionItem(
+            latitude,
+            longitude,
+            altitude,
+            speed,
+            True,
+            nan,
+            nan,
+            no_action,
+            nan,
+            nan,
+            acceptance_radius,
+            0,
+            0,
+        )
+        for latitude, longitude, altitude in waypoints.tolist()
+    ]
 
 
-async def upload_mission(competition: bool) -> None:
+async def search_items(
+    competition: bool,
+    swath: float,
+    altitude: float,
+    start: tuple[float, float],
+    finish: tuple[float, float],
+) -> list[MissionItem]:
     """
-    Connects to the drone and uploads the mission plan for landing the drone.
+    Plans a boustrophedon search of the field, inside its geofence and away from its
+    keep-out zones by the geofence margin, the acceptance radius of the waypoints and
+    the overshoot of the turns
 
     Parameters
     ----------
     competition : bool
-        Decides if competition waypoints are used in the mission or not.
+        Decides if the competition field is searched or the golf course.
+    swath : float
+        Width in meters of the ground the camera sees across the path
+    altitude : float
+        Altitude of the search above home in meters
+    start : tuple[float, float]
+        Latitude and longitude in degrees the drone starts the search from
+    finish : tuple[float, float]
+        Latitude and longitude in degrees the drone flies to after the search
+
+    Returns
+    -------
+    items : list[MissionItem]
+        The mission items of the search
+
+    Raises
+    ------
+    GeofenceError
+        If the geofence leaves nothing to search or a leg of the search breaches it
     """
+    fence: geofence.Geofence = await geofence.load_geofence(geofence.geofence_path(competition))
+    if not fence.enforced:
+        logging.warning("Searching inside a geofence that is not enforced, so not surveyed")
+    # Waypoints are only passed within the acceptance radius and turns swing out past
+    # them, so the search keeps that much further from every boundary than the margin
+    area: BaseGeometry = fence.allowed_area(SEARCH_ACCEPTANCE_RADIUS + SEARCH_TURN_OVERSHOOT)
+    if area.is_empty:
+        raise geofence.GeofenceError("The geofence leaves no area to search")
+    # Getting into the search and on to the target also goes around the keep-out zones
+    path: npt.NDArray[np.float64] = coverage.remove_collinear(
+        coverage.coverage_path(
+            area,
+            swath,
+            start=fence.frame.to_enu(*start)[:2],
+            finish=fence.frame.to_enu(*finish)[:2],
+        )
+    )
+    breach: Optional[str] = fence.check_path(path)
+    if breach is not None:
+        raise geofence.GeofenceError(f"The search breaches the geofence: {breach}")
+    waypoints: npt.NDArray[np.float64] = coverage.path_waypoints(path, fence.frame, altitude)
+    logging.info(f"Search of the field: {len(waypoints)} waypoints, {swath:.1f} m swath")
+    return mission_items(waypoints, SEARCH_SPEED, SEARCH_ACCEPTANCE_RADIUS)
 
-    waypoint_path: str
-    if competition:
-        waypoint_path = "flight/data/target_data.json"
-    else:
-        waypoint_path = "flight/data/golf_target.json"
-
-    drone = System()
-    await drone.connect(system_address="udp://:14540")
-
-    logging.info("Waiting for drone to connect...")
-    async for state in drone.core.connection_state():
-        if state.is_connected:
-            logging.info("Drone discovered!")
-            break
-
-    logging.info("Getting target location and ground altitude for landing...")
-    target_data: intake_gps.Waypoint
-    ground_altitude: float
-    target_data, ground_altitude = await intake_gps.extract_gps(waypoint_path)
-    logging.info(f"Target Location: {target_data}")
-    logging.info(f"Altitude: {ground_altitude}")
-    target_latitude = target_data[0]
-    target_longitude = target_data[1]
 
+def transfer_bytes(items: int) -> int:
+    """
+    Returns the approximate bytes sent over the link to upload or download a mission
+
+    Parameters
+    ----------
+    items : int
+        The number of mission items transferred
+
+    Returns
+    -------
+    size : int
+        Bytes of every message of the transfer, both directions
+    """
+    return (
+        MISSION_COUNT_BYTES
+        + items * (MISSION_REQUEST_BYTES + MISSION_ITEM_BYTES)
+        + MISSION_ACK_BYTES
+    )
+
+
+async def sync_mission(drone: System, mission_plan: MissionPlan) -> bool:
+    """
+    Makes sure a mission plan is on the vehicle, clearing and uploading only if the
+    plan on the vehicle is different
+
+    Parameters
+    ----------
+    drone : System
+        The shared, already connected drone object.
+    mission_plan : MissionPlan
+        The plan the vehicle must have
+
+    Returns
+    -------
+    uploaded : bool
+        Whether the plan had to be uploaded
+
+    Raises
+    ------
+    ValueError
+        If the plan has more items than the mission protocol can transfer
+    """
+    if len(mission_plan.mission_items) > MAX_MISSION_ITEMS:
+        raise ValueError(
+            f"The mission has {len(mission_plan.mission_items)} items, "
+            f"at most {MAX_MISSION_ITEMS} can be uploaded"
+        )
+    plan_hash: str = mission_hash(mission_plan)
+    if _VEHICLE_PLANS.get(drone) == plan_hash:
+        logging.info("Mission already uploaded, transferred 0 items (0 bytes)")
+        return False
+
+    downloaded_items: int = 0
+    try:
+        on_vehicle: MissionPlan = await drone.mission.download_mission()
+        downloaded_items = len(on_vehicle.mission_items)
+        if mission_hash(on_vehicle) == plan_hash:
+            _VEHICLE_PLANS[drone] = plan_hash
+            logging.info(
+                "Mission on the vehicle matches, downloaded %d items (%d bytes), uploaded none",
+                downloaded_items,
+                transfer_bytes(downloaded_items),
+            )
+            return False
+    except MissionError:
+        logging.debug("Could not download the mission on the vehicle, uploading it")
+
+    _VEHICLE_PLANS.pop(drone, None)
     # Clear mission on drone if there is one
-    await drone.mission.clear_mission()
+    await commands.send(
+        drone, "clear_mission", drone.mission.clear_mission, priority=commands.ROUTINE
+    )
+
+    # The whole plan goes over in a single mission transfer, however many items it has
+    logging.info("Uploading mission...")
+    items: int = len(mission_plan.mission_items)
+    await commands.send(
+        drone,
+        "upload_mission",
+        functools.partial(drone.mission.upload_mission, mission_plan),
+        items,
+        priority=commands.ROUTINE,
+    )
+    _VEHICLE_PLANS[drone] = plan_hash
+    logging.info(
+        "Downloaded %d items (%d bytes), uploaded %d items (%d bytes)",
+        downloaded_items,
+        transfer_bytes(downloaded_items),
+        items,
+        MISSION_CLEAR_BYTES + MISSION_ACK_BYTES + transfer_bytes(items),
+    )
+    return True
+
+
+async def upload_mission(
+    drone: System,
+    competition: bool,
+    targets: Optional[intake_gps.TargetData] = None,
+    search_swath: Optional[float] = None,
+) -> None:
+    """
+    Uploads the mission plan for landing the drone.
+
+    Parameters
+    ----------
+    drone : System
+        The shared, already connected drone object.
+    competition : bool
+        Decides if competition waypoints are used in the mission or not.
+    targets : Optional[TargetData]
+        The already loaded targets, loaded from the competition or golf course file if None.
+    search_swath : Optional[float]
+        Swath in meters of a search of the field flown before going to the target, or
+        None to fly straight to the target.
+    """
+
+    await telemetry_rates.enter_phase(drone, "upload")
+    if targets is None:
+        logging.info("Getting target location and ground altitude for landing...")
+        targets = await intake_gps.load_targets(intake_gps.target_path(competition))
+    target_data: intake_gps.Waypoint = targets.target
+    logging.info(f"Target Location: {targets.primary} {target_data}")
+    logging.info(f"Ground altitude: {targets.ground_altitude:.1f} m AMSL")
+    target_latitude = target_data.latitude
+    target_longitude = target_data.longitude
+
+    # Home is rarely at the height of the ground under the target
+    home: Position = await get_hub(drone).wait_latest("home")
+    ground: terrain.Terrain = await terrain.load_terrain(
+        terrain.terrain_path(competition), targets.ground_altitude, home
+    )
+    ground_offset: float = ground.relative_elevation(target_latitude, target_longitude)
+    if abs(ground_offset) > MAX_GROUND_OFFSET:
+        logging.warning(
+            f"Ground under the target {ground_offset:+.1f} m from home is implausible, "
+            f"limited to {MAX_GROUND_OFFSET:.0f} m"
+        )
+        ground_offset = math.copysign(MAX_GROUND_OFFSET, ground_offset)
+    logging.info(f"Ground under the target: {ground_offset:+.1f} m from home")
 
     # Create the mission plan
-    # 122m = 400 ft
-    speed_limit_point = MissionItem(
-        target_latitude,
-        target_longitude,
-        122,
-        20,
-        True,
-        float("nan"),
-        float("nan"),
-        MissionItem.CameraAction.NONE,
-        float("nan"),
-        float("nan"),
+    speed_limit_point: list[MissionItem] = mission_items(
+        np.array([[target_latitude, target_longitude, TRANSIT_ALTITUDE + ground_offset]]),
+        TRANSIT_SPEED,
         0.001,
-        0,
-        0,
     )
 
     # Activate speed limit
-    above_target_point = MissionItem(
-        target_latitude,
-        target_longitude,
-        50,
-        6,
-        True,
-        float("nan"),
-        float("nan"),
-        MissionItem.CameraAction.NONE,
-        float("nan"),
-        float("nan"),
+    above_target_point: list[MissionItem] = mission_items(
+        np.array([[target_latitude, target_longitude, APPROACH_ALTITUDE + ground_offset]]),
+        APPROACH_SPEED,
         0.0001,
-        0,
-        0,
     )
 
-    landing_mission = MissionPlan([speed_limit_point, above_target_point])
+    search: list[MissionItem] = []
+    if search_swath is not None:
+        position: Position = await get_hub(drone).wait_latest("position")
+        search = await search_items(
+            competition,
+            search_swath,
+            SEARCH_ALTITUDE + ground_offset,
+            (position.latitude_deg, position.longitude_deg),
+            (target_latitude, target_longitude),
+        )
 
-    logging.info("Uploading mission...")
-    await drone.mission.upload_mission(landing_mission)
+    landing_mission = MissionPlan(search + speed_limit_point + above_target_point)
+
+    await sync_mission(drone, landing_mission)
+
+
+async def main(competition: bool, search_swath: Optional[float], address: str = SIM_ADDR) -> None:
+    """
+    Connects to the simulator and uploads the mission plan on its own.
+
+    Parameters
+    ----------
+    competition : bool
+        Decides if competition waypoints are used in the mission or not.
+    search_swath : Optional[float]
+        Swath in meters of a search of the field before the target, or None for no search.
+    address : str
+        The system address of the simulator to connect to.
+    """
+    drone: System = await connection.get_drone(address)
+    await upload_mission(drone, competition, search_swath=search_swath)
 
 
 if __name__ == "__main__":
     """
-    Uploads a mission plan to QGroundControl for the drone to land at a target.
-    This is run by python3 upload_mission.py -file {json file path}.
-    If no file path is specified it will use the default target data file path.
+    Uploads a mission plan to the simulated drone for it to land at a target.
+    This is run by python3 -m flight.upload_mission [-c] [-s SWATH] [-o].
+    If -c is not given it will use the golf course target data file.
+    -o uses the built-in offline simulator.
     """
-    # Read file to be used as the data file using the -file argument
     parser: argparse.ArgumentParser = argparse.ArgumentParser()
-    parser.add_argument("-file")
+    parser.add_argument(
+        "-c", "--competition", help="Using the competition waypoints", action="store_true"
+    )
+    parser.add_argument(
+        "-s",
+        "--search",
+        help="Search the field in lines this many meters apart before the target",
+        type=float,
+        metavar="SWATH",
+    )
+    parser.add_argument(
+        "-o",
+        "--offline",
+        help="Using the built-in offline simulator, faster than real time",
+        action="store_true",
+    )
     args: argparse.Namespace = parser.parse_args()
-
-    # Use default target data if no file is specified
-    DATA_PATH = vars(args)["file"]
-    if DATA_PATH is None:
-        DATA_PATH = "flight/data/target_data.json"
-    asyncio.run(upload_mission(DATA_PATH))
+    if args.offline:
+        clock.run(main(args.competition, args.search, OFFLINE_ADDR))
+    else:
+        asyncio.run(main(args.competition, args.search))
@@ -0,0 +1,84 @@
+"""
+Event loop watchdog. Measures how late the loop wakes up a periodic timer, which is
+how long the loop was blocked, into a metrics histogram, and watches the telemetry streams
+the flight depends on. A blocked loop or stalled telemetry is logged as an alert,
+and a stall that lasts too long triggers a failsafe.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from flight import logger, metrics
+from flight.telemetry_hub import StreamStats, TelemetryHub
+
+CHECK_INTERVAL: float = 0.1  # Seconds between checks
+LAG_ALERT: float = 0.1  # Seconds of loop lag logged as an alert
+STALL_ALERT: float = 1.0  # Seconds without a sample before a stream counts as stalled
+STALL_FAILSAFE: float = 3.0  # Seconds a stall may last before the failsafe is triggered
+WATCHED_STREAMS: tuple[str, ...] = ("position",)  # Streams the landing controller needs
+LAG_METRIC: str = "event_loop_lag_seconds"  # Name of the exported lag histogram
+
+
+class LoopWatchdog:
+    """
+    Watches event loop lag and telemetry staleness for as long as run() runs.
+
+    Attributes
+    ----------
+    histogram : Histogram
+        The loop lag measured so far, exported as LAG_METRIC labelled with the vehicle.
+    stalls : int
+        The number of stalls alerted.
+    """
+
+    def __init__(
+        self,
+        hub: TelemetryHub,
+        failsafe: Optional[Callable[[], Awaitable[None]]] = None,
+        streams: tuple[str, ...] = WATCHED_STREAMS,
+    ) -> None:
+        self.histogram: metrics.Histogram = metrics.Histogram(
+            LAG_METRIC,
+            "Seconds the event loop woke a watchdog timer late",
+            (("vehicle", logger.VEHICLE.get()),),
+        )
+        metrics.register(self.histogram)
+        self.stalls: int = 0
+        self._hub: TelemetryHub = hub
+        self._failsafe: Optional[Callable[[], Awaitable[None]]] = failsafe
+        self._streams: tuple[str, ...] = streams
+
+    async def run(self) -> None:
+        """
+        Checks the loop and the telemetry every CHECK_INTERVAL seconds. Returns only
+        after triggering the failsafe, so a supervisor can end the flight then.
+        """
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        started: float = loop.time()
+        stalled_since: dict[str, float] = {}
+        expected: float = started + CHECK_INTERVAL
+        while True:
+            await asyncio.sleep(expected - loop.time())
+            now: float = loop.time()
+            lag: float = max(0.0, now - expected)
+            self.histogram.record(lag)
+            if lag >= LAG_ALERT:
+                logging.warning("Event loop was blocked for %.3f s", lag)
+            expected = now + CHECK_INTERVAL
+
+            for name in self._streams:
+                stats: StreamStats = self._hub.stats(name)
+                # A stream that never delivered has been stalled since watching started
+                age: float = stats.age_s if stats.samples else now - started
+                if age < STALL_ALERT:
+                    if stalled_since.pop(name, None) is not None:
+                        logging.info("Telemetry stream %s recovered", name)
+                    continue
+                if name not in stalled_since:
+                    stalled_since[name] = now
+                    self.stalls += 1
+                    logging.error("Telemetry stream %s stalled, no sample for %.1f s", name, age)
+                elif now - stalled_since[name] >= STALL_FAILSAFE and self._failsafe is not None:
+                    logging.critical("Telemetry stream %s stalled for %.1f s, failsafe", name, age)
+                    await self._failsafe()
+                    return
@@ -1,47 +1,127 @@
 """Main runnable file for the codebase"""
 
 import argparse
+import concurrent.futures
+import functools
+import itertools
 import logging
 import asyncio
-from multiprocessing import Queue
-from flight import logger, upload_mission, run_mission
+import os
+import queue
+from datetime import datetime
+from typing import Any, Coroutine, Iterator, Optional
+from flight import (
+    commands,
+    fleet,
+    geofence,
+    intake_gps,
+    logger,
+    metrics,
+    upload_mission,
+    run_mission,
+    connection,
+    recorder,
+    supervisor,
+    telemetry_hub,
+    telemetry_rates,
+    watchdog,
+)
+from flight.sim import clock
+from flight.sim.system import is_simulated
 import flight.config as config
 from mavsdk import System
 from flight.flight import (
-    wait_for_drone,
     log_flight_mode,
     observe_is_in_air,
-    check_for_exit,
     DroneNotFoundError,
 )
 
 SIM_ADDR: str = "udp://:14540"  # Address to connect to the simulator
 CONTROLLER_ADDR: str = "serial:///dev/ttyUSB0"  # Address to connect to a pixhawk board
+OFFLINE_ADDR: str = "sim://"  # Address of the built-in offline simulator
+# Binary flight data recording of each vehicle
+FLIGHT_RECORD_FILE: str = "logs/{time:%Y-%m-%d_%H-%M-%S}_{vehicle}.fdr"
 
 
-async def init_and_begin(simulation: bool, competition: bool) -> None:
+def drone_address(simulation: bool, offline: bool = False) -> str:
     """
-    Creates drone object and passes it to start_flight
+    Returns the address of the single drone flown without a fleet
 
     Parameters
     ----------
     simulation: bool
-        When true, run with simulation connection address, otherwise use physical drone connection address
+        Decides whether to use the simulation address or not
+    offline: bool
+        Decides whether to use the offline simulator instead of any other address
+
+    Returns
+    -------
+    address: str
+        MAVSDK system address of the drone
+    """
+    if offline:
+        return OFFLINE_ADDR
+    return SIM_ADDR if simulation else CONTROLLER_ADDR
+
+
+async def init_and_begin(
+    vehicles: list[fleet.Vehicle], competition: bool, metrics_port: Optional[int] = None
+) -> None:
+    """
+    Flies every vehicle concurrently, each in its own task, until all of them are done
+
+    Parameters
+    ----------
+    vehicles: list[Vehicle]
+        The vehicles to fly, a single one outside of a fleet
     competition: bool
         Decides whether to use competition waypoints or not
+    metrics_port: Optional[int]
+        Port to serve the metrics on during the flight for Prometheus, or None
     """
+    server: Optional[asyncio.AbstractServer] = None
     try:
-        drone: System = await init_drone(simulation)
-        await start_flight(drone, competition)
+        if metrics_port is not None:
+            server = await metrics.serve(metrics_port)
+        # Every flight catches its own errors, so one vehicle failing never stops the others
+        await asyncio.gather(*(fly_vehicle(vehicle, competition) for vehicle in vehicles))
+    except:
+        logging.exception("Uncaught error occurred")
+        return
+    finally:
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+
+
+async def fly_vehicle(vehicle: fleet.Vehicle, competition: bool) -> None:
+    """
+    Connects to one vehicle and passes it to start_flight. Must run in a task of its own,
+    as it sets the vehicle that the logs of the task are tagged with.
+
+    Parameters
+    ----------
+    vehicle: Vehicle
+        The vehicle to fly
+    competition: bool
+        Decides whether to use competition waypoints or not
+    """
+    logger.VEHICLE.set(vehicle.name)
+    try:
+        drone: System = await init_drone(vehicle.address, vehicle.server_port)
+        await start_flight(drone, competition, vehicle.target_file, vehicle.search_swath)
     except DroneNotFoundError:
         logging.exception("Drone was not found")
-        return
     except:
         logging.exception("Uncaught error occurred")
-        return
 
 
-async def start_flight(drone: System, competition: bool) -> None:
+async def start_flight(
+    drone: System,
+    competition: bool,
+    target_file: Optional[str] = None,
+    search_swath: Optional[float] = None,
+) -> None:
     """
     Starts the flight process and runs upload_mission and run_mission
 
@@ -51,70 +131,335 @@ async def start_flight(drone: System, competition: bool) -> None:
         Drone object to control the drone
     competition: bool
         Decides whether to use competition waypoints or not
+    target_file: Optional[str]
+        Target data file to fly to, the one of the competition or golf course if None
+    search_swath: Optional[float]
+        Swath in meters of a search of the field flown first, or None to fly straight
+        to the target
     """
-    # Run config params in config file
-    await config.config_params(drone)
+    # A broken geofence file stops the flight before anything is started
+    fence_path: str = geofence.geofence_path(competition)
+    fence: geofence.Geofence = await geofence.load_geofence(fence_path)
+    if not fence.enforced:
+        logging.warning("Geofence %s is not enforced, breaches are only logged", fence_path)
 
-    log_queue: Queue[str] = Queue(-1)
-    logger.worker_configurer(log_queue)
-    logging.debug("Flight process started")
+    # Open the shared telemetry subscriptions once for every stage
+    hub: telemetry_hub.TelemetryHub = telemetry_hub.get_hub(drone)
 
-    # Continuously log flight mode changes
-    asyncio.ensure_future(log_flight_mode(drone))
-    # Will stop flight code if the drone lands
-    asyncio.ensure_future(observe_is_in_air(drone))
-    # Handles CTRL-C / interrupts
-    asyncio.ensure_future(check_for_exit())
+    # Flying blind on stale telemetry is worse than hovering in place
+    loop_watchdog: watchdog.LoopWatchdog = watchdog.LoopWatchdog(
+        hub, functools.partial(hold_position, drone)
+    )
+    # Leaving the field is stopped the same way
+    fence_monitor: geofence.GeofenceMonitor = geofence.GeofenceMonitor(
+        fence, functools.partial(hold_position, drone)
+    )
 
+    # Every path from here on reaches stop_recording, so the recording is always closed
+    recorder.start_recording(
+        drone, hub, FLIGHT_RECORD_FILE.format(time=datetime.now(), vehicle=logger.VEHICLE.get())
+    )
     try:
-        logging.debug("Running upload_mission")
-        await upload_mission.upload_mission(competition)
-        logging.debug("Running run_mission")
-        await run_mission.run_mission(competition)
+        # Run config params in config file
+        await config.config_params(drone)
+
+        logging.debug("Flight process started")
+
+        # The flight ends when the mission finishes, the drone lands, the watchdog or the
+        # geofence triggers its failsafe, a task fails or on Ctrl-C, cancelling everything else
+        async with supervisor.Supervisor() as flight:
+            # Continuously log flight mode changes
+            flight.start(log_flight_mode(drone), "log_flight_mode")
+            flight.start(observe_is_in_air(drone), "observe_is_in_air", ends_flight=True)
+            flight.start(loop_watchdog.run(), "watchdog", ends_flight=True)
+            flight.start(fence_monitor.run(hub), "geofence", ends_flight=True)
+            flight.start(
+                fly_mission(drone, competition, target_file, search_swath),
+                "mission",
+                ends_flight=True,
+            )
+        if flight.interrupted:
+            await hold_position(drone)
     except:
         logging.exception("Exception in flight process occurred")
+    finally:
+        logging.info("Event loop lag: %s", loop_watchdog.histogram.summary())
+        logging.info(
+            "Geofence: %d samples checked, %d breaching",
+            fence_monitor.checks,
+            fence_monitor.breaches,
+        )
+        await recorder.stop_recording(drone)
 
 
-async def init_drone(simulation: bool) -> System:
+async def fly_mission(
+    drone: System,
+    competition: bool,
+    target_file: Optional[str] = None,
+    search_swath: Optional[float] = None,
+) -> None:
     """
-    Creates drone object depending on address and returns it
+    Uploads and runs the mission
 
     Parameters
     ----------
-    simulation: bool
-        Decides whether to use the simulation address or not
+    drone: System
+        Drone object to control the drone
+    competition: bool
+        Decides whether to use competition waypoints or not
+    target_file: Optional[str]
+        Target data file to fly to, the one of the competition or golf course if None
+    search_swath: Optional[float]
+        Swath in meters of a search of the field flown first, or None to fly straight
+        to the target
+    """
+    # Both stages fly to the same targets, loaded once
+    targets: intake_gps.TargetData = await intake_gps.load_targets(
+        target_file or intake_gps.target_path(competition)
+    )
+    try:
+        logging.debug("Running upload_mission")
+        await upload_mission.upload_mission(drone, competition, targets, search_swath)
+        logging.debug("Running run_mission")
+        await run_mission.run_mission(drone, competition, targets)
+    except commands.CommandRejectedError as ex:
+        # A failsafe took over the drone, which ends the flight rather than failing it
+        logging.warning("Mission stopped: %s", ex)
+
+
+async def hold_position(drone: System) -> None:
+    """
+    Stops the drone where it is, ending offboard control or the mission
+
+    Parameters
+    ----------
+    drone: System
+        Drone object to control the drone
+    """
+    logging.warning("Holding position")
+    await commands.send(drone, "hold", drone.action.hold, priority=commands.FAILSAFE)
+
+
+async def init_drone(sys_addr: str, server_port: Optional[int] = None) -> System:
+    """
+    Connects to the drone on an address and returns the shared drone object
+
+    Parameters
+    ----------
+    sys_addr: str
+        MAVSDK system address of the drone
+    server_port: Optional[int]
+        gRPC port of the mavsdk_server of the drone, or None for the next free one
 
     Returns
     -------
     drone: System
         Drone object in MAVSDK of the drone
     """
-    # Connect to drone with either sim or controller address depending on simulation boolean
-    sys_addr: str = SIM_ADDR if simulation else CONTROLLER_ADDR
-    drone: System = System()
-    await drone.connect(system_address=sys_addr)
-    logging.debug("Waiting for drone to connect...")
-    try:
-        await asyncio.wait_for(wait_for_drone(drone), timeout=5)
-    except asyncio.TimeoutError:
-        raise DroneNotFoundError()
+    drone: System = await connection.get_drone(sys_addr, server_port)
+    await telemetry_rates.enter_phase(drone, "connect")
+    logging.debug("Time to connected: %.3f s", connection.MANAGER.stats(sys_addr).time_to_connected)
     return drone
 
 
-if __name__ == "__main__":
-    logging.info(">> Starting landing process")
+def fly(
+    vehicles: list[fleet.Vehicle], competition: bool, metrics_port: Optional[int] = None
+) -> None:
+    """
+    Flies vehicles on one event loop, which runs on virtual time when they are all flown
+    by the offline simulator
+
+    Parameters
+    ----------
+    vehicles: list[Vehicle]
+        The vehicles to fly
+    competition: bool
+        Decides whether to use competition waypoints or not
+    metrics_port: Optional[int]
+        Port to serve the metrics on during the flight for Prometheus, or None
+    """
+    flights: Coroutine[Any, Any, None] = init_and_begin(vehicles, competition, metrics_port)
+    if all(is_simulated(vehicle.address) for vehicle in vehicles):
+        # The offline simulator runs on virtual time, jumping ahead whenever the code waits
+        clock.run(flights)
+    else:
+        asyncio.run(flights)
+
+
+def fly_group(
+    vehicles: list[fleet.Vehicle], competition: bool, metrics_file: Optional[str], group: int
+) -> None:
+    """
+    Flies a group of vehicles of a fleet in a worker process, writing the metrics of the
+    process next to metrics_file
+
+    Parameters
+    ----------
+    vehicles: list[Vehicle]
+        The vehicles of the group
+    competition: bool
+        Decides whether to use competition waypoints or not
+    metrics_file: Optional[str]
+        File the metrics of the whole run would go to, or None
+    group: int
+        Index of the group, which the metrics file of the process is numbered with
+    """
+    try:
+        fly(vehicles, competition)
+    finally:
+        if metrics_file is not None:
+            root, extension = os.path.splitext(metrics_file)
+            metrics.dump(f"{root}.{group}{extension}")
+
+
+def _init_worker(log_queue: "Optional[queue.Queue[logging.LogRecord]]", metrics_on: bool) -> None:
+    # A forked worker inherits the handlers of the parent, which only the parent may use
+    root: logging.Logger = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if log_queue is not None:
+        logger.worker_configurer(log_queue)
+    if metrics_on:
+        metrics.enable()
+
+
+def fly_in_processes(
+    vehicles: list[fleet.Vehicle], competition: bool, processes: int, metrics_file: Optional[str]
+) -> None:
+    """
+    Splits a fleet across worker processes, each flying its share of the vehicles on its
+    own event loop, for fleets whose control loops need more than one core. The workers
+    log through the queue of this process.
 
+    Parameters
+    ----------
+    vehicles: list[Vehicle]
+        The vehicles to fly
+    competition: bool
+        Decides whether to use competition waypoints or not
+    processes: int
+        Worker processes, no more than one per vehicle is started
+    metrics_file: Optional[str]
+        File the metrics would go to, each worker writes its own numbered one next to it
+    """
+    # Every worker has its own connection manager counting ports up from the same base,
+    # so the ports are handed out here, where every vehicle is known
+    taken: set[Optional[int]] = {vehicle.server_port for vehicle in vehicles}
+    ports: Iterator[int] = (
+        port for port in itertools.count(connection.BASE_SERVER_PORT) if port not in taken
+    )
+    vehicles = [
+        (
+            vehicle._replace(server_port=next(ports))
+            if vehicle.server_port is None and not is_simulated(vehicle.address)
+            else vehicle
+        )
+        for vehicle in vehicles
+    ]
+    groups: list[list[fleet.Vehicle]] = [
+        vehicles[start::processes] for start in range(min(processes, len(vehicles)))
+    ]
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=len(groups),
+        initializer=_init_worker,
+        initargs=(logger.shared_queue(), metrics.enabled()),
+    ) as pool:
+        futures: list[concurrent.futures.Future[None]] = [
+            pool.submit(fly_group, group, competition, metrics_file, index)
+            for index, group in enumerate(groups)
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+
+
+if __name__ == "__main__":
     # Parse through arguments, create competition and simulation variables.
     parser: argparse.ArgumentParser = argparse.ArgumentParser()
     parser.add_argument(
         "-c", "--competition", help="Using the competition waypoints", action="store_true"
     )
     parser.add_argument("-s", "--simulation", help="Using a simulator", action="store_true")
+    parser.add_argument(
+        "-o",
+        "--offline",
+        help="Using the built-in offline simulator, faster than real time",
+        action="store_true",
+    )
+    parser.add_argument("--json-logs", help="Write the log file as JSON lines", action="store_true")
+    parser.add_argument(
+        "--metrics", help="Write latency metrics to this file at the end of the flight"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, help="Serve latency metrics on this localhost port"
+    )
+    parser.add_argument(
+        "--fleet", help="Fly every vehicle of this fleet file at once, instead of -s and -o"
+    )
+    parser.add_argument(
+        "--offline-fleet",
+        type=int,
+        help="Fly this many vehicles at once on the built-in offline simulator",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=0,
+        help="Split the vehicles across this many processes, 0 to fly them on one event loop",
+    )
+    parser.add_argument(
+        "--search",
+        type=float,
+        metavar="SWATH",
+        help="Search the field with this swath in meters before flying to the target",
+    )
     args: argparse.Namespace = parser.parse_args()
+    if args.processes > 0 and args.metrics_port is not None:
+        parser.error("--metrics-port serves one process, it cannot be used with --processes")
+    if args.search is not None and not args.search > 0.0:
+        parser.error("--search must be a positive swath in meters")
+
+    vehicles: list[fleet.Vehicle]
+    try:
+        if args.fleet is not None:
+            vehicles = fleet.read_fleet(args.fleet)
+        elif args.offline_fleet is not None:
+            vehicles = fleet.simulated_fleet(args.offline_fleet)
+        else:
+            vehicles = [
+                fleet.Vehicle(fleet.DEFAULT_NAME, drone_address(args.simulation, args.offline))
+            ]
+    except (OSError, ValueError) as ex:
+        parser.error(str(ex))
+    if args.search is not None:
+        # A swath given in the fleet file wins over the one of the command line
+        vehicles = [
+            vehicle
+            if vehicle.search_swath is not None
+            else vehicle._replace(search_swath=args.search)
+            for vehicle in vehicles
+        ]
+
+    # Log records are written by a background thread, never by the event loop
+    logger.start_logging(args.json_logs, processes=args.processes > 0)
+    logging.info(">> Starting landing process")
     competition: bool = args.competition
     simulation: bool = args.simulation
+    offline: bool = args.offline
     logging.debug("Competition flag %s", "enabled" if competition else "disabled")
     logging.debug("Simulation flag %s", "enabled" if simulation else "disabled")
+    logging.debug("Offline flag %s", "enabled" if offline else "disabled")
+    logging.debug("Flying %d vehicles in %d processes", len(vehicles), max(args.processes, 1))
+    if args.metrics is not None or args.metrics_port is not None:
+        metrics.enable()
 
     """Starts the asyncronous event loop for the flight code"""
-    asyncio.run(init_and_begin(simulation, competition))
+    try:
+        if args.processes > 0:
+            fly_in_processes(vehicles, competition, args.processes, args.metrics)
+        else:
+            fly(vehicles, competition, args.metrics_port)
+    finally:
+        # Worker processes write their own metrics files
+        if args.metrics is not None and args.processes == 0:
+            metrics.dump(args.metrics)
+        logger.stop_logging()